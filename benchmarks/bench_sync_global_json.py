@@ -0,0 +1,366 @@
+"""Offline benchmark for sync_global_json.py
+
+Replaces ssh, scp and ssh-add with local shims (with configurable artificial
+latency) and the Node-RED webhook with a local HTTP server, then times pull,
+push, get_file_status and show_detailed_diff against synthetic global context
+files. Nothing leaves the machine.
+
+    python benchmarks/bench_sync_global_json.py --sizes 1K,1M,10M --iterations 5 --rtt 0.05
+
+The "remote" file lives in a temp directory; the shims run remote commands
+locally and copy files directly. A connection that goes through an open
+ControlMaster socket pays only --rtt, a fresh connection also pays --handshake.
+With --bandwidth every byte crossing the simulated link also costs time; compare
+compressed and raw transfers by running once with SYNC_COMPRESS=none.
+"""
+import argparse
+import http.server
+import importlib
+import json
+import os
+import random
+import shutil
+import statistics
+import sys
+import tempfile
+import threading
+import time
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+SIZE_UNITS = {'K': 1024, 'M': 1024 * 1024}
+
+# Shared by the ssh and scp shims: latency model and ControlMaster emulation
+SHIM_COMMON = r'''
+import hashlib, os, sys, time
+
+def control_socket(args):
+    """Return the emulated control socket path for -o ControlPath=... (or None)"""
+    host = next((a for a in args if '@' in a), '').split(':')[0]
+    for index, arg in enumerate(args):
+        if arg == '-o' and args[index + 1].startswith('ControlPath='):
+            path = args[index + 1].split('=', 1)[1]
+            return path.replace('%C', hashlib.sha1(host.encode()).hexdigest())
+    return None
+
+def connect(args):
+    """Sleep for one round trip, plus a handshake unless a master is open"""
+    socket = control_socket(args)
+    delay = float(os.environ.get('BENCH_RTT', '0'))
+    if not (socket and os.path.exists(socket)):
+        delay += float(os.environ.get('BENCH_HANDSHAKE', '0'))
+    time.sleep(delay)
+    return socket
+
+def transfer_delay(nbytes):
+    """Sleep for the time nbytes take at the simulated bandwidth"""
+    bandwidth = float(os.environ.get('BENCH_BANDWIDTH', '0'))
+    if bandwidth > 0:
+        time.sleep(nbytes / bandwidth)
+
+def positional(args, flags_with_value):
+    """Return positional arguments, skipping options and their values"""
+    result, index = [], 0
+    while index < len(args):
+        arg = args[index]
+        if arg in flags_with_value:
+            index += 2
+        elif arg.startswith('-'):
+            index += 1
+        else:
+            result.append(arg)
+            index += 1
+    return result
+'''
+
+SSH_SHIM = r'''
+args = sys.argv[1:]
+if '-O' in args:
+    # Control commands: "check" reports whether the master is alive and keeps it,
+    # "exit"/"stop" close it
+    socket = control_socket(args)
+    command = args[args.index('-O') + 1]
+    if command == 'check':
+        if socket and os.path.exists(socket):
+            print("Master running (pid=0)", file=sys.stderr)
+            sys.exit(0)
+        print(f"Control socket connect({socket}): No such file or directory", file=sys.stderr)
+        sys.exit(255)
+    if command in ('exit', 'stop') and socket and os.path.exists(socket):
+        os.unlink(socket)
+    sys.exit(0)
+
+socket = connect(args)
+if '-M' in args:
+    if socket:
+        open(socket, 'w').close()
+    sys.exit(0)
+
+rest = positional(args, {'-o', '-p', '-i', '-F', '-l', '-O'})
+if len(rest) < 2:
+    sys.exit(0)
+import subprocess, threading
+if not float(os.environ.get('BENCH_BANDWIDTH', '0')):
+    sys.exit(subprocess.run(['sh', '-c', ' '.join(rest[1:])]).returncode)
+
+# Relay stdin/stdout to count the bytes that would cross the link
+process = subprocess.Popen(['sh', '-c', ' '.join(rest[1:])], stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+sent = [0]
+
+def relay_stdin():
+    try:
+        for chunk in iter(lambda: sys.stdin.buffer.read1(65536), b''):
+            sent[0] += len(chunk)
+            process.stdin.write(chunk)
+        process.stdin.close()
+    except (OSError, ValueError):
+        pass
+
+threading.Thread(target=relay_stdin, daemon=True).start()
+received = 0
+for chunk in iter(lambda: process.stdout.read(65536), b''):
+    received += len(chunk)
+    sys.stdout.buffer.write(chunk)
+returncode = process.wait()
+transfer_delay(sent[0] + received)
+sys.exit(returncode)
+'''
+
+SCP_SHIM = r'''
+import shutil
+args = sys.argv[1:]
+connect(args)
+source, destination = [p.split(':', 1)[1] if '@' in p.split(':', 1)[0] else p
+                       for p in positional(args, {'-o', '-P', '-i', '-F'})]
+try:
+    shutil.copyfile(source, destination)
+except OSError as e:
+    print(e, file=sys.stderr)
+    sys.exit(1)
+transfer_delay(os.path.getsize(destination))
+'''
+
+SSH_ADD_SHIM = r'''
+print("256 SHA256:benchmark benchmark@localhost (ED25519)")
+'''
+
+class _WebhookHandler(http.server.BaseHTTPRequestHandler):
+    """Stand-in for the Node-RED set_global endpoint"""
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        body = b'{"status":"applied"}'
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+def parse_size(text):
+    """Parse sizes such as 512, 1K or 50M into bytes"""
+    text = text.strip().upper()
+    if text[-1] in SIZE_UNITS:
+        return int(float(text[:-1]) * SIZE_UNITS[text[-1]])
+    return int(text)
+
+def format_size(size):
+    """Format a byte count as K/M for report labels"""
+    for unit, factor in (('M', SIZE_UNITS['M']), ('K', SIZE_UNITS['K'])):
+        if size >= factor:
+            return f"{size / factor:g}{unit}"
+    return f"{size}B"
+
+def synthetic_context(target_size, seed=0):
+    """Build a global-context-like document of roughly target_size bytes"""
+    rng = random.Random(seed)
+    document = {
+        'pushoverTokens': {f"app_{i}": f"a{rng.getrandbits(120):030x}" for i in range(8)},
+        'TEXTBEE_CONFIG': {'apiKey': f"{rng.getrandbits(128):032x}", 'deviceId': 'bench'},
+        'user-whitelist': [],
+        'sensorMappings': {},
+    }
+    index = 0
+    while len(json.dumps(document, indent=2)) < target_size:
+        # Grow in batches so generation stays fast for the 50M case
+        for _ in range(max(1, target_size // 2000)):
+            document['user-whitelist'].append({'id': index, 'phone': f"+1555{index:07d}", 'name': f"user {index}"})
+            document['sensorMappings'][f"binary_sensor.bench_{index}"] = {
+                'area': rng.choice(['garage', 'kitchen', 'porch', 'office']),
+                'friendly_name': f"Sensor {index}",
+                'notify': rng.random() < 0.5,
+            }
+            index += 1
+    return document
+
+def write_json(path, document):
+    """Write a document the way the sync tool's users keep it (indented)"""
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(document, f, indent=2)
+
+def percentile(samples, fraction):
+    """Nearest-rank percentile of a list of samples"""
+    ordered = sorted(samples)
+    rank = max(0, min(len(ordered) - 1, int(round(fraction * len(ordered) + 0.5)) - 1))
+    return ordered[rank]
+
+def install_shims(bin_dir):
+    """Write the ssh, scp and ssh-add shims and put them first on PATH"""
+    os.makedirs(bin_dir, exist_ok=True)
+    for name, body in (('ssh', SHIM_COMMON + SSH_SHIM), ('scp', SHIM_COMMON + SCP_SHIM), ('ssh-add', SSH_ADD_SHIM)):
+        path = os.path.join(bin_dir, name)
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(f"#!{sys.executable}\n{body}")
+        os.chmod(path, 0o755)
+    os.environ['PATH'] = bin_dir + os.pathsep + os.environ.get('PATH', '')
+
+def start_webhook_server():
+    """Start the local webhook stand-in and return (server, url)"""
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), _WebhookHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}/set-global"
+
+def load_sync_module(workdir, webhook_url):
+    """Import sync_global_json configured against the benchmark workspace"""
+    os.environ.update({
+        'REMOTE_USER': 'bench',
+        'REMOTE_HOST': 'bench-host',
+        'REMOTE_PATH': os.path.join(workdir, 'remote', 'global.json'),
+        'LOCAL_PATH': os.path.join(workdir, 'local', 'global.json'),
+        'NODE-RED_GLOBAL_WEBHOOK': webhook_url,
+        'AUTH_SECRET': 'benchmark',
+        'SYNC_STATE_DIR': os.path.join(workdir, 'state'),
+        'SYNC_TARGETS_FILE': os.path.join(workdir, 'no-targets.json'),
+        'SYNC_PUSH_MODE': 'full',
+    })
+    os.makedirs(os.path.join(workdir, 'remote'), exist_ok=True)
+    os.makedirs(os.path.join(workdir, 'local'), exist_ok=True)
+
+    sys.path.insert(0, REPO_ROOT)
+    module = importlib.import_module('sync_global_json')
+    module.console.quiet = True
+    return module
+
+def run_benchmark(sync, sizes, iterations, warm):
+    """Time each phase for every size; returns {size: {phase: [seconds, ...]}}"""
+    local_file = os.environ['LOCAL_PATH']
+    remote_file = os.environ['REMOTE_PATH']
+    results = {}
+
+    for size in sizes:
+        base = synthetic_context(size)
+        changed = json.loads(json.dumps(base))
+        changed['pushoverTokens']['app_0'] = 'rotated-token'
+        changed['sensorMappings'].pop(next(iter(changed['sensorMappings']), None), None)
+        changed['user-whitelist'].append({'id': -1, 'phone': '+15550000000', 'name': 'new user'})
+
+        base_path = os.path.join(os.path.dirname(local_file), 'base.json')
+        changed_path = os.path.join(os.path.dirname(local_file), 'changed.json')
+        write_json(base_path, base)
+        write_json(changed_path, changed)
+
+        phases = {'pull': [], 'push': [], 'get_file_status': [], 'show_detailed_diff': []}
+
+        def reset():
+            # Local edit pending against an older remote copy
+            shutil.copyfile(changed_path, local_file)
+            shutil.copyfile(base_path, remote_file)
+            os.utime(remote_file, (time.time() - 60, time.time() - 60))
+            if not warm:
+                sync.invalidate_snapshot_cache()
+                sync.invalidate_pre_flight()
+
+        for _ in range(iterations):
+            reset()
+            started = time.perf_counter()
+            sync.get_file_status()
+            phases['get_file_status'].append(time.perf_counter() - started)
+
+            reset()
+            status_info = sync.get_file_status()
+            started = time.perf_counter()
+            sync.show_detailed_diff(status_info)
+            phases['show_detailed_diff'].append(time.perf_counter() - started)
+
+            reset()
+            started = time.perf_counter()
+            sync.push(assume_yes=True)
+            phases['push'].append(time.perf_counter() - started)
+
+            reset()
+            started = time.perf_counter()
+            sync.pull()
+            phases['pull'].append(time.perf_counter() - started)
+
+        results[size] = phases
+
+    return results
+
+def report(results, as_json):
+    """Print per-phase percentiles for every size"""
+    rows = []
+    for size, phases in results.items():
+        for phase, samples in phases.items():
+            rows.append({
+                'size': format_size(size),
+                'bytes': size,
+                'phase': phase,
+                'runs': len(samples),
+                'p50_ms': percentile(samples, 0.50) * 1000,
+                'p90_ms': percentile(samples, 0.90) * 1000,
+                'p99_ms': percentile(samples, 0.99) * 1000,
+                'mean_ms': statistics.mean(samples) * 1000,
+                'max_ms': max(samples) * 1000,
+            })
+
+    if as_json:
+        print(json.dumps(rows, indent=2))
+        return
+
+    header = f"{'size':>6}  {'phase':<20} {'runs':>4} {'p50 ms':>9} {'p90 ms':>9} {'p99 ms':>9} {'max ms':>9}"
+    print(header)
+    print("-" * len(header))
+    for row in rows:
+        print(f"{row['size']:>6}  {row['phase']:<20} {row['runs']:>4} "
+              f"{row['p50_ms']:>9.1f} {row['p90_ms']:>9.1f} {row['p99_ms']:>9.1f} {row['max_ms']:>9.1f}")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Offline benchmark for sync_global_json.py")
+    parser.add_argument("--sizes", default="1K,100K,1M,10M,50M",
+                        help="comma separated synthetic file sizes (default 1K,100K,1M,10M,50M)")
+    parser.add_argument("--iterations", type=int, default=5, help="runs per phase and size (default 5)")
+    parser.add_argument("--rtt", type=float, default=0.0, help="simulated round trip per ssh/scp call, seconds")
+    parser.add_argument("--handshake", type=float, default=0.0,
+                        help="extra simulated cost of a new (non-multiplexed) SSH connection, seconds")
+    parser.add_argument("--bandwidth", default="0",
+                        help="simulated link bandwidth in bytes per second, e.g. 1M (default 0 = unlimited)")
+    parser.add_argument("--warm", action="store_true", help="keep the session snapshot and pre-flight caches between runs")
+    parser.add_argument("--json", action="store_true", help="print results as JSON")
+    args = parser.parse_args(argv)
+
+    sizes = [parse_size(size) for size in args.sizes.split(",") if size.strip()]
+    workdir = tempfile.mkdtemp(prefix="nrsync-bench-")
+    os.environ['BENCH_RTT'] = str(args.rtt)
+    os.environ['BENCH_HANDSHAKE'] = str(args.handshake)
+    os.environ['BENCH_BANDWIDTH'] = str(parse_size(args.bandwidth))
+
+    server = None
+    try:
+        install_shims(os.path.join(workdir, 'bin'))
+        server, webhook_url = start_webhook_server()
+        sync = load_sync_module(workdir, webhook_url)
+        sync.run_pre_flight_checks()
+        results = run_benchmark(sync, sizes, args.iterations, args.warm)
+        report(results, args.json)
+    finally:
+        if server:
+            server.shutdown()
+        if 'sync_global_json' in sys.modules:
+            sys.modules['sync_global_json'].close_ssh_masters()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+if __name__ == "__main__":
+    main()
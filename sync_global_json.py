@@ -3,19 +3,83 @@ import sys
 import os
 import json
 import time
-import difflib
 import tempfile
-import requests
+import atexit
+import shutil
+import signal
+import re
+import shlex
+import fnmatch
+import posixpath
+import hashlib
+import random
+import itertools
+import argparse
+import functools
+import uuid
+import io
+from contextlib import contextmanager, redirect_stdout, redirect_stderr
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime
 from dotenv import load_dotenv
-from rich.console import Console
-from rich.panel import Panel
-from rich.text import Text
-from rich.prompt import Confirm
-from rich.syntax import Syntax
 
-# Initialize Rich console
-console = Console()
+# requests and rich are imported where they are first needed so scripted
+# subcommands (e.g. `status` from a git hook) start quickly
+
+class _LazyConsole:
+    """Rich console that is only imported and created on first use"""
+    def __init__(self):
+        object.__setattr__(self, '_console', None)
+    
+    def _get(self):
+        if self._console is None:
+            from rich.console import Console
+            object.__setattr__(self, '_console', Console())
+        return self._console
+    
+    def __getattr__(self, name):
+        return getattr(self._get(), name)
+    
+    def __setattr__(self, name, value):
+        setattr(self._get(), name, value)
+
+class _PlainConsole:
+    """Console stand-in for the plain/json output modes: uncoloured messages on stderr
+    
+    Results go to stdout separately, so stderr only carries diagnostics;
+    [INFO]/[SUCCESS] progress, command echoes and timing lines are shown
+    only when verbose.
+    """
+    _markup = re.compile(r"\[/?[a-z#@][^\[\]]*\]")
+    
+    def __init__(self, verbose=False):
+        self.quiet = False
+        self.verbose = verbose
+    
+    def print(self, *objects, style=None, **kwargs):
+        if self.quiet:
+            return
+        parts = []
+        for obj in objects:
+            # Text/Syntax carry their plain content; tables and panels are rich-only
+            text = obj if isinstance(obj, str) else getattr(obj, 'plain', None) or getattr(obj, 'code', None)
+            if text is not None:
+                parts.append(self._markup.sub("", text))
+        line = " ".join(parts)
+        if not self.verbose and (style == "dim" or line.strip().startswith(("[INFO]", "[SUCCESS]", "⏱"))):
+            return
+        if line.strip() or self.verbose:
+            print(line, file=sys.stderr)
+
+# Initialize Rich console (replaced by a _PlainConsole for --output plain/json)
+console = _LazyConsole()
+
+def confirm(question):
+    """Ask a yes/no question on the terminal"""
+    from rich.prompt import Confirm
+    
+    return Confirm.ask(question)
 
 # ==== CONFIGURATION ====
 # Load environment variables
@@ -25,17 +89,563 @@ remote_user = os.getenv("REMOTE_USER")
 remote_host = os.getenv("REMOTE_HOST")
 remote_path = os.getenv("REMOTE_PATH")
 local_path = os.getenv("LOCAL_PATH")
+
+# SSH connection multiplexing (one master connection shared by every ssh/scp call)
+ssh_multiplex = os.getenv("SSH_MULTIPLEX", "true").strip().lower() not in ("0", "false", "no", "off")
+ssh_control_persist = os.getenv("SSH_CONTROL_PERSIST", "600")
+
+# Push mode: "full" copies the whole file, "delta" posts only changed top-level keys
+push_mode = os.getenv("SYNC_PUSH_MODE", "full").strip().lower()
+delta_copy_file = os.getenv("SYNC_DELTA_COPY_FILE", "false").strip().lower() in ("1", "true", "yes", "on")
+
+# Compressed transfer: files of at least SYNC_COMPRESS_MIN_BYTES are streamed over
+# ssh through SYNC_COMPRESS (gzip, bzip2, xz or none); smaller files use plain scp
+compress_codec = os.getenv("SYNC_COMPRESS", "gzip").strip().lower()
+compress_level = int(os.getenv("SYNC_COMPRESS_LEVEL", "6"))
+compress_min_bytes = int(os.getenv("SYNC_COMPRESS_MIN_BYTES", str(64 * 1024)))
+
+# Maximum number of changes (or lines) shown by a detailed diff
+DIFF_MAX_LINES = 50
+
+# Local sync state (last-synced snapshot used as the delta base)
+sync_state_dir = os.getenv("SYNC_STATE_DIR") or os.path.join(os.path.dirname(os.path.abspath(__file__)), 'config', '.sync_state')
+
+# Version history of pulled/pushed files (SYNC_HISTORY_KEEP=0 turns it off;
+# SYNC_HISTORY_MAX_AGE_DAYS=0 keeps versions regardless of age)
+history_dir = os.getenv("SYNC_HISTORY_DIR") or os.path.join(sync_state_dir, 'history')
+history_keep = int(os.getenv("SYNC_HISTORY_KEEP", "500"))
+history_max_age_days = float(os.getenv("SYNC_HISTORY_MAX_AGE_DAYS", "0"))
+
+# Pulled files at least this large are validated with the streaming validator
+# instead of being parsed into memory (pushes always parse, the result is reused)
+stream_validate_bytes = int(os.getenv("SYNC_STREAM_VALIDATE_BYTES", str(16 * 1024 * 1024)))
+
+# Watch mode: quiet period after the last save before an automatic push
+watch_debounce = float(os.getenv("SYNC_WATCH_DEBOUNCE", "0.3"))
+
+# Fleet: extra Node-RED hosts (JSON list) synced alongside the REMOTE_* host
+targets_file = os.getenv("SYNC_TARGETS_FILE") or os.path.join(os.path.dirname(os.path.abspath(__file__)), 'config', 'targets.json')
+fleet_max_workers = int(os.getenv("SYNC_MAX_WORKERS", "4"))
+
+# Function-node scripts (`scripts` command): files of this repo matching
+# SCRIPTS_PATTERNS are mirrored under each target's SCRIPTS_REMOTE_DIR
+scripts_root = os.getenv("SCRIPTS_ROOT") or os.path.dirname(os.path.abspath(__file__))
+scripts_remote_dir = os.getenv("SCRIPTS_REMOTE_DIR")
+scripts_patterns = [pattern.strip() for pattern in os.getenv("SCRIPTS_PATTERNS", "*.js").split(",") if pattern.strip()]
+scripts_max_workers = int(os.getenv("SCRIPTS_MAX_WORKERS", "8"))
+
+# Global-key check on push: global.get/global.set calls in those scripts are
+# indexed (only changed files are rescanned) and compared with the outgoing
+# JSON. Keys matching SYNC_KEYS_IGNORE are provided elsewhere, e.g. modules
+# exposed through functionGlobalContext in settings.js.
+key_refs_check = os.getenv("SYNC_KEY_CHECK", "true").strip().lower() not in ("0", "false", "no", "off")
+key_index_path = os.getenv("SYNC_KEY_INDEX") or os.path.join(sync_state_dir, 'key_index.json')
+keys_ignore = [pattern.strip() for pattern in os.getenv("SYNC_KEYS_IGNORE", "axios,moment").split(",") if pattern.strip()]
+
+# Retry policy for ssh/scp calls: total attempts (1 = no retry; lower values count
+# as 1), per-attempt and total deadlines (seconds) and the backoff base/cap (full
+# jitter). Only transient failures are retried.
+retry_attempts = int(os.getenv("SYNC_RETRY_ATTEMPTS", "3"))
+retry_attempt_timeout = float(os.getenv("SYNC_ATTEMPT_TIMEOUT", "300"))
+retry_deadline = float(os.getenv("SYNC_RETRY_DEADLINE", "600"))
+retry_backoff = float(os.getenv("SYNC_RETRY_BACKOFF", "1"))
+retry_backoff_max = float(os.getenv("SYNC_RETRY_BACKOFF_MAX", "10"))
+
+# Circuit breaker: after this many consecutive connection failures a host is
+# failed fast for SYNC_BREAKER_COOLDOWN seconds (0 turns the breaker off)
+breaker_threshold = int(os.getenv("SYNC_BREAKER_THRESHOLD", "4"))
+breaker_cooldown = float(os.getenv("SYNC_BREAKER_COOLDOWN", "60"))
+
+# How targets are reached: ssh (system ssh/scp over a ControlMaster), sftp
+# (in-process paramiko session, optional dependency) or local (a path on this
+# machine). Targets in the targets file can override it with "transport".
+sync_transport = os.getenv("SYNC_TRANSPORT", "ssh").strip().lower()
+
+# Webhook delivery: retries on connection errors/5xx and apply confirmation
+# (WEBHOOK_CONFIRM: off, auto = confirm when the endpoint reports versions, required).
+# WEBHOOK_ATTEMPTS counts total attempts like SYNC_RETRY_ATTEMPTS (1 = no retry).
+webhook_attempts = int(os.getenv("WEBHOOK_ATTEMPTS", "3"))
+webhook_backoff = float(os.getenv("WEBHOOK_BACKOFF", "0.5"))
+webhook_confirm = os.getenv("WEBHOOK_CONFIRM", "auto").strip().lower()
+webhook_confirm_timeout = float(os.getenv("WEBHOOK_CONFIRM_TIMEOUT", "10"))
+
+# Per-run metrics (JSONL, one record per action); also settable with --metrics
+metrics_file = os.getenv("SYNC_METRICS_FILE")
+
+# Seconds a successful pre-flight check is reused within a session (0 = always check)
+preflight_ttl = float(os.getenv("PREFLIGHT_TTL", "300"))
+
+# Resident agent (`agent` command): control socket and background refresh interval.
+# status/diff/pull/push --yes are answered by a running agent unless SYNC_AGENT=off
+agent_socket = os.getenv("SYNC_AGENT_SOCKET") or os.path.join(sync_state_dir, 'agent.sock')
+agent_refresh = float(os.getenv("SYNC_AGENT_REFRESH", "30"))
+use_agent = os.getenv("SYNC_AGENT", "auto").strip().lower() not in ("0", "false", "no", "off")
 # =======================
 
-def validate_json_file(filepath):
-    """Validate JSON file syntax and structure"""
+# ==== METRICS ====
+# Spans time each phase of an action (pre-flight, key check, SSH test, remote
+# stat/fetch, compare, diff, scp, webhook and every retry attempt). A run
+# groups the spans of one top-level action into a single metrics record.
+_metrics_lock = threading.Lock()
+_metrics_context = threading.local()
+_current_run = None
+
+def start_run(action):
+    """Begin collecting spans for a top-level action"""
+    global _current_run
+    with _metrics_lock:
+        _current_run = {
+            'run_id': uuid.uuid4().hex[:12],
+            'action': action,
+            'started_at': datetime.now().isoformat(timespec='seconds'),
+            'started': time.monotonic(),
+            'spans': [],
+            'bytes_sent': 0,
+            'bytes_received': 0,
+            'retries': 0
+        }
+    return _current_run
+
+def _record_span(record):
+    with _metrics_lock:
+        if _current_run is not None:
+            _current_run['spans'].append(record)
+
+def add_transfer_bytes(sent=0, received=0):
+    """Count bytes moved over SSH or HTTP in the current run"""
+    with _metrics_lock:
+        if _current_run is not None:
+            _current_run['bytes_sent'] += sent
+            _current_run['bytes_received'] += received
+
+@contextmanager
+def span(name, **fields):
+    """Time a phase; the yielded dict can be annotated (e.g. record['ok'] = False)"""
+    record = {'name': name, **fields}
+    target_name = getattr(_metrics_context, 'target', None)
+    if target_name and 'target' not in record:
+        record['target'] = target_name
+    started = time.monotonic()
+    try:
+        yield record
+        record.setdefault('ok', True)
+    except BaseException as e:
+        record['ok'] = False
+        record['error'] = str(e) or type(e).__name__
+        raise
+    finally:
+        record['duration_ms'] = round((time.monotonic() - started) * 1000, 3)
+        _record_span(record)
+
+def timed(name):
+    """Decorator form of span(); a False or None return marks the span as failed"""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(name) as record:
+                result = func(*args, **kwargs)
+                record['ok'] = result is not False and result is not None
+                return result
+        return wrapper
+    return decorator
+
+def count_retry():
+    """Count one retry in the current run"""
+    with _metrics_lock:
+        if _current_run is not None:
+            _current_run['retries'] += 1
+
+def finish_run(outcome):
+    """Close the current run, print a timing summary and append it to the metrics file"""
+    global _current_run
+    with _metrics_lock:
+        run, _current_run = _current_run, None
+    if run is None:
+        return None
+    
+    run['duration_ms'] = round((time.monotonic() - run.pop('started')) * 1000, 3)
+    run['outcome'] = outcome
+    
+    top_level = {}
+    for record in run['spans']:
+        if not record['name'].endswith('.attempt'):
+            top_level[record['name']] = top_level.get(record['name'], 0) + record['duration_ms']
+    if top_level:
+        summary = " · ".join(f"{name} {ms / 1000:.2f}s" for name, ms in top_level.items())
+        console.print(f"⏱  {run['action']} {run['duration_ms'] / 1000:.2f}s ({summary})", style="dim")
+    
+    if metrics_file:
+        try:
+            with open(metrics_file, 'a', encoding='utf-8') as f:
+                f.write(json.dumps(run, default=str) + "\n")
+        except Exception as e:
+            console.print(f"[WARNING] Could not write metrics to {metrics_file}: {e}", style="yellow")
+    return run
+
+def run_action(action, func, *args, **kwargs):
+    """Run a top-level action as one metrics run and return its result"""
+    start_run(action)
+    outcome = 'error'
+    try:
+        result = func(*args, **kwargs)
+        outcome = 'failed' if result is False else 'success'
+        return result
+    finally:
+        finish_run(outcome)
+
+# Problems found while loading the targets file at import time; printed by
+# report_target_warnings once the console for the chosen output mode is set,
+# so --output json keeps stdout clean
+_target_warnings = []
+
+def load_targets():
+    """Build the target inventory from REMOTE_* settings and the optional targets file
+    
+    Each entry in the targets file is an object with name, user, host, path,
+    webhook, auth_secret, scripts_dir and transport; missing fields fall back
+    to the REMOTE_*, webhook, SCRIPTS_REMOTE_DIR and SYNC_TRANSPORT settings
+    from .env.
+    """
+    defaults = {
+        'name': os.getenv("REMOTE_NAME", "primary"),
+        'user': remote_user,
+        'host': remote_host,
+        'path': remote_path,
+        'webhook': os.getenv('NODE-RED_GLOBAL_WEBHOOK'),
+        'auth_secret': os.getenv('AUTH_SECRET'),
+        'scripts_dir': scripts_remote_dir,
+        'transport': sync_transport
+    }
+    
+    entries = []
+    if os.path.exists(targets_file):
+        try:
+            with open(targets_file, 'r', encoding='utf-8') as f:
+                entries = json.load(f)
+            if not isinstance(entries, list):
+                raise ValueError("expected a JSON list of targets")
+        except Exception as e:
+            _target_warnings.append(f"Ignoring targets file {targets_file}: {e}")
+            entries = []
+    
+    inventory = []
+    if remote_host or not entries:
+        inventory.append(dict(defaults))
+    
+    for entry in entries:
+        if not isinstance(entry, dict):
+            _target_warnings.append(f"Skipping targets file entry that is not an object: {entry!r}")
+            continue
+        target = dict(defaults)
+        target.update({key: value for key, value in entry.items() if value is not None})
+        if 'name' not in entry:
+            target['name'] = target['host']
+        if any(existing['name'] == target['name'] for existing in inventory):
+            _target_warnings.append(f"Skipping duplicate target name: {target['name']}")
+            continue
+        inventory.append(target)
+    
+    return inventory
+
+targets = load_targets()
+
+def report_target_warnings():
+    """Print (once) the problems found while loading the targets file"""
+    for message in _target_warnings:
+        console.print(f"[WARNING] {message}", style="yellow")
+    _target_warnings.clear()
+
+def primary_target():
+    """Return the target used by single-host actions"""
+    return targets[0]
+
+_ssh_control_dir = None
+_ssh_masters = set()
+_ssh_lock = threading.Lock()
+
+def remote_target(target=None):
+    """Return the user@host string for a target (default: the primary)"""
+    target = target or primary_target()
+    return f"{target['user']}@{target['host']}"
+
+def ssh_options(target=None):
+    """Return ssh/scp options that route traffic over the target's master connection"""
+    target = target or primary_target()
+    if target['name'] not in _ssh_masters:
+        return []
+    return [
+        "-o", "ControlMaster=no",
+        "-o", f"ControlPath={os.path.join(_ssh_control_dir, '%C')}",
+    ]
+
+def ssh_cmd(*remote_args, options=(), target=None):
+    """Build an ssh command line for running a command on a remote host"""
+    return ["ssh", *ssh_options(target), *options, remote_target(target), *remote_args]
+
+def scp_cmd(source, destination, target=None):
+    """Build an scp command line; remote paths are given as user@host:path"""
+    return ["scp", *ssh_options(target), source, destination]
+
+@timed('ssh_master')
+def open_ssh_master(target=None):
+    """Start a persistent ControlMaster connection reused by all later ssh/scp calls"""
+    global _ssh_control_dir
+    target = target or primary_target()
+    
+    if not ssh_multiplex:
+        return False
+    
+    with _ssh_lock:
+        if target['name'] in _ssh_masters:
+            return True
+        # One short directory holds every master socket (%C hashes user/host/port);
+        # Unix socket paths are length limited
+        if not _ssh_control_dir:
+            _ssh_control_dir = tempfile.mkdtemp(prefix="nrsync-")
+    
+    cmd = [
+        "ssh", "-M", "-N", "-f",
+        "-o", "ControlMaster=yes",
+        "-o", f"ControlPath={os.path.join(_ssh_control_dir, '%C')}",
+        "-o", f"ControlPersist={ssh_control_persist}",
+        "-o", "ConnectTimeout=5",
+        "-o", "BatchMode=yes",
+        remote_target(target)
+    ]
+    
+    try:
+        result = run_transport(cmd, target, timeout=15, capture_output=True, text=True)
+        if result.returncode == 0:
+            with _ssh_lock:
+                _ssh_masters.add(target['name'])
+            console.print(f"[SUCCESS] Shared SSH connection established ({target['name']})", style="green")
+            return True
+        console.print(f"[WARNING] Could not open shared SSH connection to {target['name']} (using direct connections): {result.stderr.strip()}", style="yellow")
+    except RetryableError:
+        console.print(f"[WARNING] Shared SSH connection timeout for {target['name']} (using direct connections)", style="yellow")
+    except Exception as e:
+        console.print(f"[WARNING] Shared SSH connection to {target['name']} failed (using direct connections): {e}", style="yellow")
+    return False
+
+def ensure_ssh_master(target=None):
+    """Reopen a target's master connection if it has gone away (e.g. after a network drop)"""
+    target = target or primary_target()
+    if target['name'] in _ssh_masters:
+        cmd = [
+            "ssh", "-O", "check",
+            "-o", f"ControlPath={os.path.join(_ssh_control_dir, '%C')}",
+            remote_target(target)
+        ]
+        try:
+            if subprocess.run(cmd, capture_output=True, text=True, timeout=5).returncode == 0:
+                return True
+        except Exception:
+            pass
+        with _ssh_lock:
+            _ssh_masters.discard(target['name'])
+    return open_ssh_master(target)
+
+def close_ssh_master(target):
+    """Shut down a target's shared master connection"""
+    with _ssh_lock:
+        if target['name'] not in _ssh_masters:
+            return
+        _ssh_masters.discard(target['name'])
+    cmd = [
+        "ssh", "-O", "exit",
+        "-o", f"ControlPath={os.path.join(_ssh_control_dir, '%C')}",
+        remote_target(target)
+    ]
+    try:
+        subprocess.run(cmd, capture_output=True, text=True, timeout=5)
+    except Exception:
+        pass  # ControlPersist still closes an orphaned master once it goes idle
+
+def close_ssh_masters():
+    """Shut down every shared master connection and remove the control sockets"""
+    global _ssh_control_dir
+    
+    for target in targets:
+        close_ssh_master(target)
+    
+    if _ssh_control_dir:
+        shutil.rmtree(_ssh_control_dir, ignore_errors=True)
+        _ssh_control_dir = None
+
+def _exit_on_signal(signum, frame):
+    """Turn termination signals into a normal exit so atexit cleanup runs"""
+    sys.exit(128 + signum)
+
+atexit.register(close_ssh_masters)
+
+# Token patterns for the streaming validator (strict JSON, as accepted by JSON.parse)
+_JSON_WHITESPACE = re.compile(r'[ \t\n\r]*')
+_JSON_STRING = re.compile(r'"(?:[^"\\\x00-\x1f]|\\(?:["\\/bfnrt]|u[0-9a-fA-F]{4}))*"')
+_JSON_STRING_PREFIX = re.compile(r'"(?:[^"\\\x00-\x1f]|\\(?:["\\/bfnrt]|u[0-9a-fA-F]{4}))*(?:\\(?:u[0-9a-fA-F]{0,3})?)?')
+_JSON_NUMBER = re.compile(r'-?(?:0|[1-9][0-9]*)(?:\.[0-9]+)?(?:[eE][+-]?[0-9]+)?')
+_JSON_NUMBER_CHARS = re.compile(r'[-+0-9.eE]*')
+_JSON_LITERALS = ('true', 'false', 'null')
+
+def stream_validate_json(filepath, chunk_size=1024 * 1024):
+    """Validate JSON syntax incrementally without building the document
+    
+    Reads the file in chunks and checks it with a token-level state machine,
+    so memory use stays bounded by the chunk size and nesting depth. Returns
+    None when the file is valid, otherwise (message, line, column) of the
+    first error.
+    """
+    buffer = ''
+    pos = 0
+    eof = False
+    line_base = 1       # line number at buffer[0]
+    column_base = 1     # column number at buffer[0]
+    stack = []
+    expect = 'value'
+    
+    def location(index):
+        newlines = buffer.count('\n', 0, index)
+        if newlines:
+            return line_base + newlines, index - buffer.rfind('\n', 0, index)
+        return line_base, column_base + index
+    
+    def after_value():
+        if not stack:
+            return 'end'
+        return 'object_next' if stack[-1] == '{' else 'array_next'
+    
+    with open(filepath, 'r', encoding='utf-8') as f:
+        while True:
+            need_more = False
+            pos = _JSON_WHITESPACE.match(buffer, pos).end()
+            
+            if pos == len(buffer):
+                if eof:
+                    if expect == 'end':
+                        return None
+                    return ("Unexpected end of file", *location(pos))
+                need_more = True
+            else:
+                char = buffer[pos]
+                
+                if expect == 'end':
+                    return ("Extra data", *location(pos))
+                
+                elif expect in ('value', 'array_first'):
+                    if expect == 'array_first' and char == ']':
+                        stack.pop()
+                        pos += 1
+                        expect = after_value()
+                    elif char == '{':
+                        stack.append('{')
+                        pos += 1
+                        expect = 'object_first'
+                    elif char == '[':
+                        stack.append('[')
+                        pos += 1
+                        expect = 'array_first'
+                    elif char == '"':
+                        match = _JSON_STRING.match(buffer, pos)
+                        if match:
+                            pos = match.end()
+                            expect = after_value()
+                        elif not eof and _JSON_STRING_PREFIX.match(buffer, pos).end() == len(buffer):
+                            need_more = True
+                        else:
+                            return ("Invalid string", *location(_JSON_STRING_PREFIX.match(buffer, pos).end()))
+                    elif char == '-' or char.isdigit():
+                        run_end = _JSON_NUMBER_CHARS.match(buffer, pos).end()
+                        if run_end == len(buffer) and not eof:
+                            need_more = True
+                        else:
+                            match = _JSON_NUMBER.match(buffer, pos)
+                            if not match or match.end() != run_end:
+                                return ("Invalid number", *location(pos))
+                            pos = run_end
+                            expect = after_value()
+                    else:
+                        for literal in _JSON_LITERALS:
+                            if buffer.startswith(literal, pos):
+                                pos += len(literal)
+                                expect = after_value()
+                                break
+                            if not eof and len(buffer) - pos < len(literal) and literal.startswith(buffer[pos:]):
+                                need_more = True
+                                break
+                        else:
+                            return ("Expecting value", *location(pos))
+                
+                elif expect in ('object_first', 'key'):
+                    if expect == 'object_first' and char == '}':
+                        stack.pop()
+                        pos += 1
+                        expect = after_value()
+                    elif char == '"':
+                        match = _JSON_STRING.match(buffer, pos)
+                        if match:
+                            pos = match.end()
+                            expect = 'colon'
+                        elif not eof and _JSON_STRING_PREFIX.match(buffer, pos).end() == len(buffer):
+                            need_more = True
+                        else:
+                            return ("Invalid string", *location(_JSON_STRING_PREFIX.match(buffer, pos).end()))
+                    else:
+                        return ("Expecting property name enclosed in double quotes", *location(pos))
+                
+                elif expect == 'colon':
+                    if char != ':':
+                        return ("Expecting ':' delimiter", *location(pos))
+                    pos += 1
+                    expect = 'value'
+                
+                else:  # object_next / array_next
+                    closer = '}' if expect == 'object_next' else ']'
+                    if char == ',':
+                        pos += 1
+                        expect = 'key' if expect == 'object_next' else 'value'
+                    elif char == closer:
+                        stack.pop()
+                        pos += 1
+                        expect = after_value()
+                    else:
+                        return ("Expecting ',' delimiter", *location(pos))
+            
+            if need_more:
+                # Drop the consumed prefix, keeping line/column bookkeeping in step
+                line_base, column_base = location(pos)
+                buffer = buffer[pos:]
+                pos = 0
+                chunk = f.read(chunk_size)
+                if chunk:
+                    buffer += chunk
+                else:
+                    eof = True
+
+@timed('validate')
+def validate_json_file(filepath, standalone=False):
+    """Validate JSON file syntax and structure
+    
+    The local file is parsed through the session snapshot, so push, status,
+    diff and delta computation reuse the same parsed document. Standalone
+    checks whose result is not parsed again (after a pull) use the slower
+    streaming validator for files of at least SYNC_STREAM_VALIDATE_BYTES to
+    keep memory flat.
+    """
     if not os.path.exists(filepath):
         console.print(f"[ERROR] File not found: {filepath}", style="red")
         return False
     
     try:
-        with open(filepath, 'r', encoding='utf-8') as f:
-            json.load(f)
+        if standalone and os.path.getsize(filepath) >= stream_validate_bytes:
+            error = stream_validate_json(filepath)
+            if error:
+                message, line, column = error
+                console.print(f"[ERROR] Invalid JSON in {os.path.basename(filepath)}: {message}: line {line} column {column}", style="red")
+                return False
+        elif local_path and os.path.abspath(filepath) == os.path.abspath(local_path):
+            snapshot_data(get_local_snapshot())
+        else:
+            with open(filepath, 'r', encoding='utf-8') as f:
+                json.load(f)
         console.print(f"[SUCCESS] JSON validation passed: {os.path.basename(filepath)}", style="green")
         return True
     except json.JSONDecodeError as e:
@@ -45,29 +655,20 @@ def validate_json_file(filepath):
         console.print(f"[ERROR] Failed to read file {os.path.basename(filepath)}: {e}", style="red")
         return False
 
-def test_ssh_connection():
-    """Test SSH connectivity to remote host"""
-    console.print("[INFO] Testing SSH connection...", style="blue")
+@timed('ssh_test')
+def test_connection(target=None):
+    """Test connectivity to the remote host through its transport"""
+    console.print("[INFO] Testing connection...", style="blue")
     
     try:
-        # Test basic SSH connection with shorter timeout
-        test_cmd = ["ssh", "-o", "ConnectTimeout=5", "-o", "BatchMode=yes", 
-                   f"{remote_user}@{remote_host}", "echo 'Connection successful'"]
-        result = subprocess.run(test_cmd, capture_output=True, text=True, timeout=8)
-        
-        if result.returncode == 0:
-            console.print("[SUCCESS] SSH connection test passed", style="green")
-            return True
-        else:
-            console.print(f"[WARNING] SSH connection failed (continuing anyway): {result.stderr.strip()}", style="yellow")
-            return True  # Don't block the whole script for SSH issues
-    except subprocess.TimeoutExpired:
-        console.print("[WARNING] SSH connection timeout (continuing anyway)", style="yellow")
-        return True  # Don't block the whole script for SSH issues
+        get_transport(target).check()
+        console.print("[SUCCESS] Connection test passed", style="green")
+        return True
     except Exception as e:
-        console.print(f"[WARNING] SSH test failed (continuing anyway): {e}", style="yellow")
-        return True  # Don't block the whole script for SSH issues
+        console.print(f"[WARNING] Connection test failed (continuing anyway): {e}", style="yellow")
+        return True  # Don't block the whole script for connection issues
 
+@timed('key_check')
 def validate_ssh_key():
     """Validate SSH key configuration"""
     console.print("[INFO] Validating SSH key configuration...", style="blue")
@@ -100,368 +701,3017 @@ def validate_ssh_key():
         console.print(f"[ERROR] SSH key validation failed: {e}", style="red")
         return False
 
-def get_remote_file():
-    """Download remote file to temporary location for comparison"""
+# ==== ATOMIC FILE WRITES ====
+
+@contextmanager
+def atomic_file(destination):
+    """Yield a binary file that replaces destination only once the block completes
+    
+    The temp file lives next to destination (so the rename is atomic) and
+    takes over its permissions; on any error it is removed and destination
+    is left untouched.
+    """
+    directory = os.path.dirname(os.path.abspath(destination))
+    os.makedirs(directory, exist_ok=True)
+    fd, temp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
     try:
-        temp_file = tempfile.NamedTemporaryFile(mode='w+', suffix='.json', delete=False)
-        temp_path = temp_file.name
-        temp_file.close()
-        
-        cmd = ["scp", f"{remote_user}@{remote_host}:{remote_path}", temp_path]
-        result = subprocess.run(cmd, capture_output=True, text=True)
-        
-        if result.returncode == 0:
-            return temp_path
-        else:
-            console.print(f"[WARNING] Could not fetch remote file: {result.stderr.strip()}", style="yellow")
+        with os.fdopen(fd, 'wb') as f:
+            yield f
+        if os.path.exists(destination):
+            shutil.copymode(destination, temp_path)
+        os.replace(temp_path, destination)
+    except BaseException:
+        if os.path.exists(temp_path):
             os.unlink(temp_path)
-            return None
-    except Exception as e:
-        console.print(f"[ERROR] Failed to fetch remote file: {e}", style="red")
+        raise
+
+def _write_atomic(path, data):
+    """Atomically replace path with the given bytes"""
+    with atomic_file(path) as f:
+        f.write(data)
+
+def _copy_atomic(source, destination):
+    """Atomically replace destination with a copy of source"""
+    with open(source, 'rb') as src, atomic_file(destination) as out:
+        shutil.copyfileobj(src, out, TRANSFER_CHUNK)
+
+# ==== COMPRESSED TRANSFER ====
+# Large files are streamed through a compressor over the ssh channel instead of
+# being copied raw with scp. The receiving side writes a temp file next to the
+# destination and renames it, so readers never see a half-written file.
+TRANSFER_CODECS = ('gzip', 'bzip2', 'xz')
+TRANSFER_CHUNK = 256 * 1024
+
+def compression_enabled():
+    """Return True when SYNC_COMPRESS names a supported codec"""
+    if compress_codec in ('', 'none', 'off', 'false', '0'):
+        return False
+    if compress_codec not in TRANSFER_CODECS:
+        console.print(f"[WARNING] Unknown SYNC_COMPRESS codec '{compress_codec}' - using raw copies", style="yellow")
+        return False
+    return True
+
+def transfer_codec(size):
+    """Return the codec for a transfer of size bytes, or None when a raw copy is cheaper"""
+    if size is None or size < compress_min_bytes or not compression_enabled():
         return None
+    return compress_codec
 
-def get_file_status():
-    """Get comprehensive file status comparison at startup"""
-    console.print("[INFO] Checking file status...", style="blue")
+def _codec_level(codec):
+    """Clamp SYNC_COMPRESS_LEVEL to the codec's range (xz accepts 0)"""
+    return min(9, max(0 if codec == 'xz' else 1, compress_level))
+
+def _compressor(codec):
+    """Create an incremental compressor matching the remote codec's format"""
+    level = _codec_level(codec)
+    if codec == 'gzip':
+        import zlib
+        return zlib.compressobj(level, zlib.DEFLATED, 31)  # wbits 31 = gzip container
+    if codec == 'bzip2':
+        import bz2
+        return bz2.BZ2Compressor(level)
+    import lzma
+    return lzma.LZMACompressor(preset=level)
+
+def _decompressor(codec):
+    """Create an incremental decompressor for a codec's stream"""
+    if codec == 'gzip':
+        import zlib
+        return zlib.decompressobj(31)
+    if codec == 'bzip2':
+        import bz2
+        return bz2.BZ2Decompressor()
+    import lzma
+    return lzma.LZMADecompressor()
+
+def _stream_error(codec, errors, returncode):
+    """Build the exception for a failed remote stream from its captured stderr"""
+    errors.seek(0)
+    message = errors.read().decode('utf-8', errors='replace').strip()
+    return Exception(f"{codec} stream failed: {message or f'exit code {returncode}'}")
+
+def _finish_stream(process, watchdog, codec, errors, target):
+    """Wait for a streaming ssh process, count it for the host's breaker and raise on failure"""
+    timer, expired = watchdog
+    returncode = process.wait()
+    timer.cancel()
+    record_breaker(target['host'], returncode != 255 and not expired.is_set())
+    if expired.is_set():
+        raise RetryableError(f"{codec} stream timed out")
+    if returncode != 0:
+        raise _stream_error(codec, errors, returncode)
+
+def stream_pull(destination, codec, target=None):
+    """Stream a target's file over ssh and atomically replace destination
     
-    if not local_path or not os.path.exists(local_path):
-        console.print("[ERROR] Local file not found", style="red")
-        return None
+    The remote side checks the file size itself and sends a one-byte marker:
+    Z followed by the codec's stream, or R followed by the raw file when it
+    is below SYNC_COMPRESS_MIN_BYTES. This saves a separate stat round trip.
+    Returns (bytes received, whether the stream was compressed); raises on failure.
+    """
+    target = target or primary_target()
+    path = shlex.quote(target['path'])
+    remote_cmd = (
+        f"size=$(stat -c %s -- {path}) || exit 1; if [ \"$size\" -ge {compress_min_bytes} ]; "
+        f"then printf Z; {codec} -c -{_codec_level(codec)} < {path}; "
+        f"else printf R; cat -- {path}; fi"
+    )
+    decompressor = None
+    process = None
+    watchdog = None
+    received = 0
     
-    # Get local file info
-    local_stat = os.stat(local_path)
-    local_mtime = datetime.fromtimestamp(local_stat.st_mtime)
-    local_size = local_stat.st_size
+    try:
+        with tempfile.TemporaryFile() as errors, atomic_file(destination) as out:
+            check_breaker(target['host'])
+            timeout = call_timeout()
+            process = subprocess.Popen(ssh_cmd(remote_cmd, target=target), stdout=subprocess.PIPE, stderr=errors)
+            watchdog = start_watchdog(process, timeout)
+            with process.stdout:
+                marker = process.stdout.read(1)
+                if marker == b'Z':
+                    decompressor = _decompressor(codec)
+                for chunk in iter(lambda: process.stdout.read(TRANSFER_CHUNK), b''):
+                    received += len(chunk)
+                    out.write(decompressor.decompress(chunk) if decompressor else chunk)
+            _finish_stream(process, watchdog, codec, errors, target)
+            if marker not in (b'Z', b'R'):
+                raise _stream_error(codec, errors, 0)
+            if decompressor:
+                if hasattr(decompressor, 'flush'):
+                    out.write(decompressor.flush())
+                if not decompressor.eof:
+                    raise Exception(f"{codec} stream ended early")
+        return received, decompressor is not None
+    except BaseException:
+        if watchdog:
+            watchdog[0].cancel()
+        if process and process.poll() is None:
+            process.kill()
+            process.wait()
+        raise
+
+def stream_push(source, codec, target=None):
+    """Stream source through codec over ssh; the remote side decompresses into a temp file and renames it
     
-    # Try to get remote file info
-    remote_temp_path = get_remote_file()
-    if not remote_temp_path:
-        return {
-            'status': 'remote_unavailable',
-            'local_mtime': local_mtime,
-            'local_size': local_size,
-            'remote_mtime': None,
-            'remote_size': None,
-            'files_identical': False,
-            'recommendation': 'Cannot compare - remote file unavailable'
-        }
+    Returns the number of compressed bytes sent; raises on failure.
+    """
+    target = target or primary_target()
+    path = shlex.quote(target['path'])
+    remote_cmd = (
+        f"tmp=$(mktemp {shlex.quote(target['path'] + '.XXXXXX')}) || exit 1; "
+        f"if {codec} -dc > \"$tmp\" && {{ chmod --reference={path} \"$tmp\" 2>/dev/null || true; }} "
+        f"&& mv -f \"$tmp\" {path}; then exit 0; fi; rm -f \"$tmp\"; exit 1"
+    )
+    compressor = _compressor(codec)
+    sent = 0
+    
+    with tempfile.TemporaryFile() as errors:
+        check_breaker(target['host'])
+        timeout = call_timeout()
+        process = subprocess.Popen(ssh_cmd(remote_cmd, target=target), stdin=subprocess.PIPE,
+                                   stdout=subprocess.DEVNULL, stderr=errors)
+        watchdog = start_watchdog(process, timeout)
+        try:
+            with open(source, 'rb') as f, process.stdin:
+                for chunk in iter(lambda: f.read(TRANSFER_CHUNK), b''):
+                    data = compressor.compress(chunk)
+                    process.stdin.write(data)
+                    sent += len(data)
+                data = compressor.flush()
+                process.stdin.write(data)
+                sent += len(data)
+        except BrokenPipeError:
+            pass  # The remote command exited early; its status and stderr say why
+        except BaseException:
+            watchdog[0].cancel()
+            process.kill()
+            process.wait()
+            raise
+        _finish_stream(process, watchdog, codec, errors, target)
+    return sent
+
+def fetch_compressed(destination, size=None, target=None):
+    """Download a target's file over an ssh stream; False means use scp instead
+    
+    With a known size, small files go straight to scp. With size None (pull)
+    the remote side decides, so the download still takes one round trip.
+    """
+    if not compression_enabled() or (size is not None and size < compress_min_bytes):
+        return False
     
     try:
-        # Get remote file info
-        remote_stat = os.stat(remote_temp_path)
-        remote_mtime = datetime.fromtimestamp(remote_stat.st_mtime)
-        remote_size = remote_stat.st_size
-        
-        # Compare file contents
-        if not local_path:
-            raise Exception("Local path not configured")
-            
-        with open(str(local_path), 'r', encoding='utf-8') as f:
-            local_content = f.read()
-        
-        with open(remote_temp_path, 'r', encoding='utf-8') as f:
-            remote_content = f.read()
-        
-        files_identical = local_content == remote_content
-        
-        # Determine recommendation
-        if files_identical:
-            recommendation = "Files are identical - no sync needed"
-            status = 'identical'
-        elif local_mtime > remote_mtime:
-            recommendation = "Local file is newer - consider PUSH"
-            status = 'local_newer'
-        elif remote_mtime > local_mtime:
-            recommendation = "Remote file is newer - consider PULL"
-            status = 'remote_newer'
-        else:
-            recommendation = "Files modified at same time but differ - manual review needed"
-            status = 'conflict'
-        
-        return {
-            'status': status,
-            'local_mtime': local_mtime,
-            'local_size': local_size,
-            'remote_mtime': remote_mtime,
-            'remote_size': remote_size,
-            'files_identical': files_identical,
-            'recommendation': recommendation,
-            'temp_remote_path': remote_temp_path
-        }
-        
+        with span('stream_pull', codec=compress_codec) as record:
+            received, compressed = stream_pull(destination, compress_codec, target)
+            record['wire_bytes'] = received
+            record['compressed'] = compressed
+        add_transfer_bytes(received=received)
+        if compressed:
+            console.print(
+                f"[INFO] Received {os.path.getsize(destination)} bytes as {received} bytes of {compress_codec}",
+                style="blue"
+            )
+        return True
     except Exception as e:
-        console.print(f"[ERROR] File comparison failed: {e}", style="red")
-        if remote_temp_path and os.path.exists(remote_temp_path):
-            os.unlink(remote_temp_path)
-        return None
+        console.print(f"[WARNING] Compressed download failed ({e}), falling back to scp", style="yellow")
+        return False
 
-def display_file_status(status_info):
-    """Display file status in a nice format"""
-    if not status_info:
-        return
+def send_compressed(source, target=None):
+    """Upload source compressed if it is large enough; False means use scp instead"""
+    size = os.path.getsize(source)
+    codec = transfer_codec(size)
+    if not codec:
+        return False
     
-    from rich.table import Table
+    try:
+        with span('stream_push', codec=codec, bytes=size) as record:
+            sent = stream_push(source, codec, target)
+            record['wire_bytes'] = sent
+        add_transfer_bytes(sent=sent)
+        console.print(f"[INFO] Sent {size} bytes as {sent} bytes of {codec}", style="blue")
+        return True
+    except Exception as e:
+        console.print(f"[WARNING] Compressed upload failed ({e}), falling back to scp", style="yellow")
+        return False
+
+# ==== TRANSPORTS ====
+# Sync logic reaches a target's files only through a Transport (get_transport):
+#   ssh   - ssh/scp subprocesses over the shared ControlMaster (default)
+#   sftp  - in-process SSH/SFTP session via paramiko (optional dependency)
+#   local - plain filesystem calls, for Node-RED on this machine or testing
+# Backends raise RetryableError/FatalError (or OSError) and are retried by
+# the callers through retry_operation.
+
+def _hash_tree_command(directory):
+    """Shell command printing `sha256  ./relative/path` for every file under directory"""
+    quoted = shlex.quote(directory)
+    # A missing directory is an empty manifest: the first sync creates it
+    return f"[ -d {quoted} ] || exit 0; cd {quoted} && find . -type f -exec sha256sum -- {{}} +"
+
+def _parse_hash_tree(output):
+    """Parse _hash_tree_command output into {relative path: sha256}"""
+    manifest = {}
+    for line in output.splitlines():
+        digest, _, path = line.partition("  ")
+        # sha256sum escapes unusual names with a leading backslash; those are not ours
+        if path.startswith("./") and not digest.startswith("\\"):
+            manifest[path[2:]] = digest.lower()
+    return manifest
+
+def _hash_local_file(path):
+    """SHA-256 of a local file, read in chunks"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(TRANSFER_CHUNK), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+class Transport:
+    """Access to one target's files; path=None means the target's global JSON file"""
+    kind = None
+    needs_ssh_key = True
     
-    table = Table(title="📊 File Status Comparison", border_style="blue")
-    table.add_column("Location", style="cyan", width=12)
-    table.add_column("Modified", style="yellow", width=20)
-    table.add_column("Size", style="green", width=10)
-    table.add_column("Status", width=15)
+    def __init__(self, target):
+        self.target = target
     
-    # Local file row
-    local_status = "📄 Present" if status_info['local_size'] else "❌ Missing"
-    table.add_row(
-        "Local",
-        status_info['local_mtime'].strftime("%Y-%m-%d %H:%M:%S"),
-        f"{status_info['local_size']} bytes",
-        local_status
-    )
+    def _path(self, path):
+        return self.target['path'] if path is None else path
     
-    # Remote file row
-    if status_info['remote_mtime']:
-        remote_status = "📄 Present" if status_info['remote_size'] else "❌ Missing"
-        table.add_row(
-            "Remote", 
-            status_info['remote_mtime'].strftime("%Y-%m-%d %H:%M:%S"),
-            f"{status_info['remote_size']} bytes",
-            remote_status
-        )
-    else:
-        table.add_row("Remote", "Unknown", "Unknown", "❌ Unavailable")
+    def connect(self):
+        """Open (or reopen) a shared connection; False means calls connect on their own"""
+        return True
     
-    console.print(table)
+    def check(self):
+        """Raise when the target cannot be reached"""
+        raise NotImplementedError
     
-    # Status panel
-    status_styles = {
-        'identical': 'green',
-        'local_newer': 'yellow',
-        'remote_newer': 'blue', 
-        'conflict': 'red',
-        'remote_unavailable': 'red'
-    }
+    def info(self, path=None):
+        """Return {'size', 'mtime', 'hash'} of a remote file in as few round trips as possible"""
+        raise NotImplementedError
     
-    status_icons = {
-        'identical': '✅',
-        'local_newer': '⬆️',
-        'remote_newer': '⬇️',
-        'conflict': '⚠️',
-        'remote_unavailable': '❌'
-    }
+    def read(self, path=None, offset=0, length=None, size=None):
+        """Return length bytes (default: the rest) of a remote file from offset
+        
+        size is the file size when already known; a backend may use it to
+        pick the cheapest way to transfer the whole file.
+        """
+        raise NotImplementedError
     
-    icon = status_icons.get(status_info['status'], '❓')
-    style = status_styles.get(status_info['status'], 'white')
+    def download(self, destination, path=None, size=None):
+        """Atomically replace the local destination with a remote file"""
+        raise NotImplementedError
     
-    recommendation_panel = Panel(
-        f"{icon} {status_info['recommendation']}",
-        title="💡 Recommendation",
-        border_style=style,
-        padding=(0, 1)
-    )
+    def upload(self, source, path=None):
+        """Atomically replace a remote file with the local source"""
+        raise NotImplementedError
     
-    console.print(recommendation_panel)
-    console.print()
+    def hash_tree(self, directory):
+        """Return {relative path: sha256} for every file under a remote directory"""
+        raise NotImplementedError
+    
+    def makedirs(self, directories):
+        """Create remote directories (with parents)"""
+        raise NotImplementedError
+    
+    def remove(self, paths):
+        """Delete remote files; missing ones are ignored"""
+        raise NotImplementedError
+    
+    def close(self):
+        """Release the connection"""
 
-def show_detailed_diff(status_info):
-    """Show detailed file differences"""
-    if not status_info or not status_info.get('temp_remote_path'):
-        console.print("[ERROR] Cannot show diff - remote file unavailable", style="red")
-        return
+class SubprocessTransport(Transport):
+    """ssh/scp subprocesses sharing a ControlMaster; large files stream compressed"""
+    kind = 'ssh'
     
-    if status_info['files_identical']:
-        console.print("[INFO] Files are identical - no differences to show", style="green")
-        return
+    def _spec(self, path):
+        return f"{remote_target(self.target)}:{self._path(path)}"
     
-    try:
-        # Read both files
-        if not local_path:
-            raise Exception("Local path not configured")
-            
-        with open(str(local_path), 'r', encoding='utf-8') as f:
-            local_content = f.readlines()
-        
-        with open(status_info['temp_remote_path'], 'r', encoding='utf-8') as f:
-            remote_content = f.readlines()
-        
-        # Generate diff
-        diff = list(difflib.unified_diff(
-            remote_content, local_content,
-            fromfile=f"Remote: {remote_path} ({status_info['remote_mtime']})",
-            tofile=f"Local: {local_path} ({status_info['local_mtime']})",
-            lineterm=""
-        ))
-        
-        if diff:
-            console.print("[INFO] File differences:", style="blue")
-            diff_text = "\n".join(diff[:50])  # Limit to first 50 lines
-            if len(diff) > 50:
-                diff_text += f"\n... ({len(diff) - 50} more lines truncated)"
-            
-            syntax = Syntax(diff_text, "diff", theme="monokai", line_numbers=False)
-            console.print(syntax)
+    def _run(self, remote_cmd, action, timeout=60):
+        result = run_transport(ssh_cmd(remote_cmd, target=self.target), self.target, timeout=timeout,
+                               capture_output=True, text=True)
+        add_transfer_bytes(sent=len(remote_cmd), received=len(result.stdout))
+        if result.returncode != 0:
+            raise transport_error(result, action)
+        return result.stdout
+    
+    def _scp(self, source, destination, name):
+        cmd = scp_cmd(source, destination, target=self.target)
+        console.print(" ".join(cmd), style="dim")
+        # stderr is captured to classify failures; scp's progress meter stays on stdout
+        with span(name):
+            result = run_transport(cmd, self.target, stderr=subprocess.PIPE, text=True)
+        if result.returncode != 0:
+            raise transport_error(result, "scp")
+    
+    def connect(self):
+        return ensure_ssh_master(self.target)
+    
+    def check(self):
+        test_cmd = ssh_cmd("echo 'Connection successful'",
+                           options=("-o", "ConnectTimeout=5", "-o", "BatchMode=yes"), target=self.target)
+        result = run_transport(test_cmd, self.target, timeout=8, capture_output=True, text=True)
+        if result.returncode != 0:
+            raise transport_error(result, "SSH connection")
+    
+    def info(self, path=None):
+        quoted_path = shlex.quote(self._path(path))
+        output = self._run(f"stat -c '%s %Y' -- {quoted_path} && sha256sum -- {quoted_path}", "Remote stat", timeout=30)
+        stat_line, hash_line = output.strip().splitlines()[:2]
+        size, mtime = stat_line.split()
+        return {
+            'size': int(size),
+            'mtime': datetime.fromtimestamp(int(mtime)),
+            'hash': hash_line.split()[0].lower()
+        }
+    
+    def read(self, path=None, offset=0, length=None, size=None):
+        if offset or length is not None:
+            # Partial read: only the requested bytes cross the wire
+            command = f"tail -c +{offset + 1} -- {shlex.quote(self._path(path))}"
+            if length is not None:
+                command += f" | head -c {length}"
+            result = run_transport(ssh_cmd(command, target=self.target), self.target, timeout=60, capture_output=True)
+            if result.returncode != 0:
+                result.stderr = result.stderr.decode('utf-8', errors='replace')
+                raise transport_error(result, "Remote read")
+            add_transfer_bytes(received=len(result.stdout))
+            return result.stdout
+        
+        fd, temp_path = tempfile.mkstemp(suffix='.json')
+        os.close(fd)
+        try:
+            self.download(temp_path, path, size)
+            with open(temp_path, 'rb') as f:
+                return f.read()
+        finally:
+            os.unlink(temp_path)
+    
+    def download(self, destination, path=None, size=None):
+        # Only the target's own file is streamed (with size None the remote side decides)
+        if path is None and fetch_compressed(destination, size, self.target):
+            return
+        self._scp(self._spec(path), destination, 'scp_pull')
+        add_transfer_bytes(received=os.path.getsize(destination))
+    
+    def upload(self, source, path=None):
+        if path is None and send_compressed(source, self.target):
+            return
+        self._scp(source, self._spec(path), 'scp_push')
+        add_transfer_bytes(sent=os.path.getsize(source))
+    
+    def hash_tree(self, directory):
+        return _parse_hash_tree(self._run(_hash_tree_command(directory), "Remote hash"))
+    
+    def makedirs(self, directories):
+        if directories:
+            self._run("mkdir -p -- " + " ".join(shlex.quote(directory) for directory in directories), "mkdir")
+    
+    def remove(self, paths):
+        if paths:
+            self._run("rm -f -- " + " ".join(shlex.quote(path) for path in paths), "rm")
+    
+    def close(self):
+        close_ssh_master(self.target)
+
+class SFTPTransport(Transport):
+    """In-process SSH session (paramiko): no process spawn per operation
+    
+    One SSH connection per target carries an SFTP channel per thread for
+    stat/read/write and exec channels for hashing and batch commands.
+    Hosts must be in known_hosts; ~/.ssh/config host entries are honoured.
+    """
+    kind = 'sftp'
+    
+    def __init__(self, target):
+        super().__init__(target)
+        self._client = None
+        self._generation = 0
+        self._lock = threading.Lock()
+        self._channels = threading.local()
+    
+    @staticmethod
+    def _paramiko():
+        try:
+            import paramiko
+        except ImportError:
+            raise FatalError("the sftp transport requires the 'paramiko' package (pip install paramiko)") from None
+        return paramiko
+    
+    def _connect(self):
+        paramiko = self._paramiko()
+        host = self.target['host']
+        with self._lock:
+            session = self._client.get_transport() if self._client else None
+            if session is not None and session.is_active():
+                return self._client
+            
+            check_breaker(host)
+            options = {}
+            config_path = os.path.expanduser("~/.ssh/config")
+            if os.path.exists(config_path):
+                options = paramiko.SSHConfig.from_path(config_path).lookup(host)
+            client = paramiko.SSHClient()
+            client.load_system_host_keys()
+            client.set_missing_host_key_policy(paramiko.RejectPolicy())
+            try:
+                client.connect(
+                    options.get('hostname', host),
+                    port=int(options.get('port', 22)),
+                    username=self.target['user'] or options.get('user'),
+                    key_filename=options.get('identityfile'),
+                    timeout=call_timeout(10),
+                    banner_timeout=call_timeout(10),
+                    auth_timeout=call_timeout(10)
+                )
+            except paramiko.AuthenticationException as e:
+                raise FatalError(f"SSH authentication to {host} failed: {e}") from None
+            except paramiko.BadHostKeyException as e:
+                raise FatalError(f"Host key verification failed: {e}") from None
+            except (paramiko.SSHException, OSError) as e:
+                record_breaker(host, False)
+                raise RetryableError(f"SSH connection to {host} failed: {e}") from None
+            record_breaker(host, True)
+            client.get_transport().set_keepalive(30)
+            self._client = client
+            self._generation += 1
+            return client
+    
+    def _sftp(self):
+        client = self._connect()
+        if getattr(self._channels, 'generation', None) != self._generation:
+            self._channels.sftp = client.open_sftp()
+            self._channels.generation = self._generation
+        self._channels.sftp.get_channel().settimeout(call_timeout())
+        return self._channels.sftp
+    
+    @contextmanager
+    def _errors(self, action):
+        """Turn paramiko/socket failures into classified errors (dropping a dead session)"""
+        import socket
+        paramiko = self._paramiko()
+        
+        try:
+            yield
+        except (FatalError, RetryableError):
+            raise
+        except (FileNotFoundError, PermissionError, IsADirectoryError) as e:
+            raise FatalError(f"{action} failed: {e.strerror or e}") from None
+        except (socket.timeout, EOFError, paramiko.SSHException, OSError) as e:
+            record_breaker(self.target['host'], False)
+            self.close()
+            raise RetryableError(f"{action} failed: {e or type(e).__name__}") from None
+    
+    def _exec(self, command, action):
+        with self._errors(action):
+            _, stdout, stderr = self._connect().exec_command(command, timeout=call_timeout(60))
+            output = stdout.read()
+            errors = stderr.read().decode('utf-8', errors='replace').strip()
+            status = stdout.channel.recv_exit_status()
+        add_transfer_bytes(sent=len(command), received=len(output))
+        if status == 127:
+            # Shells word this differently (dash: "not found"); the exit code is reliable
+            raise FatalError(f"{action} failed: command not found ({errors or 'exit code 127'})")
+        if status != 0:
+            message = f"{action} failed: {errors or f'exit code {status}'}"
+            raise FatalError(message) if _FATAL_ERRORS.search(message) else RetryableError(message)
+        return output.decode('utf-8', errors='replace')
+    
+    def connect(self):
+        try:
+            self._connect()
+            return True
+        except Exception as e:
+            console.print(f"[WARNING] Could not open SSH session to {self.target['name']}: {e}", style="yellow")
+            return False
+    
+    def check(self):
+        self._exec("true", "SSH connection")
+    
+    def info(self, path=None):
+        path = self._path(path)
+        with self._errors("Remote stat"):
+            attributes = self._sftp().stat(path)
+        try:
+            digest = self._exec(f"sha256sum -- {shlex.quote(path)}", "Remote hash").split()[0].lower()
+        except (RetryableError, FatalError) as e:
+            if isinstance(e, FatalError) and "command not found" not in str(e):
+                raise
+            # No (working) sha256sum on the host: hash the file in-process over SFTP
+            digest = hashlib.sha256(self.read(path)).hexdigest()
+        return {
+            'size': attributes.st_size,
+            'mtime': datetime.fromtimestamp(attributes.st_mtime),
+            'hash': digest
+        }
+    
+    def read(self, path=None, offset=0, length=None, size=None):
+        with self._errors("Remote read"):
+            with self._sftp().open(self._path(path), 'rb') as f:
+                if offset:
+                    f.seek(offset)
+                elif length is None:
+                    f.prefetch()  # Pipeline the requests for a whole-file read
+                data = f.read(length) if length is not None else f.read()
+        add_transfer_bytes(received=len(data))
+        return data
+    
+    def download(self, destination, path=None, size=None):
+        with atomic_file(destination) as out, span('sftp_get'), self._errors("SFTP download"):
+            self._sftp().getfo(self._path(path), out)
+        add_transfer_bytes(received=os.path.getsize(destination))
+    
+    def upload(self, source, path=None):
+        path = self._path(path)
+        temp_path = f"{path}.{uuid.uuid4().hex[:8]}.tmp"
+        with span('sftp_put'), self._errors("SFTP upload"):
+            sftp = self._sftp()
+            try:
+                with open(source, 'rb') as f:
+                    sftp.putfo(f, temp_path)
+                try:
+                    sftp.chmod(temp_path, sftp.stat(path).st_mode & 0o7777)
+                except FileNotFoundError:
+                    pass  # New file: keep the server's default mode
+                sftp.posix_rename(temp_path, path)
+            except BaseException:
+                try:
+                    sftp.remove(temp_path)
+                except Exception:
+                    pass
+                raise
+        add_transfer_bytes(sent=os.path.getsize(source))
+    
+    def hash_tree(self, directory):
+        return _parse_hash_tree(self._exec(_hash_tree_command(directory), "Remote hash"))
+    
+    def makedirs(self, directories):
+        if directories:
+            self._exec("mkdir -p -- " + " ".join(shlex.quote(directory) for directory in directories), "mkdir")
+    
+    def remove(self, paths):
+        if paths:
+            self._exec("rm -f -- " + " ".join(shlex.quote(path) for path in paths), "rm")
+    
+    def close(self):
+        with self._lock:
+            client, self._client = self._client, None
+            self._generation += 1  # Threads reopen their SFTP channel on the next call
+        if client:
+            client.close()
+
+class LocalTransport(Transport):
+    """The target's files on this machine (Node-RED on the same box, or tests)"""
+    kind = 'local'
+    needs_ssh_key = False
+    
+    def check(self):
+        directory = os.path.dirname(os.path.abspath(self.target['path']))
+        if not os.path.isdir(directory):
+            raise FatalError(f"{directory}: No such file or directory")
+    
+    def info(self, path=None):
+        path = self._path(path)
+        stat = os.stat(path)
+        return {
+            'size': stat.st_size,
+            'mtime': datetime.fromtimestamp(int(stat.st_mtime)),
+            'hash': _hash_local_file(path)
+        }
+    
+    def read(self, path=None, offset=0, length=None, size=None):
+        with open(self._path(path), 'rb') as f:
+            f.seek(offset)
+            return f.read(length) if length is not None else f.read()
+    
+    def download(self, destination, path=None, size=None):
+        _copy_atomic(self._path(path), destination)
+    
+    def upload(self, source, path=None):
+        _copy_atomic(source, self._path(path))
+    
+    def hash_tree(self, directory):
+        manifest = {}
+        for root, _, files in os.walk(directory):
+            for name in files:
+                full_path = os.path.join(root, name)
+                manifest[os.path.relpath(full_path, directory).replace(os.sep, '/')] = _hash_local_file(full_path)
+        return manifest
+    
+    def makedirs(self, directories):
+        for directory in directories:
+            os.makedirs(directory, exist_ok=True)
+    
+    def remove(self, paths):
+        for path in paths:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+TRANSPORTS = {backend.kind: backend for backend in (SubprocessTransport, SFTPTransport, LocalTransport)}
+_transports = {}
+_transports_lock = threading.Lock()
+
+def get_transport(target=None):
+    """Return the (shared) transport of a target, as chosen by its transport setting"""
+    target = target or primary_target()
+    with _transports_lock:
+        transport = _transports.get(target['name'])
+        if transport is None:
+            backend = TRANSPORTS.get((target.get('transport') or 'ssh').lower())
+            if backend is None:
+                raise FatalError(f"unknown transport '{target.get('transport')}' for {target['name']} "
+                                 f"(expected {', '.join(TRANSPORTS)})")
+            transport = _transports[target['name']] = backend(target)
+        return transport
+
+def close_transports():
+    """Close every open transport"""
+    with _transports_lock:
+        open_transports = list(_transports.values())
+        _transports.clear()
+    for transport in open_transports:
+        try:
+            transport.close()
+        except Exception:
+            pass
+
+atexit.register(close_transports)
+
+@timed('remote_fetch')
+def get_remote_file_content(target=None, size=None):
+    """Read a target's remote file into memory; None on failure"""
+    transport = get_transport(target)
+    try:
+        return retry_operation(lambda: transport.read(size=size), name='remote_read')
+    except Exception as e:
+        console.print(f"[WARNING] Could not fetch remote file: {e}", style="yellow")
+        return None
+
+@timed('remote_stat')
+def get_remote_file_info(target=None):
+    """Fetch remote file size, modification time and SHA-256"""
+    transport = get_transport(target)
+    try:
+        return retry_operation(transport.info, name='remote_stat')
+    except Exception as e:
+        console.print(f"[WARNING] Could not stat remote file: {e}", style="yellow")
+        return None
+
+# ==== SESSION SNAPSHOT CACHE ====
+# Parsed local/remote content reused across menu actions. The local entry is
+# keyed by (mtime_ns, size) and each target's remote entry by its SHA-256, so
+# a refresh only re-reads or re-downloads a side that actually changed.
+# 'info' holds each target's last remote stat/hash with the time it was fetched.
+_snapshot_cache = {'local': None, 'remote': {}, 'base': {}, 'info': {}}
+
+# Seconds a fetched remote stat/hash is reused by get_file_status (0 = always
+# ask the remote); the agent raises it while its background refresh runs
+remote_info_max_age = 0.0
+
+def _make_snapshot(raw_bytes, key=None):
+    """Build a cache entry from raw file content"""
+    return {
+        'key': key,
+        'hash': hashlib.sha256(raw_bytes).hexdigest(),
+        'size': len(raw_bytes),
+        'raw': raw_bytes,
+        'data': None,
+        'parsed': False
+    }
+
+def snapshot_data(snapshot):
+    """Return the parsed JSON of a snapshot, parsing it at most once"""
+    if not snapshot['parsed']:
+        snapshot['data'] = json.loads(snapshot['raw'])
+        snapshot['parsed'] = True
+    return snapshot['data']
+
+def get_local_snapshot():
+    """Return the cached local snapshot, re-reading only if mtime/size changed"""
+    local_stat = os.stat(local_path)
+    key = (local_stat.st_mtime_ns, local_stat.st_size)
+    
+    cached = _snapshot_cache['local']
+    if cached and cached['key'] == key:
+        return cached
+    
+    with open(local_path, 'rb') as f:
+        snapshot = _make_snapshot(f.read(), key)
+    _snapshot_cache['local'] = snapshot
+    return snapshot
+
+def get_remote_snapshot(remote_hash=None, target=None, remote_size=None):
+    """Return the cached remote snapshot, downloading only if the remote hash changed"""
+    target = target or primary_target()
+    cached = _snapshot_cache['remote'].get(target['name'])
+    if cached and remote_hash and cached['hash'] == remote_hash:
+        return cached
+    
+    raw_bytes = get_remote_file_content(target, size=remote_size)
+    if raw_bytes is None:
+        return None
+    
+    snapshot = _make_snapshot(raw_bytes)
+    _snapshot_cache['remote'][target['name']] = snapshot
+    return snapshot
+
+def seed_remote_snapshot(snapshot, target=None):
+    """Record that the remote now holds the given content (after pull/push)"""
+    target = target or primary_target()
+    _snapshot_cache['remote'][target['name']] = snapshot
+    # The remote mtime changed with it; the next status asks again
+    _snapshot_cache['info'].pop(target['name'], None)
+
+def get_cached_remote_file_info(target=None):
+    """Return the remote file info, reusing one fetched less than remote_info_max_age seconds ago"""
+    target = target or primary_target()
+    cached = _snapshot_cache['info'].get(target['name'])
+    if cached and time.monotonic() - cached['fetched_at'] < remote_info_max_age:
+        return cached['info']
+    
+    remote_info = get_remote_file_info(target)
+    if remote_info:
+        _snapshot_cache['info'][target['name']] = {'info': remote_info, 'fetched_at': time.monotonic()}
+    return remote_info
+
+def invalidate_snapshot_cache():
+    """Drop all cached snapshots"""
+    _snapshot_cache['local'] = None
+    _snapshot_cache['remote'].clear()
+    _snapshot_cache['base'].clear()
+    _snapshot_cache['info'].clear()
+
+@timed('compare')
+def get_file_status(fetch_content=False, target=None):
+    """Get comprehensive file status comparison using content hashes
+    
+    Only size, mtime and a SHA-256 digest are fetched from the remote. The
+    remote content itself is downloaded when the hashes differ and
+    fetch_content is set (or later, on demand, by show_detailed_diff), and
+    is served from the session snapshot cache while the remote hash is unchanged.
+    """
+    target = target or primary_target()
+    console.print("[INFO] Checking file status...", style="blue")
+    
+    if not local_path or not os.path.exists(local_path):
+        console.print("[ERROR] Local file not found", style="red")
+        return None
+    
+    # Get local file info
+    local_stat = os.stat(local_path)
+    local_mtime = datetime.fromtimestamp(local_stat.st_mtime)
+    local_size = local_stat.st_size
+    
+    try:
+        local_snapshot = get_local_snapshot()
+        local_hash = local_snapshot['hash']
+        remote_snapshot = None
+        
+        remote_info = get_cached_remote_file_info(target)
+        if not remote_info:
+            # Remote lacks stat/sha256sum: fall back to downloading and hashing the copy
+            remote_snapshot = get_remote_snapshot(target=target)
+            if remote_snapshot:
+                remote_info = {
+                    'size': remote_snapshot['size'],
+                    'mtime': None,
+                    'hash': remote_snapshot['hash']
+                }
+        
+        if not remote_info:
+            return {
+                'target': target,
+                'status': 'remote_unavailable',
+                'local_mtime': local_mtime,
+                'local_size': local_size,
+                'local_hash': local_hash,
+                'remote_mtime': None,
+                'remote_size': None,
+                'remote_hash': None,
+                'files_identical': False,
+                'recommendation': 'Cannot compare - remote file unavailable',
+                'local_snapshot': local_snapshot,
+                'remote_snapshot': None
+            }
+        
+        remote_mtime = remote_info['mtime']
+        files_identical = local_hash == remote_info['hash']
+        
+        # The last-synced base tells which side changed; mtimes are only a fallback
+        try:
+            base_snapshot = get_base_snapshot(target)
+        except OSError:
+            base_snapshot = None
+        base_hash = base_snapshot['hash'] if base_snapshot else None
+        
+        # Determine recommendation
+        if files_identical:
+            recommendation = "Files are identical - no sync needed"
+            status = 'identical'
+        elif base_hash == local_hash:
+            recommendation = "Only the remote changed since the last sync - consider PULL"
+            status = 'remote_newer'
+        elif base_hash == remote_info['hash']:
+            recommendation = "Only the local file changed since the last sync - consider PUSH"
+            status = 'local_newer'
+        elif base_hash:
+            recommendation = "Both sides changed since the last sync - consider MERGE"
+            status = 'diverged'
+        elif remote_mtime is None:
+            recommendation = "Files differ and remote mtime is unknown - manual review needed"
+            status = 'conflict'
+        elif local_mtime > remote_mtime:
+            recommendation = "Local file is newer - consider PUSH"
+            status = 'local_newer'
+        elif remote_mtime > local_mtime:
+            recommendation = "Remote file is newer - consider PULL"
+            status = 'remote_newer'
+        else:
+            recommendation = "Files modified at same time but differ - manual review needed"
+            status = 'conflict'
+        
+        cached_remote = _snapshot_cache['remote'].get(target['name'])
+        if files_identical:
+            remote_snapshot = local_snapshot
+        elif not remote_snapshot and cached_remote and cached_remote['hash'] == remote_info['hash']:
+            remote_snapshot = cached_remote
+        elif not remote_snapshot and fetch_content:
+            remote_snapshot = get_remote_snapshot(remote_info['hash'], target, remote_info['size'])
+        
+        return {
+            'target': target,
+            'status': status,
+            'local_mtime': local_mtime,
+            'local_size': local_size,
+            'local_hash': local_hash,
+            'remote_mtime': remote_mtime,
+            'remote_size': remote_info['size'],
+            'remote_hash': remote_info['hash'],
+            'base_hash': base_hash,
+            'files_identical': files_identical,
+            'recommendation': recommendation,
+            'local_snapshot': local_snapshot,
+            'remote_snapshot': remote_snapshot
+        }
+        
+    except Exception as e:
+        console.print(f"[ERROR] File comparison failed: {e}", style="red")
+        return None
+
+def display_file_status(status_info):
+    """Display file status in a nice format"""
+    if not status_info:
+        return
+    
+    from rich.panel import Panel
+    from rich.table import Table
+    
+    table = Table(title="📊 File Status Comparison", border_style="blue")
+    table.add_column("Location", style="cyan", width=8)
+    table.add_column("Modified", style="yellow", width=20)
+    table.add_column("Size", style="green", width=10)
+    table.add_column("SHA-256", style="magenta", width=12)
+    table.add_column("Status", width=12)
+    
+    # Local file row
+    local_status = "📄 Present" if status_info['local_size'] else "❌ Missing"
+    table.add_row(
+        "Local",
+        status_info['local_mtime'].strftime("%Y-%m-%d %H:%M:%S"),
+        f"{status_info['local_size']} bytes",
+        status_info['local_hash'][:12],
+        local_status
+    )
+    
+    # Remote file row
+    if status_info['remote_hash']:
+        remote_status = "📄 Present" if status_info['remote_size'] else "❌ Missing"
+        remote_mtime = status_info['remote_mtime']
+        table.add_row(
+            "Remote", 
+            remote_mtime.strftime("%Y-%m-%d %H:%M:%S") if remote_mtime else "Unknown",
+            f"{status_info['remote_size']} bytes",
+            status_info['remote_hash'][:12],
+            remote_status
+        )
+    else:
+        table.add_row("Remote", "Unknown", "Unknown", "Unknown", "❌ Unavailable")
+    
+    console.print(table)
+    
+    # Status panel
+    status_styles = {
+        'identical': 'green',
+        'local_newer': 'yellow',
+        'remote_newer': 'blue', 
+        'diverged': 'magenta',
+        'conflict': 'red',
+        'remote_unavailable': 'red'
+    }
+    
+    status_icons = {
+        'identical': '✅',
+        'local_newer': '⬆️',
+        'remote_newer': '⬇️',
+        'diverged': '🔀',
+        'conflict': '⚠️',
+        'remote_unavailable': '❌'
+    }
+    
+    icon = status_icons.get(status_info['status'], '❓')
+    style = status_styles.get(status_info['status'], 'white')
+    
+    recommendation_panel = Panel(
+        f"{icon} {status_info['recommendation']}",
+        title="💡 Recommendation",
+        border_style=style,
+        padding=(0, 1)
+    )
+    
+    console.print(recommendation_panel)
+    console.print()
+
+def _json_path_key(path, key):
+    """Append an object key to a JSON path ($.key or $["odd key"])"""
+    if key.isidentifier():
+        return f"{path}.{key}"
+    return f"{path}[{json.dumps(key, ensure_ascii=False)}]"
+
+def _json_scalar_equal(old, new):
+    """Compare JSON scalars without treating 1 and true (or 1 and 1.0) as equal"""
+    return type(old) is type(new) and old == new
+
+def iter_json_diff(old, new, path="$"):
+    """Lazily yield structural differences between two parsed JSON documents
+    
+    Yields (kind, path, old_value, new_value) tuples where kind is 'added',
+    'removed' or 'changed'. Objects are compared by key, so reordering keys
+    produces no output; arrays are compared by index. The walk is iterative
+    and visits each node once, so a consumer that stops early (paging or
+    truncation) also stops the work.
+    """
+    # Stack entries are (kind, path, old, new); kind None means "walk this pair"
+    stack = [(None, path, old, new)]
+    while stack:
+        kind, current_path, old_value, new_value = stack.pop()
+        
+        if kind is not None:
+            yield (kind, current_path, old_value, new_value)
+            continue
+        
+        if old_value is new_value:
+            continue
+        
+        if isinstance(old_value, dict) and isinstance(new_value, dict):
+            children = []
+            for key, value in new_value.items():
+                if key in old_value:
+                    children.append((None, _json_path_key(current_path, key), old_value[key], value))
+                else:
+                    children.append(('added', _json_path_key(current_path, key), None, value))
+            for key, value in old_value.items():
+                if key not in new_value:
+                    children.append(('removed', _json_path_key(current_path, key), value, None))
+        elif isinstance(old_value, list) and isinstance(new_value, list):
+            children = []
+            shared = min(len(old_value), len(new_value))
+            for index in range(shared):
+                children.append((None, f"{current_path}[{index}]", old_value[index], new_value[index]))
+            for index in range(shared, len(new_value)):
+                children.append(('added', f"{current_path}[{index}]", None, new_value[index]))
+            for index in range(shared, len(old_value)):
+                children.append(('removed', f"{current_path}[{index}]", old_value[index], None))
+        else:
+            if not _json_scalar_equal(old_value, new_value):
+                yield ('changed', current_path, old_value, new_value)
+            continue
+        
+        # Reverse so entries pop off the stack in document order
+        stack.extend(reversed(children))
+
+def _format_diff_value(value, max_length=80):
+    """Render a JSON value compactly for diff output"""
+    text = json.dumps(value, ensure_ascii=False)
+    if len(text) > max_length:
+        text = text[:max_length - 3] + "..."
+    return text
+
+def _iter_line_diff(remote_text, local_text, fromfile, tofile):
+    """Lazily yield a unified line diff for content that is not valid JSON"""
+    import difflib
+    
+    lines = difflib.unified_diff(
+        remote_text.splitlines(), local_text.splitlines(),
+        fromfile=fromfile, tofile=tofile, lineterm=""
+    )
+    for line in lines:
+        yield line
+
+def diff_snapshots(old_snapshot, new_snapshot, old_label, new_label, limit=DIFF_MAX_LINES):
+    """Compute up to limit differences between two snapshots without rendering them
+    
+    Returns a dict with 'format' ('json' path changes, or 'text' unified diff
+    lines when either side is not valid JSON), 'changes' and 'truncated',
+    or None when the comparison fails.
+    """
+    try:
+        try:
+            old_data = snapshot_data(old_snapshot)
+            new_data = snapshot_data(new_snapshot)
+        except json.JSONDecodeError as e:
+            console.print(f"[WARNING] Structural diff unavailable ({e}), showing line diff", style="yellow")
+            changes = _iter_line_diff(
+                old_snapshot['raw'].decode('utf-8'), new_snapshot['raw'].decode('utf-8'),
+                fromfile=old_label, tofile=new_label
+            )
+            diff_format = 'text'
+        else:
+            changes = iter_json_diff(old_data, new_data)
+            diff_format = 'json'
+        
+        shown = list(itertools.islice(changes, limit))
+        # Only probe for one more change; counting the rest would walk the whole tree
+        truncated = next(changes, None) is not None
+        return {'format': diff_format, 'changes': shown, 'truncated': truncated}
+        
+    except Exception as e:
+        console.print(f"[ERROR] Failed to generate diff: {e}", style="red")
+        return None
+
+def collect_diff(status_info, limit=DIFF_MAX_LINES):
+    """Compute up to limit differences (remote → local) of a status check; see diff_snapshots
+    
+    Returns None when the remote content cannot be fetched or compared.
+    """
+    if not status_info or status_info['status'] == 'remote_unavailable':
+        console.print("[ERROR] Cannot show diff - remote file unavailable", style="red")
+        return None
+    
+    if status_info['files_identical']:
+        return {'format': 'json', 'changes': [], 'truncated': False}
+    
+    # Status checks only compare hashes; download the remote content on demand
+    if not status_info.get('remote_snapshot'):
+        status_info['remote_snapshot'] = get_remote_snapshot(
+            status_info['remote_hash'], status_info['target'], status_info['remote_size']
+        )
+        if not status_info['remote_snapshot']:
+            console.print("[ERROR] Cannot show diff - remote file unavailable", style="red")
+            return None
+    
+    return diff_snapshots(
+        status_info['remote_snapshot'], status_info['local_snapshot'],
+        f"Remote: {status_info['target']['path']} ({status_info['remote_mtime']})",
+        f"Local: {local_path} ({status_info['local_mtime']})",
+        limit
+    )
+
+def print_diff(diff, description):
+    """Render a diff from diff_snapshots on the console"""
+    from rich.syntax import Syntax
+    from rich.text import Text
+    
+    shown = diff['changes']
+    if diff['format'] == 'text':
+        if shown:
+            diff_text = "\n".join(shown)
+            if diff['truncated']:
+                diff_text += "\n... (more lines truncated)"
+            console.print(Syntax(diff_text, "diff", theme="monokai", line_numbers=False))
+        return True
+    
+    if not shown:
+        console.print("[INFO] Files differ only in formatting or key order", style="green")
+        return True
+    
+    console.print(f"[INFO] Changes from {description}:", style="blue")
+    for kind, path, old_value, new_value in shown:
+        if kind == 'added':
+            console.print(Text(f"+ {path}: {_format_diff_value(new_value)}", style="green"))
+        elif kind == 'removed':
+            console.print(Text(f"- {path}: {_format_diff_value(old_value)}", style="red"))
+        else:
+            console.print(Text(
+                f"~ {path}: {_format_diff_value(old_value)} → {_format_diff_value(new_value)}",
+                style="yellow"
+            ))
+    
+    if diff['truncated']:
+        console.print(f"... (more changes truncated after {DIFF_MAX_LINES})", style="dim")
+    return True
+
+@timed('diff')
+def show_detailed_diff(status_info):
+    """Show detailed file differences as JSON path changes (remote → local)"""
+    if status_info and status_info['files_identical']:
+        console.print("[INFO] Files are identical - no differences to show", style="green")
+        return True
+    
+    diff = collect_diff(status_info)
+    if diff is None:
+        return False
+    return print_diff(diff, f"remote ({status_info['target']['path']}) to local ({local_path})")
+
+# ==== RETRY POLICY ====
+# Every ssh/scp call goes through run_transport and every webhook POST through
+# _post_webhook: both apply the current attempt's deadline as a timeout and
+# feed the per-host circuit breaker. retry_operation retries only transient
+# failures, with jittered backoff, within a total deadline.
+
+class RetryableError(Exception):
+    """A transient failure (dropped connection, timeout, 5xx) worth another attempt"""
+
+class FatalError(Exception):
+    """A failure another attempt cannot fix (missing path, permission denied)"""
+
+class CircuitOpenError(FatalError):
+    """Raised without contacting a host whose circuit breaker is open"""
+
+# Transport errors that retrying cannot fix; anything else counts as transient
+_FATAL_ERRORS = re.compile(
+    r"No such file or directory|Permission denied|Is a directory|Not a directory|Read-only file system|"
+    r"No space left on device|Host key verification failed|Too many authentication failures|command not found",
+    re.IGNORECASE
+)
+# ssh/scp messages meaning the host could not be reached at all
+_CONNECTION_ERRORS = re.compile(
+    r"Connection (?:refused|timed out|reset|closed)|Connection to .* closed|Broken pipe|Network is unreachable|"
+    r"No route to host|Could not resolve hostname|Operation timed out|kex_exchange_identification|lost connection",
+    re.IGNORECASE
+)
+
+_retry_context = threading.local()
+_breakers = {}
+_breaker_lock = threading.Lock()
+
+def is_retryable(error):
+    """Classify an exception raised by an attempt"""
+    if isinstance(error, FatalError):
+        return False
+    if isinstance(error, RetryableError):
+        return True
+    return not _FATAL_ERRORS.search(str(error))
+
+def call_timeout(default=None):
+    """Timeout for one ssh/scp/HTTP call: its own limit capped by the current attempt's deadline"""
+    limit = retry_attempt_timeout if default is None else default
+    deadline = getattr(_retry_context, 'deadline', None)
+    if deadline is not None:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            raise RetryableError("attempt deadline exceeded")
+        limit = min(limit, remaining)
+    return limit
+
+def check_breaker(host):
+    """Fail fast while a host's circuit is open; after the cooldown one trial call goes through"""
+    if breaker_threshold <= 0:
+        return
+    with _breaker_lock:
+        state = _breakers.get(host)
+        if not state or state['opened_at'] is None:
+            return
+        remaining = state['opened_at'] + breaker_cooldown - time.monotonic()
+        failures = state['failures']
+    if remaining > 0:
+        raise CircuitOpenError(
+            f"{host} looks down ({failures} consecutive connection failures); not retrying for another {remaining:.0f}s"
+        )
+
+def record_breaker(host, ok):
+    """Count a connection success or failure towards a host's circuit breaker"""
+    if breaker_threshold <= 0:
+        return
+    with _breaker_lock:
+        state = _breakers.setdefault(host, {'failures': 0, 'opened_at': None})
+        if ok:
+            state['failures'] = 0
+            state['opened_at'] = None
+            return
+        state['failures'] += 1
+        if state['failures'] < breaker_threshold:
+            return
+        opening = state['opened_at'] is None
+        state['opened_at'] = time.monotonic()  # A failed trial call re-opens it
+    if opening:
+        console.print(f"[WARNING] {host} looks down - failing fast for {breaker_cooldown:g}s", style="yellow")
+
+def transport_error(result, action):
+    """Build the classified exception for a failed ssh/scp run"""
+    message = (result.stderr or "").strip() if isinstance(result.stderr, str) else ""
+    message = f"{action} failed: {message or f'exit code {result.returncode}'}"
+    if _FATAL_ERRORS.search(message) and not _CONNECTION_ERRORS.search(message):
+        return FatalError(message)
+    return RetryableError(message)
+
+def _connection_failed(returncode, stderr):
+    """True when an ssh/scp exit means the host itself could not be reached"""
+    # ssh reports its own connection errors with 255; scp only says so on stderr
+    return returncode == 255 or bool(stderr and _CONNECTION_ERRORS.search(stderr))
+
+def run_transport(cmd, target=None, timeout=None, **kwargs):
+    """subprocess.run for ssh/scp under the current deadline and the host's circuit breaker
+    
+    A timeout raises RetryableError; other failures are returned as usual
+    (see transport_error) so callers keep their own messages.
+    """
+    host = (target or primary_target())['host']
+    check_breaker(host)
+    try:
+        result = subprocess.run(cmd, timeout=call_timeout(timeout), **kwargs)
+    except subprocess.TimeoutExpired as e:
+        record_breaker(host, False)
+        raise RetryableError(f"{os.path.basename(cmd[0])} timed out after {e.timeout:.1f}s") from None
+    stderr = result.stderr if isinstance(result.stderr, str) else None
+    record_breaker(host, not _connection_failed(result.returncode, stderr))
+    return result
+
+def start_watchdog(process, timeout=None):
+    """Kill a streaming ssh process once the call timeout expires; returns (timer, expired event)"""
+    expired = threading.Event()
+    
+    def _expire():
+        expired.set()
+        process.kill()
+    
+    timer = threading.Timer(call_timeout(timeout), _expire)
+    timer.daemon = True
+    timer.start()
+    return timer, expired
+
+def retry_operation(func, attempts=None, delay=None, name=None, deadline=None, attempt_timeout=None):
+    """Retry an operation on transient failures with jittered exponential backoff
+    
+    attempts is the total number of tries (at least one); the last error is
+    raised when they are used up. Each attempt runs under a deadline of attempt_timeout seconds (picked up by
+    run_transport and the webhook via call_timeout) and all attempts share a
+    total deadline; fatal errors and open circuit breakers are raised at once.
+    """
+    name = name or getattr(func, '__name__', 'operation').lstrip('_')
+    attempts = max(1, retry_attempts if attempts is None else attempts)
+    delay = retry_backoff if delay is None else delay
+    attempt_timeout = retry_attempt_timeout if attempt_timeout is None else attempt_timeout
+    
+    outer_deadline = getattr(_retry_context, 'deadline', None)
+    total_deadline = time.monotonic() + (retry_deadline if deadline is None else deadline)
+    if outer_deadline is not None:
+        total_deadline = min(total_deadline, outer_deadline)
+    
+    try:
+        for attempt in range(attempts):
+            _retry_context.deadline = min(total_deadline, time.monotonic() + attempt_timeout)
+            try:
+                with span(f"{name}.attempt", attempt=attempt + 1):
+                    return func()
+            except Exception as e:
+                if not is_retryable(e) or attempt == attempts - 1:
+                    raise
+                
+                wait_time = random.uniform(0, min(retry_backoff_max, delay * (2 ** attempt)))
+                if time.monotonic() + wait_time >= total_deadline:
+                    raise RetryableError(f"{e} (retry deadline reached after {attempt + 1} attempt(s))") from e
+                
+                count_retry()
+                console.print(f"[WARNING] Attempt {attempt + 1} failed: {e}", style="yellow")
+                console.print(f"[INFO] Retrying in {wait_time:.2f} seconds...", style="blue")
+                time.sleep(wait_time)
+    finally:
+        _retry_context.deadline = outer_deadline
+
+_webhook_session = None
+_webhook_session_lock = threading.Lock()
+
+def get_webhook_session():
+    """Return the pooled HTTP session shared by every webhook call in this run"""
+    global _webhook_session
+    with _webhook_session_lock:
+        if _webhook_session is None:
+            import requests
+            
+            _webhook_session = requests.Session()
+            adapter = requests.adapters.HTTPAdapter(pool_connections=4, pool_maxsize=max(4, fleet_max_workers))
+            _webhook_session.mount('http://', adapter)
+            _webhook_session.mount('https://', adapter)
+        return _webhook_session
+
+def close_webhook_session():
+    """Close pooled webhook connections"""
+    global _webhook_session
+    with _webhook_session_lock:
+        if _webhook_session is not None:
+            _webhook_session.close()
+            _webhook_session = None
+
+atexit.register(close_webhook_session)
+
+def _post_webhook(url, payload, headers):
+    """POST a JSON payload, retrying connection errors and 5xx under the retry policy"""
+    import requests
+    from urllib.parse import urlparse
+    
+    body = json.dumps(payload).encode('utf-8')
+    session = get_webhook_session()
+    host = urlparse(url).hostname or url
+    
+    def _attempt():
+        check_breaker(host)
+        add_transfer_bytes(sent=len(body))
+        try:
+            response = session.post(url, data=body, headers=headers, timeout=call_timeout(10))
+        except (requests.ConnectionError, requests.Timeout) as e:
+            record_breaker(host, False)
+            raise RetryableError(str(e)) from None
+        record_breaker(host, True)
+        add_transfer_bytes(received=len(response.content))
+        if response.status_code >= 500:
+            raise RetryableError(f"status code {response.status_code}")
+        return response
+    
+    # Full jitter keeps a fleet of clients from retrying in lockstep
+    return retry_operation(_attempt, attempts=webhook_attempts, delay=webhook_backoff, name='webhook')
+
+def _response_version(response):
+    """Extract the applied context version echoed by the endpoint, if any"""
+    try:
+        data = response.json()
+    except ValueError:
+        return None
+    if isinstance(data, dict):
+        return data.get('version')
+    return None
+
+@timed('webhook_confirm')
+def confirm_webhook(target, version, response):
+    """Check that Node-RED reports the version that was just sent
+    
+    The endpoint echoes the applied version in its response; if it does not
+    match yet (e.g. the flow applies asynchronously), poll it with a
+    confirm_global_context request until WEBHOOK_CONFIRM_TIMEOUT expires.
+    """
+    echoed = _response_version(response)
+    if echoed is None and webhook_confirm != 'required':
+        console.print("[INFO] Webhook endpoint does not report versions; apply not confirmed", style="dim")
+        return True
+    
+    headers = {
+        'Content-Type': 'application/json',
+        'Authorization': f"Bearer {target['auth_secret']}"
+    }
+    deadline = time.monotonic() + webhook_confirm_timeout
+    poll_delay = 0.25
+    while echoed != version:
+        if time.monotonic() >= deadline:
+            console.print(f"[ERROR] Node-RED did not confirm version {version[:12]} (reported {str(echoed)[:12]})", style="red")
+            return False
+        time.sleep(poll_delay)
+        poll_delay = min(poll_delay * 2, 2)
+        try:
+            echoed = _response_version(_post_webhook(
+                target['webhook'], {'action': 'confirm_global_context', 'version': version}, headers
+            ))
+        except Exception as e:
+            console.print(f"[WARNING] Confirm request failed: {e}", style="yellow")
+    
+    console.print(f"[SUCCESS] Node-RED confirmed global context version {version[:12]}", style="green")
+    return True
+
+def webhook_configured(target=None):
+    """Return True when a target has both a webhook URL and an auth secret"""
+    target = target or primary_target()
+    return bool(target['webhook'] and target['auth_secret'])
+
+def build_full_payload(data):
+    """Build the webhook payload that replaces the synced globals with a whole document"""
+    return {
+        'action': 'update_global_context',
+        'timestamp': datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        'data': data
+    }
+
+@timed('webhook')
+def send_webhook(payload=None, target=None, version=None):
+    """Send webhook notification to update Node-RED global context
+    
+    Without a payload the whole local file is sent (update_global_context).
+    version (the SHA-256 of the pushed document) is included in the payload so
+    the endpoint can echo it back; the push only counts as complete once the
+    live globals report that version (see WEBHOOK_CONFIRM).
+    """
+    target = target or primary_target()
+    webhook_url = target['webhook']
+    auth_secret = target['auth_secret']
+    
+    if not webhook_configured(target):
+        console.print("[WARNING] Webhook URL or auth secret not found in .env file. Skipping webhook.", style="yellow")
+        return False
+    
+    try:
+        headers = {
+            'Content-Type': 'application/json',
+            'Authorization': f'Bearer {auth_secret}'
+        }
+        
+        if payload is None:
+            payload = build_full_payload(snapshot_data(get_local_snapshot()))
+        if version:
+            payload = dict(payload, version=version)
+        
+        console.print(f"[INFO] Sending webhook to update Node-RED global context ({target['name']})...", style="blue")
+        response = _post_webhook(webhook_url, payload, headers)
+        
+        if response.status_code != 200:
+            console.print(f"[WARNING] Webhook returned status code {response.status_code}", style="yellow")
+            return False
+        
+        console.print("[SUCCESS] Webhook sent successfully.", style="green")
+        if version and webhook_confirm != 'off':
+            return confirm_webhook(target, version, response)
+        return True
+            
+    except Exception as e:
+        console.print(f"[ERROR] Failed to send webhook: {e}", style="red")
+        return False
+
+# Two bases per target: "synced" is the content of the remote file after the
+# last pull/push (the merge and status base), "applied" is the document the
+# Node-RED runtime context last confirmed (the delta push base). They differ
+# after a delta push that does not copy the file.
+
+def snapshot_path(target=None, kind='synced'):
+    """Return the path of a target's last-synced (or last-applied) snapshot"""
+    target = target or primary_target()
+    if target is targets[0]:
+        return os.path.join(sync_state_dir, f"last_{kind}.json")
+    return os.path.join(sync_state_dir, f"last_{kind}.{target['name']}.json")
+
+def save_sync_snapshot(source_path, target=None, kind='synced'):
+    """Record the given file as the last-synced (or last-applied) version (atomic replace)"""
+    try:
+        _copy_atomic(source_path, snapshot_path(target, kind))
+        return True
+    except Exception as e:
+        console.print(f"[WARNING] Could not update last-synced snapshot: {e}", style="yellow")
+        return False
+
+def get_base_snapshot(target=None, kind='synced'):
+    """Return the cached last-synced snapshot (the merge base), or None if there is none"""
+    target = target or primary_target()
+    path = snapshot_path(target, kind)
+    try:
+        base_stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    key = (base_stat.st_mtime_ns, base_stat.st_size)
+    
+    cached = _snapshot_cache['base'].get((target['name'], kind))
+    if cached and cached['key'] == key:
+        return cached
+    
+    with open(path, 'rb') as f:
+        snapshot = _make_snapshot(f.read(), key)
+    _snapshot_cache['base'][(target['name'], kind)] = snapshot
+    return snapshot
+
+def load_sync_snapshot(target=None, kind='synced'):
+    """Load the parsed last-synced (or last-applied) snapshot, or None if there is none"""
+    try:
+        snapshot = get_base_snapshot(target, kind)
+        return snapshot_data(snapshot) if snapshot else None
+    except Exception as e:
+        console.print(f"[WARNING] Ignoring unreadable last-synced snapshot: {e}", style="yellow")
+        return None
+
+def _canonical_json(value):
+    """Serialize a value so that equal JSON compares equal (and 1 != true)"""
+    return json.dumps(value, sort_keys=True, separators=(',', ':'), ensure_ascii=False)
+
+def compute_key_delta(base, current):
+    """Compute added, changed and removed top-level keys between two JSON objects"""
+    added = [key for key in current if key not in base]
+    changed = [
+        key for key in current
+        if key in base and _canonical_json(current[key]) != _canonical_json(base[key])
+    ]
+    removed = [key for key in base if key not in current]
+    
+    return {
+        'added': added,
+        'changed': changed,
+        'removed': removed,
+        'set': {key: current[key] for key in added + changed},
+        'delete': removed
+    }
+
+def display_key_delta(delta):
+    """Display the keys a delta push will set or delete"""
+    from rich.table import Table
+    
+    table = Table(title="🔑 Global Key Delta", border_style="blue")
+    table.add_column("Key", style="cyan")
+    table.add_column("Change", width=10)
+    
+    for key in delta['added']:
+        table.add_row(key, "[green]added[/green]")
+    for key in delta['changed']:
+        table.add_row(key, "[yellow]changed[/yellow]")
+    for key in delta['removed']:
+        table.add_row(key, "[red]removed[/red]")
+    
+    console.print(table)
+
+def build_delta_payload(delta, key_report=None):
+    """Build the webhook payload for a key-level delta"""
+    payload = {
+        'action': 'apply_global_delta',
+        'timestamp': datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        'set': delta['set'],
+        'delete': delta['delete']
+    }
+    if key_report:
+        payload['keys'] = {'missing': sorted(key_report['missing']), 'unused': key_report['unused']}
+    return payload
+
+# ==== VERSION HISTORY ====
+# Every pulled and pushed version is kept as a gzip-compressed object named by
+# its SHA-256, so a version seen many times is stored once. index.jsonl lists
+# the versions in order; pruning drops the oldest entries (SYNC_HISTORY_KEEP,
+# SYNC_HISTORY_MAX_AGE_DAYS) and then any object no entry refers to.
+_history_lock = threading.Lock()
+
+def _history_index_path():
+    """Return the path of the history index"""
+    return os.path.join(history_dir, 'index.jsonl')
+
+def _history_object_path(digest):
+    """Return the path of a whole-file compressed version (recorded before chunking)"""
+    return os.path.join(history_dir, 'objects', digest[:2], digest[2:] + '.json.gz')
+
+def _history_version_path(digest):
+    """Return the path of the compressed chunk list of a version"""
+    return os.path.join(history_dir, 'versions', digest[:2], digest[2:] + '.json.gz')
+
+def _history_chunk_path(digest):
+    """Return the path of a compressed content-addressed chunk"""
+    return os.path.join(history_dir, 'chunks', digest[:2], digest[2:] + '.gz')
+
+def _iter_history_files(subdir):
+    """Yield (digest, path) for every file stored under a history subdirectory"""
+    root = os.path.join(history_dir, subdir)
+    if not os.path.isdir(root):
+        return
+    for prefix in os.listdir(root):
+        for name in os.listdir(os.path.join(root, prefix)):
+            yield prefix + name.split('.', 1)[0], os.path.join(root, prefix, name)
+
+_JSON_WHITESPACE = re.compile(r'[ \t\n\r]*')
+
+def split_top_level_members(raw_bytes):
+    """Split a JSON object document into byte chunks, one per top-level key
+    
+    The chunks join back into the exact original bytes, so an edit to one key
+    only changes that key's chunk. Anything that is not a UTF-8 JSON object
+    with at least one key is returned as a single chunk.
+    """
+    decoder = json.JSONDecoder()
+    try:
+        text = raw_bytes.decode('utf-8')
+        index = _JSON_WHITESPACE.match(text, 0).end()
+        if text[index] != '{':
+            return [raw_bytes]
+        index = _JSON_WHITESPACE.match(text, index + 1).end()
+        starts = []
+        while text[index] != '}':
+            starts.append(index)
+            key, index = decoder.raw_decode(text, index)
+            index = _JSON_WHITESPACE.match(text, index).end()
+            if not isinstance(key, str) or text[index] != ':':
+                return [raw_bytes]
+            _, index = decoder.raw_decode(text, _JSON_WHITESPACE.match(text, index + 1).end())
+            index = _JSON_WHITESPACE.match(text, index).end()
+            if text[index] == ',':
+                index = _JSON_WHITESPACE.match(text, index + 1).end()
+            elif text[index] != '}':
+                return [raw_bytes]
+    except (UnicodeDecodeError, ValueError, IndexError):
+        return [raw_bytes]
+    if not starts:
+        return [raw_bytes]
+    
+    # The opening brace goes with the first key, the closing one with the last
+    bounds = [0] + starts[1:] + [len(text)]
+    return [text[start:end].encode('utf-8') for start, end in zip(bounds, bounds[1:])]
+
+def _store_history_version(snapshot):
+    """Store a version as content-addressed chunks unless it is already stored (history lock held)"""
+    import gzip
+    
+    digest = snapshot['hash']
+    if os.path.exists(_history_version_path(digest)) or os.path.exists(_history_object_path(digest)):
+        return
+    chunk_digests = []
+    for chunk in split_top_level_members(snapshot['raw']):
+        chunk_digest = hashlib.sha256(chunk).hexdigest()
+        chunk_path = _history_chunk_path(chunk_digest)
+        if not os.path.exists(chunk_path):
+            _write_atomic(chunk_path, gzip.compress(chunk, compresslevel=6, mtime=0))
+        chunk_digests.append(chunk_digest)
+    # Chunks first: a version file never points at a chunk that is not there yet
+    _write_atomic(_history_version_path(digest), gzip.compress(json.dumps(chunk_digests).encode('utf-8'), mtime=0))
+
+def _read_chunk_list(path):
+    """Return the chunk digests of a stored version"""
+    import gzip
+    
+    with open(path, 'rb') as f:
+        return json.loads(gzip.decompress(f.read()))
+
+def load_history():
+    """Return the history entries, oldest first"""
+    try:
+        with open(_history_index_path(), 'r', encoding='utf-8') as f:
+            lines = f.readlines()
+    except FileNotFoundError:
+        return []
+    
+    entries = []
+    for line in lines:
+        try:
+            entries.append(json.loads(line))
+        except json.JSONDecodeError:
+            continue  # A torn last line from an interrupted write
+    return entries
+
+def record_history(snapshot, action, target=None, only_new=False):
+    """Store a version (a snapshot) in the history and return its entry
+    
+    Recording the version that is already the latest entry for the same
+    target and action is a no-op, as is recording any known version with
+    only_new (used to save a copy that is about to be overwritten). Failures
+    only warn: history must never block a sync.
+    """
+    if history_keep <= 0 or not snapshot:
+        return None
+    target = target or primary_target()
+    
+    try:
+        with _history_lock:
+            _store_history_version(snapshot)
+            
+            entries = load_history()
+            if only_new and any(entry['hash'] == snapshot['hash'] for entry in entries):
+                return None
+            last = entries[-1] if entries else None
+            if last and (last['hash'], last['action'], last['target']) == (snapshot['hash'], action, target['name']):
+                return last
+            
+            entry = {
+                'id': last['id'] + 1 if last else 1,
+                'time': datetime.now().isoformat(timespec='seconds'),
+                'action': action,
+                'target': target['name'],
+                'hash': snapshot['hash'],
+                'size': snapshot['size']
+            }
+            with open(_history_index_path(), 'a', encoding='utf-8') as f:
+                f.write(json.dumps(entry) + "\n")
+            
+            if len(entries) + 1 > history_keep or history_max_age_days > 0:
+                _prune_history(entries + [entry])
+        return entry
+    except Exception as e:
+        console.print(f"[WARNING] Could not record version history: {e}", style="yellow")
+        return None
+
+def remember_overwritten(target=None, local=True, remote=True):
+    """Record the local file and/or cached remote content a sync is about to overwrite, if new"""
+    target = target or primary_target()
+    if local and local_path and os.path.exists(local_path):
+        record_history(get_local_snapshot(), 'local', target, only_new=True)
+    cached_remote = _snapshot_cache['remote'].get(target['name']) if remote else None
+    if cached_remote:
+        record_history(cached_remote, 'remote', target, only_new=True)
+
+def _prune_history(entries):
+    """Apply the retention policy and delete unreferenced objects (history lock held)"""
+    kept = entries
+    if history_max_age_days > 0:
+        cutoff = datetime.now().timestamp() - history_max_age_days * 86400
+        kept = [entry for entry in kept if datetime.fromisoformat(entry['time']).timestamp() >= cutoff]
+    kept = kept[-history_keep:]
+    if len(kept) == len(entries):
+        return 0
+    
+    _write_atomic(_history_index_path(), "".join(json.dumps(entry) + "\n" for entry in kept).encode('utf-8'))
+    
+    referenced = {entry['hash'] for entry in kept}
+    removed = 0
+    for digest, path in _iter_history_files('objects'):
+        if digest not in referenced:
+            os.unlink(path)
+            removed += 1
+    
+    used_chunks = set()
+    for digest, path in _iter_history_files('versions'):
+        if digest in referenced:
+            used_chunks.update(_read_chunk_list(path))
+        else:
+            os.unlink(path)
+            removed += 1
+    for digest, path in _iter_history_files('chunks'):
+        if digest not in used_chunks:
+            os.unlink(path)
+    return removed
+
+def find_history_entry(ref):
+    """Look up a history entry by SHA-256 prefix or ID (None if unknown or ambiguous)
+    
+    '#N' always means ID N. A bare number can be an ID or an all-digit hash
+    prefix; when it matches both it is reported as ambiguous.
+    """
+    entries = load_history()
+    ref = str(ref).strip().lower()
+    if ref.startswith('#') and ref[1:].isdigit():
+        matches = [entry for entry in entries if entry['id'] == int(ref[1:])]
+    else:
+        matches = {entry['hash']: entry for entry in entries if entry['hash'].startswith(ref)}
+        matches = list(matches.values()) if len(ref) >= 4 else []
+        if ref.isdigit():
+            id_matches = [entry for entry in entries if entry['id'] == int(ref)]
+            if matches and id_matches and matches != id_matches:
+                console.print(
+                    f"[ERROR] Ambiguous history version '{ref}' - it is both an ID and a hash prefix; "
+                    f"use '#{ref}' for the ID or a longer hash",
+                    style="red"
+                )
+                return None
+            matches = matches or id_matches
+    
+    if len(matches) != 1:
+        console.print(f"[ERROR] {'Ambiguous' if matches else 'Unknown'} history version '{ref}'", style="red")
+        return None
+    return matches[0]
+
+def load_history_version(entry):
+    """Return the snapshot of a history entry, checking it against its hash"""
+    import gzip
+    
+    version_path = _history_version_path(entry['hash'])
+    if os.path.exists(version_path):
+        chunks = []
+        for chunk_digest in _read_chunk_list(version_path):
+            with open(_history_chunk_path(chunk_digest), 'rb') as f:
+                chunks.append(gzip.decompress(f.read()))
+        snapshot = _make_snapshot(b"".join(chunks))
+    else:
+        with open(_history_object_path(entry['hash']), 'rb') as f:
+            snapshot = _make_snapshot(gzip.decompress(f.read()))
+    if snapshot['hash'] != entry['hash']:
+        raise Exception(f"history object {entry['hash'][:12]} is corrupt")
+    return snapshot
+
+def resolve_version(ref):
+    """Return (snapshot, label) for a history ID/hash prefix or 'local'; (None, None) if unavailable"""
+    if str(ref).lower() == 'local':
+        if not local_path or not os.path.exists(local_path):
+            console.print("[ERROR] Local file not found", style="red")
+            return None, None
+        return get_local_snapshot(), f"local ({local_path})"
+    entry = find_history_entry(ref)
+    if not entry:
+        return None, None
+    try:
+        return load_history_version(entry), f"version {entry['id']} ({entry['action']} {entry['time']})"
+    except Exception as e:
+        console.print(f"[ERROR] Cannot read history version {entry['id']}: {e}", style="red")
+        return None, None
+
+def display_history(entries):
+    """Display history entries, newest first"""
+    from rich.table import Table
+    
+    table = Table(title="🕘 Version History", border_style="blue")
+    table.add_column("ID", style="cyan", justify="right")
+    table.add_column("Time", style="yellow")
+    table.add_column("Action")
+    table.add_column("Target")
+    table.add_column("Size", style="green", justify="right")
+    table.add_column("SHA-256", style="magenta")
+    
+    for entry in reversed(entries):
+        table.add_row(str(entry['id']), entry['time'].replace('T', ' '), entry['action'], entry['target'],
+                      f"{entry['size']} bytes", entry['hash'][:12])
+    console.print(table)
+
+def rollback(ref, assume_yes=False):
+    """Restore a history version locally and push it to the remote
+    
+    Nothing is written before pre-flight passes and the rollback is
+    confirmed, and the previous local file is put back if the upload fails.
+    """
+    if not check_config():
+        return False
+    entry = find_history_entry(ref)
+    if not entry:
+        return False
+    try:
+        snapshot = load_history_version(entry)
+        snapshot_data(snapshot)
+    except Exception as e:
+        console.print(f"[ERROR] Cannot read history version {entry['id']}: {e}", style="red")
+        return False
+    
+    if not run_pre_flight_checks():
+        return False
+    label = f"version {entry['id']} ({entry['hash'][:12]})"
+    if not assume_yes:
+        status_info = get_file_status(fetch_content=True)
+        remote_snapshot = status_info and status_info['remote_snapshot']
+        if remote_snapshot:
+            diff = diff_snapshots(remote_snapshot, snapshot, "remote", label)
+            if diff is not None:
+                print_diff(diff, f"remote to {label}")
+        if not confirm(f"\n[bold yellow]Roll back local and remote to {label}?[/bold yellow]"):
+            console.print("[INFO] Rollback cancelled by user", style="yellow")
+            return False
+    
+    # Keep the version being replaced so the rollback itself can be undone
+    previous = get_local_snapshot() if os.path.exists(local_path) else None
+    remember_overwritten(remote=False)
+    _write_atomic(local_path, snapshot['raw'])
+    console.print(f"[SUCCESS] Restored {label} to {local_path}", style="green")
+    
+    base_before = get_base_snapshot()
+    if push(mode="full", assume_yes=True, pre_flight=False):
+        return True
+    # A push that reached the remote (only Node-RED failed) moved the last-synced base
+    base_after = get_base_snapshot()
+    if (base_after and base_after['key']) == (base_before and base_before['key']):
+        if previous:
+            _write_atomic(local_path, previous['raw'])
+        else:
+            os.unlink(local_path)
+        console.print("[INFO] Rollback not pushed - previous local file restored", style="yellow")
+    return False
+
+def show_history():
+    """List the version history, then optionally diff or roll back a version"""
+    entries = load_history()
+    if not entries:
+        console.print("[INFO] No versions recorded yet - pull or push to start the history", style="blue")
+        return True
+    display_history(entries[-DIFF_MAX_LINES:])
+    
+    choice = input("ID to diff against local, 'r ID' to roll back (Enter to go back): ").strip()
+    if not choice:
+        return True
+    rollback_requested = choice.lower().startswith('r ')
+    ref = choice[2:].strip() if rollback_requested else choice
+    # The prompt asks for an ID from the table above, so a bare number is one
+    ref = f"#{ref}" if ref.isdigit() else ref
+    if rollback_requested:
+        return rollback(ref)
+    
+    old_snapshot, old_label = resolve_version(ref)
+    new_snapshot, new_label = resolve_version('local')
+    if not old_snapshot:
+        return False
+    diff = diff_snapshots(old_snapshot, new_snapshot, old_label, new_label)
+    return diff is not None and print_diff(diff, f"{old_label} to {new_label}")
+
+def missing_target_settings(target):
+    """Return the settings a target still needs for its transport (the local one needs only a path)"""
+    required = ('path',) if (target.get('transport') or 'ssh').lower() == 'local' else ('user', 'host', 'path')
+    return [name for name in required if not target[name]]
+
+def check_config():
+    """Check that the required environment variables are set"""
+    target = primary_target()
+    missing = [f"REMOTE_{name.upper()}" for name in missing_target_settings(target)]
+    if not local_path:
+        missing.append("LOCAL_PATH")
+    if missing:
+        console.print("[ERROR] Missing required environment variables", style="red")
+        console.print(f"Missing: {', '.join(missing)}", style="red")
+        return False
+    return True
+
+_pre_flight_passed_at = None
+
+def invalidate_pre_flight():
+    """Forget the cached pre-flight result so the next action checks again"""
+    global _pre_flight_passed_at
+    _pre_flight_passed_at = None
+
+def _check_connection():
+    """Open the shared connection and test it"""
+    # Open the shared connection once; later checks and transfers reuse it
+    get_transport().connect()
+    return test_connection()
+
+@timed('pre_flight')
+def run_pre_flight_checks(force=False):
+    """Run all pre-flight validation checks, reusing a success for PREFLIGHT_TTL seconds"""
+    global _pre_flight_passed_at
+    if not force and _pre_flight_passed_at is not None:
+        age = time.monotonic() - _pre_flight_passed_at
+        if age < preflight_ttl:
+            console.print(f"[INFO] Pre-flight checks passed {age:.0f}s ago - skipping", style="blue")
+            return True
+    
+    console.print("[INFO] Running pre-flight checks...", style="blue")
+    
+    # Check environment variables
+    if not check_config():
+        return False
+    
+    # The SSH key check is local and the connection test remote; run them side by side
+    try:
+        needs_ssh_key = get_transport().needs_ssh_key
+    except FatalError as e:
+        console.print(f"[ERROR] {e}", style="red")
+        return False
+    with ThreadPoolExecutor(max_workers=2) as pool:
+        key_check = pool.submit(validate_ssh_key) if needs_ssh_key else None
+        connection_check = pool.submit(_check_connection)
+        checks_passed = (key_check is None or key_check.result()) and connection_check.result()
+    if not checks_passed:
+        return False
+    
+    _pre_flight_passed_at = time.monotonic()
+    console.print("[SUCCESS] Pre-flight checks completed", style="green")
+    return True
+
+def pull():
+    if not run_pre_flight_checks():
+        return False
         
+    def _pull_operation():
+        console.print("\n[INFO] Pulling remote file to local...", style="blue")
+        get_transport().download(local_path)
+        return True
+    
+    remember_overwritten(remote=False)
+    try:
+        success = retry_operation(_pull_operation, name='download')
+        if success:
+            console.print("[SUCCESS] Pull complete.", style="green")
+            # Validate the pulled JSON file
+            if local_path and validate_json_file(local_path, standalone=True):
+                console.print("[SUCCESS] Downloaded file validated successfully", style="green")
+                seed_remote_snapshot(get_local_snapshot())
+                save_sync_snapshot(local_path)
+                record_history(get_local_snapshot(), 'pull')
+        return success
     except Exception as e:
-        console.print(f"[ERROR] Failed to generate diff: {e}", style="red")
+        console.print(f"[ERROR] Pull failed after all retries: {e}", style="red")
+        invalidate_pre_flight()
+        return False
+
+def upload_local_file(target=None):
+    """Copy the local file over a target's remote file"""
+    target = target or primary_target()
+    console.print(f"\n[INFO] Pushing local file to remote ({target['name']})...", style="blue")
+    get_transport(target).upload(local_path)
+    return True
+
+def push(mode=None, assume_yes=False, pre_flight=True):
+    mode = (mode or push_mode).lower()
+    if mode not in ("full", "delta"):
+        console.print(f"[ERROR] Unknown push mode '{mode}' (expected full or delta)", style="red")
+        return False
+    
+    if pre_flight and not run_pre_flight_checks():
+        return False
+    
+    # Validate local JSON file before pushing
+    if not local_path or not validate_json_file(local_path):
+        console.print("[ERROR] Local JSON validation failed. Aborting push.", style="red")
+        return False
+    
+    key_report = check_global_key_refs()
+    if mode == "delta":
+        return push_delta(assume_yes=assume_yes, key_report=key_report)
+    
+    # Get current status and ask for confirmation (skipped for unattended pushes)
+    status_info = None if assume_yes else get_file_status()
+    if status_info and not status_info['files_identical']:
+        console.print("\n[INFO] Files are different. Showing detailed diff:", style="blue")
+        show_detailed_diff(status_info)
+        
+        if not confirm("\n[bold yellow]Continue with push?[/bold yellow]"):
+            console.print("[INFO] Push cancelled by user", style="yellow")
+            return False
+    
+    remember_overwritten(local=False)
+    try:
+        success = retry_operation(upload_local_file, name='upload')
+    except Exception as e:
+        console.print(f"[ERROR] Push failed after all retries: {e}", style="red")
+        invalidate_pre_flight()
+        return False
+    if not success:
+        return False
+    
+    seed_remote_snapshot(get_local_snapshot())
+    save_sync_snapshot(local_path)
+    record_history(get_local_snapshot(), 'push')
+    console.print("[SUCCESS] Remote file updated.", style="green")
+    
+    # The push is only complete once Node-RED has applied (and confirmed) the file
+    if not webhook_configured():
+        console.print("[WARNING] Webhook URL or auth secret not set - Node-RED was not notified", style="yellow")
+        return True
+    if not send_webhook(version=get_local_snapshot()['hash']):
+        console.print("[ERROR] Push incomplete: the remote file is updated but Node-RED did not apply it", style="red")
+        return False
+    save_sync_snapshot(local_path, kind='applied')
+    console.print("[SUCCESS] Push complete.", style="green")
+    return True
 
-def retry_operation(func, max_retries=3, delay=1):
-    """Retry an operation with exponential backoff"""
-    for attempt in range(max_retries):
+def push_delta(assume_yes=False, key_report=None):
+    """Post only the top-level keys changed since the last applied push to the webhook
+    
+    The delta base is what Node-RED last confirmed, falling back to the
+    last-synced file and then to the remote file. The last-synced base only
+    moves when the remote file is written too (SYNC_DELTA_COPY_FILE).
+    """
+    try:
+        local_data = snapshot_data(get_local_snapshot())
+    except Exception as e:
+        console.print(f"[ERROR] Failed to read local file: {e}", style="red")
+        return False
+    
+    base_data = load_sync_snapshot(kind='applied')
+    if base_data is None:
+        base_data = load_sync_snapshot()
+    if base_data is None:
+        console.print("[INFO] No last-synced snapshot yet, using the remote file as the delta base", style="blue")
+        remote_info = get_remote_file_info()
+        remote_snapshot = get_remote_snapshot(
+            remote_info['hash'] if remote_info else None, remote_size=remote_info['size'] if remote_info else None
+        )
+        if not remote_snapshot:
+            console.print("[ERROR] Cannot compute delta - remote file unavailable", style="red")
+            return False
         try:
-            result = func()
-            return result
+            base_data = snapshot_data(remote_snapshot)
         except Exception as e:
-            if attempt == max_retries - 1:
-                raise e
-            
-            wait_time = delay * (2 ** attempt)
-            console.print(f"[WARNING] Attempt {attempt + 1} failed: {e}", style="yellow")
-            console.print(f"[INFO] Retrying in {wait_time} seconds...", style="blue")
-            time.sleep(wait_time)
+            console.print(f"[ERROR] Remote file is not valid JSON: {e}", style="red")
+            return False
+    
+    if not isinstance(local_data, dict) or not isinstance(base_data, dict):
+        console.print("[ERROR] Delta push requires a JSON object at the top level. Use a full push.", style="red")
+        return False
+    
+    delta = compute_key_delta(base_data, local_data)
+    if not delta['set'] and not delta['delete']:
+        console.print("[INFO] No key changes since the last sync - nothing to push", style="green")
+        return True
+    
+    display_key_delta(delta)
+    if not assume_yes and not confirm("\n[bold yellow]Send these key changes to Node-RED?[/bold yellow]"):
+        console.print("[INFO] Push cancelled by user", style="yellow")
+        return False
+    
+    try:
+        if delta_copy_file:
+            retry_operation(upload_local_file, name='upload')
+            seed_remote_snapshot(get_local_snapshot())
+            save_sync_snapshot(local_path)
+    except Exception as e:
+        console.print(f"[ERROR] Push failed after all retries: {e}", style="red")
+        invalidate_pre_flight()
+        return False
+    
+    if not send_webhook(build_delta_payload(delta, key_report), version=get_local_snapshot()['hash']):
+        console.print("[ERROR] Delta push failed - last-applied snapshot left unchanged", style="red")
+        return False
+    
+    save_sync_snapshot(local_path, kind='applied')
+    record_history(get_local_snapshot(), 'push_delta')
+    console.print(
+        f"[SUCCESS] Delta push complete: {len(delta['set'])} key(s) set, {len(delta['delete'])} deleted.",
+        style="green"
+    )
+    return True
+
+# ==== THREE-WAY MERGE ====
+
+_MISSING = object()
+
+def _same_json(a, b):
+    """Compare two JSON values (or _MISSING) for equality"""
+    if a is _MISSING or b is _MISSING:
+        return a is b
+    return _canonical_json(a) == _canonical_json(b)
+
+def three_way_merge(base, local, remote, resolve=None, path="$"):
+    """Merge local and remote edits of a JSON object against their last-synced base
+    
+    A key changed on one side only takes that side's value, and objects
+    changed on both sides are merged key by key. Keys both sides changed
+    differently are passed to resolve(path, base, local, remote), which
+    returns 'local', 'remote' or None; unresolved ones keep the local value
+    and are reported. Returns (merged, taken, conflicts) where taken lists
+    (path, side) for every value that came from one side.
+    """
+    merged = {}
+    taken = []
+    conflicts = []
+    
+    for key in itertools.chain(local, (key for key in remote if key not in local)):
+        key_path = _json_path_key(path, key)
+        base_value = base.get(key, _MISSING)
+        local_value = local.get(key, _MISSING)
+        remote_value = remote.get(key, _MISSING)
+        
+        if _same_json(local_value, remote_value):
+            value = local_value
+        elif _same_json(local_value, base_value):
+            value = remote_value
+            taken.append((key_path, 'remote'))
+        elif _same_json(remote_value, base_value):
+            value = local_value
+            taken.append((key_path, 'local'))
+        elif all(isinstance(v, dict) for v in (base_value, local_value, remote_value)):
+            value, nested_taken, nested_conflicts = three_way_merge(
+                base_value, local_value, remote_value, resolve, key_path
+            )
+            taken.extend(nested_taken)
+            conflicts.extend(nested_conflicts)
+        else:
+            side = resolve(key_path, base_value, local_value, remote_value) if resolve else None
+            if side in ('local', 'remote'):
+                value = local_value if side == 'local' else remote_value
+                taken.append((key_path, side))
+            else:
+                value = local_value
+                conflicts.append((key_path, base_value, local_value, remote_value))
+        
+        if value is not _MISSING:
+            merged[key] = value
+    
+    return merged, taken, conflicts
+
+def _format_merge_value(value):
+    """Render one side of a conflict, including a missing (deleted) key"""
+    return "(deleted)" if value is _MISSING else _format_diff_value(value)
+
+def ask_conflict_resolution(path, base, local, remote):
+    """Ask which side of a same-key conflict to keep (None leaves it unresolved)"""
+    from rich.prompt import Prompt
+    
+    console.print(f"\n[bold red]Conflict:[/bold red] {path}")
+    console.print(f"  base:   {_format_merge_value(base)}", style="dim")
+    console.print(f"  local:  {_format_merge_value(local)}", style="green")
+    console.print(f"  remote: {_format_merge_value(remote)}", style="blue")
+    choice = Prompt.ask("Keep which value?", choices=["local", "remote", "skip"], default="skip")
+    return None if choice == "skip" else choice
+
+def display_merge(taken, conflicts):
+    """Display where each merged value comes from and any unresolved conflicts"""
+    from rich.table import Table
+    
+    table = Table(title="🔀 Three-way Merge", border_style="blue")
+    table.add_column("Path", style="cyan")
+    table.add_column("Taken from", width=12)
+    
+    for path, side in itertools.islice(taken, DIFF_MAX_LINES):
+        table.add_row(path, "[green]local[/green]" if side == 'local' else "[blue]remote[/blue]")
+    for path, base, local, remote in itertools.islice(conflicts, DIFF_MAX_LINES):
+        table.add_row(path, "[red]conflict[/red]")
+    
+    console.print(table)
+    if len(taken) > DIFF_MAX_LINES or len(conflicts) > DIFF_MAX_LINES:
+        console.print(f"... (more paths truncated after {DIFF_MAX_LINES})", style="dim")
+    for path, base, local, remote in conflicts[:DIFF_MAX_LINES]:
+        console.print(
+            f"[ERROR] Conflict at {path}: local {_format_merge_value(local)} "
+            f"vs remote {_format_merge_value(remote)} (base {_format_merge_value(base)})",
+            style="red"
+        )
+    if conflicts:
+        console.print(
+            f"[ERROR] {len(conflicts)} path(s) changed differently on both sides - "
+            "nothing written (resolve them, or prefer local/remote)",
+            style="red"
+        )
+
+def prepare_merge(status_info, resolve=None):
+    """Merge the local and remote content of a status check against the last-synced base
+    
+    Returns a dict with the merged document, taken paths and conflicts, or
+    None when there is no base or either side cannot be merged.
+    """
+    target = status_info['target']
+    base_data = load_sync_snapshot(target)
+    if base_data is None:
+        console.print("[ERROR] No last-synced snapshot to merge against - pull or push once first", style="red")
+        return None
+    
+    if not status_info.get('remote_snapshot'):
+        status_info['remote_snapshot'] = get_remote_snapshot(status_info['remote_hash'], target, status_info['remote_size'])
+        if not status_info['remote_snapshot']:
+            console.print("[ERROR] Cannot merge - remote file unavailable", style="red")
+            return None
+    
+    try:
+        local_data = snapshot_data(status_info['local_snapshot'])
+        remote_data = snapshot_data(status_info['remote_snapshot'])
+    except json.JSONDecodeError as e:
+        console.print(f"[ERROR] Cannot merge - file is not valid JSON: {e}", style="red")
+        return None
+    
+    if not all(isinstance(data, dict) for data in (base_data, local_data, remote_data)):
+        console.print("[ERROR] Merge requires a JSON object at the top level", style="red")
+        return None
+    
+    merged, taken, conflicts = three_way_merge(base_data, local_data, remote_data, resolve)
+    return {
+        'merged': merged,
+        'taken': taken,
+        'conflicts': conflicts,
+        'local_data': local_data,
+        'remote_data': remote_data
+    }
+
+def apply_merge(status_info, plan):
+    """Write a conflict-free merge locally and push it to the remote"""
+    merged = plan['merged']
+    remote_snapshot = status_info['remote_snapshot']
+    takes_local = not _same_json(merged, plan['remote_data'])
+    
+    remember_overwritten(status_info['target'])
+    try:
+        if not takes_local:
+            # Only remote edits: keep the remote bytes as they are (a pull without the transfer)
+            _write_atomic(local_path, remote_snapshot['raw'])
+            console.print("[SUCCESS] Local file updated with the remote changes.", style="green")
+        elif not _same_json(merged, plan['local_data']):
+            # Node-RED's file context store writes 4-space indented JSON
+            _write_atomic(local_path, json.dumps(merged, indent=4, ensure_ascii=False).encode('utf-8'))
+            console.print("[SUCCESS] Local file updated with the merge.", style="green")
+    except Exception as e:
+        console.print(f"[ERROR] Could not write merged file: {e}", style="red")
+        return False
+    
+    if not takes_local:
+        seed_remote_snapshot(get_local_snapshot())
+        save_sync_snapshot(local_path)
+        record_history(get_local_snapshot(), 'merge')
+        return True
+    
+    if not validate_json_file(local_path):
+        console.print("[ERROR] Merged file failed validation. Aborting push.", style="red")
+        return False
+    
+    try:
+        retry_operation(upload_local_file, name='upload')
+    except Exception as e:
+        console.print(f"[ERROR] Push failed after all retries: {e}", style="red")
+        invalidate_pre_flight()
+        return False
+    
+    seed_remote_snapshot(get_local_snapshot())
+    save_sync_snapshot(local_path)
+    record_history(get_local_snapshot(), 'merge')
+    console.print("[SUCCESS] Merged file pushed.", style="green")
+    
+    # Live globals already hold the remote edits; only send the keys the local side changed
+    delta = compute_key_delta(plan['remote_data'], merged)
+    if (delta['set'] or delta['delete']) and webhook_configured():
+        if not send_webhook(build_delta_payload(delta), version=get_local_snapshot()['hash']):
+            console.print("[ERROR] Merge pushed, but Node-RED did not apply the changed keys", style="red")
+            return False
+        save_sync_snapshot(local_path, kind='applied')
+    return True
+
+def plan_merge(prefer=None, interactive=False):
+    """Fetch both sides and merge them against the last-synced base
+    
+    Same-key conflicts are settled by prefer ('local' or 'remote') or, when
+    interactive, by asking. Returns (status_info, plan); plan is None when
+    the files are identical or nothing could be merged.
+    """
+    if not run_pre_flight_checks():
+        return None, None
+    
+    status_info = get_file_status(fetch_content=True)
+    if not status_info or status_info['status'] == 'remote_unavailable':
+        console.print("[ERROR] Cannot merge - remote file unavailable", style="red")
+        return None, None
+    if status_info['files_identical']:
+        console.print("[INFO] Files are identical - nothing to merge", style="green")
+        return status_info, None
+    
+    def resolve(*conflict):
+        if prefer:
+            return prefer
+        return ask_conflict_resolution(*conflict) if interactive else None
+    
+    return status_info, prepare_merge(status_info, resolve)
+
+def merge(prefer=None, assume_yes=False):
+    """Three-way merge local and remote edits made since the last sync"""
+    status_info, plan = plan_merge(prefer, interactive=sys.stdin.isatty() and not assume_yes)
+    if plan is None:
+        return bool(status_info and status_info['files_identical'])
+    
+    display_merge(plan['taken'], plan['conflicts'])
+    if plan['conflicts']:
+        return False
+    
+    if not assume_yes and not confirm("\n[bold yellow]Apply the merge to local and remote?[/bold yellow]"):
+        console.print("[INFO] Merge cancelled by user", style="yellow")
+        return False
+    return apply_merge(status_info, plan)
+
+# ==== FLEET (MULTI-TARGET) SYNC ====
+
+def run_on_targets(operation, target_list=None):
+    """Run operation(target) against targets in parallel with a bounded worker pool
+    
+    operation returns a short detail string on success and raises on failure.
+    Returns one result dict per target, in inventory order.
+    """
+    target_list = target_list or targets
+    results = {}
+    
+    def _timed(target):
+        _metrics_context.target = target['name']
+        started = time.monotonic()
+        try:
+            detail = operation(target)
+            return {'target': target, 'ok': True, 'detail': detail, 'seconds': time.monotonic() - started}
+        except Exception as e:
+            return {'target': target, 'ok': False, 'detail': str(e), 'seconds': time.monotonic() - started}
+    
+    workers = max(1, min(fleet_max_workers, len(target_list)))
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(_timed, target) for target in target_list]
+        for future in as_completed(futures):
+            result = future.result()
+            results[result['target']['name']] = result
+    
+    return [results[target['name']] for target in target_list]
+
+def display_fleet_results(title, results):
+    """Display a per-host result table for a fleet operation"""
+    from rich.table import Table
+    
+    table = Table(title=title, border_style="blue")
+    table.add_column("Target", style="cyan")
+    table.add_column("Host", style="dim")
+    table.add_column("Result", width=8)
+    table.add_column("Detail")
+    table.add_column("Time", justify="right", width=8)
+    
+    for result in results:
+        target = result['target']
+        table.add_row(
+            target['name'],
+            target['host'] or "-",
+            "[green]OK[/green]" if result['ok'] else "[red]FAILED[/red]",
+            result['detail'] or "",
+            f"{result['seconds']:.2f}s"
+        )
+    
+    console.print(table)
+
+def _fleet_check_target(target):
+    """Open the target's shared connection and verify it answers"""
+    missing = missing_target_settings(target)
+    if missing:
+        raise Exception(f"incomplete target ({', '.join(missing)} required)")
+    
+    transport = get_transport(target)
+    transport.connect()
+    transport.check()
+    return "reachable"
+
+def _fleet_status_target(target):
+    """Compare a target's remote hash with the local file"""
+    remote_info = get_remote_file_info(target)
+    if not remote_info:
+        raise Exception("remote file unavailable")
+    if remote_info['hash'] == get_local_snapshot()['hash']:
+        return "identical"
+    return f"differs (remote {remote_info['hash'][:12]}, {remote_info['size']} bytes)"
+
+def _fleet_push_target(target):
+    """Push the local file to one target and notify its Node-RED instance
+    
+    File copy and webhook delivery are tracked separately: a host whose file
+    already matches but whose Node-RED has not applied this version (e.g. the
+    webhook failed on an earlier attempt) only gets the webhook again.
+    """
+    local_snapshot = get_local_snapshot()
+    remote_info = get_remote_file_info(target)
+    file_current = bool(remote_info) and remote_info['hash'] == local_snapshot['hash']
+    notify = webhook_configured(target)
+    applied = get_base_snapshot(target, kind='applied') if notify else None
+    if file_current and (not notify or (applied and applied['hash'] == local_snapshot['hash'])):
+        return "already up to date"
+    
+    if not file_current:
+        remember_overwritten(target, local=False)
+        retry_operation(lambda: upload_local_file(target), name='upload')
+        seed_remote_snapshot(local_snapshot, target)
+        save_sync_snapshot(local_path, target)
+        record_history(local_snapshot, 'push', target)
+    
+    if not notify:
+        return "pushed (no webhook configured)"
+    _require(send_webhook(target=target, version=local_snapshot['hash']),
+             "webhook failed (file copied)" if not file_current else "webhook failed")
+    save_sync_snapshot(local_path, target, kind='applied')
+    return "pushed, webhook sent" if not file_current else "file already current, webhook re-sent"
+
+def _require(ok, message):
+    """Raise when a boolean-returning step failed, so retry_operation retries it"""
+    if not ok:
+        raise Exception(message)
+    return ok
+
+def fleet_pre_flight_checks(target_list=None):
+    """Run the local checks once, then per-host connection checks in parallel"""
+    console.print(f"[INFO] Running pre-flight checks on {len(target_list or targets)} target(s)...", style="blue")
+    
+    if not local_path:
+        console.print("[ERROR] Missing required environment variables", style="red")
+        console.print("Missing: LOCAL_PATH", style="red")
+        return []
+    
+    # Local-only fleets need no SSH key; unknown transports are reported per host below
+    uses_ssh = any(getattr(TRANSPORTS.get((target.get('transport') or 'ssh').lower()), 'needs_ssh_key', False)
+                   for target in target_list or targets)
+    if uses_ssh and not validate_ssh_key():
+        return []
+    
+    results = run_on_targets(_fleet_check_target, target_list)
+    display_fleet_results("🛡️ Fleet Pre-flight", results)
+    return [result['target'] for result in results if result['ok']]
+
+def fleet_status():
+    """Show the sync status of every target"""
+    reachable = fleet_pre_flight_checks()
+    if not reachable:
+        return False
     
-    return False
+    if not os.path.exists(local_path):
+        console.print("[ERROR] Local file not found", style="red")
+        return False
+    
+    results = run_on_targets(_fleet_status_target, reachable)
+    display_fleet_results("📊 Fleet Status", results)
+    return all(result['ok'] for result in results)
 
-def send_webhook():
-    """Send webhook notification to update Node-RED global context"""
-    webhook_url = os.getenv('NODE-RED_GLOBAL_WEBHOOK')
-    auth_secret = os.getenv('AUTH_SECRET')
+def fleet_push():
+    """Push the local file to every target in parallel, retrying failed hosts on request"""
+    if not local_path or not validate_json_file(local_path):
+        console.print("[ERROR] Local JSON validation failed. Aborting push.", style="red")
+        return False
     
-    if not webhook_url or not auth_secret:
-        console.print("[WARNING] Webhook URL or auth secret not found in .env file. Skipping webhook.", style="yellow")
+    check_global_key_refs()
+    pending = fleet_pre_flight_checks()
+    if not pending:
         return False
     
-    try:
-        headers = {
-            'Content-Type': 'application/json',
-            'Authorization': f'Bearer {auth_secret}'
-        }
-        
-        payload = {
-            'action': 'update_global_context',
-            'timestamp': datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        }
-        
-        console.print("[INFO] Sending webhook to update Node-RED global context...", style="blue")
-        response = requests.post(webhook_url, json=payload, headers=headers, timeout=10)
+    if not confirm(f"\n[bold yellow]Push local file to {len(pending)} target(s)?[/bold yellow]"):
+        console.print("[INFO] Push cancelled by user", style="yellow")
+        return False
+    
+    while True:
+        started = time.monotonic()
+        results = run_on_targets(_fleet_push_target, pending)
+        display_fleet_results("🚀 Fleet Push", results)
+        console.print(f"[INFO] Fleet push finished in {time.monotonic() - started:.2f}s", style="blue")
         
-        if response.status_code == 200:
-            console.print("[SUCCESS] Webhook sent successfully.", style="green")
+        pending = [result['target'] for result in results if not result['ok']]
+        if not pending:
+            console.print("[SUCCESS] All targets are in sync.", style="green")
             return True
-        else:
-            console.print(f"[WARNING] Webhook returned status code {response.status_code}", style="yellow")
+        if not confirm(f"\n[bold yellow]Retry {len(pending)} failed target(s)?[/bold yellow]"):
             return False
-            
+
+# ==== FUNCTION-NODE SCRIPTS ====
+# Batch sync of the repo's Function-node scripts. One round trip hashes every
+# file under the target's scripts_dir; only new or changed files are copied,
+# in parallel over the target's shared connection, and a single scripts_synced
+# webhook records the new manifest instead of one operation per file.
+# Function-node code itself lives in flows.json: copying a script does not
+# change a deployed node until it is pasted in (or a flow loads it from disk).
+
+def list_script_files():
+    """Return the scripts to sync relative to SCRIPTS_ROOT (git-tracked files when it is a checkout)"""
+    try:
+        result = subprocess.run(["git", "-C", scripts_root, "ls-files", "-z", "--", *scripts_patterns],
+                                capture_output=True, timeout=10)
+        if result.returncode == 0:
+            paths = [path for path in result.stdout.decode('utf-8').split('\0') if path]
+            return sorted(path for path in paths if os.path.isfile(os.path.join(scripts_root, path)))
+    except (OSError, subprocess.TimeoutExpired):
+        pass
+    
+    # Not a git checkout: every matching file outside hidden directories
+    paths = []
+    for directory, subdirs, files in os.walk(scripts_root):
+        subdirs[:] = [name for name in subdirs if not name.startswith('.') and name != 'node_modules']
+        for name in files:
+            path = os.path.relpath(os.path.join(directory, name), scripts_root).replace(os.sep, '/')
+            if script_selected(path):
+                paths.append(path)
+    return sorted(paths)
+
+def script_selected(path):
+    """Return True when a relative path matches SCRIPTS_PATTERNS"""
+    return any(fnmatch.fnmatch(path, pattern) for pattern in scripts_patterns)
+
+def local_script_manifest(paths):
+    """Map each relative path to the SHA-256 of the local file"""
+    manifest = {}
+    for path in paths:
+        with open(os.path.join(scripts_root, path), 'rb') as f:
+            manifest[path] = hashlib.sha256(f.read()).hexdigest()
+    return manifest
+
+def manifest_digest(manifest):
+    """Return one SHA-256 identifying a whole manifest"""
+    lines = "".join(f"{digest}  {path}\n" for path, digest in sorted(manifest.items()))
+    return hashlib.sha256(lines.encode('utf-8')).hexdigest()
+
+@timed('scripts_manifest')
+def get_remote_script_manifest(target=None):
+    """Hash every file under a target's scripts_dir in one round trip; None on failure"""
+    transport = get_transport(target)
+    try:
+        return retry_operation(lambda: transport.hash_tree(transport.target['scripts_dir']), name='scripts_manifest')
     except Exception as e:
-        console.print(f"[ERROR] Failed to send webhook: {e}", style="red")
+        console.print(f"[WARNING] Could not hash remote scripts: {e}", style="yellow")
+        return None
+
+def plan_script_sync(local_manifest, remote_manifest):
+    """Compare two manifests: new, changed and remote-only files"""
+    return {
+        'added': sorted(path for path in local_manifest if path not in remote_manifest),
+        'changed': sorted(path for path in local_manifest
+                          if path in remote_manifest and remote_manifest[path] != local_manifest[path]),
+        'removed': sorted(path for path in remote_manifest if path not in local_manifest and script_selected(path)),
+        'unchanged': sum(1 for path in local_manifest if remote_manifest.get(path) == local_manifest[path]),
+        'manifest': manifest_digest(local_manifest)
+    }
+
+def display_script_plan(plan, delete=False):
+    """Show the files a script sync would copy or delete"""
+    from rich.table import Table
+    
+    table = Table(title="📜 Function-Node Scripts", show_header=True, header_style="bold blue")
+    table.add_column("Script", style="cyan")
+    table.add_column("Change", justify="center")
+    for path in plan['added']:
+        table.add_row(path, "[green]new[/green]")
+    for path in plan['changed']:
+        table.add_row(path, "[yellow]changed[/yellow]")
+    for path in plan['removed']:
+        table.add_row(path, "[red]delete[/red]" if delete else "[dim]remote only[/dim]")
+    if plan['added'] or plan['changed'] or plan['removed']:
+        console.print(table)
+    console.print(
+        f"[INFO] {len(plan['added'])} new, {len(plan['changed'])} changed, {plan['unchanged']} unchanged, "
+        f"{len(plan['removed'])} only on the remote",
+        style="blue"
+    )
+
+def _upload_script(path, target):
+    """Copy one script to the same relative path under the target's scripts_dir"""
+    with span('script_upload', file=path):
+        get_transport(target).upload(os.path.join(scripts_root, path), posixpath.join(target['scripts_dir'], path))
+    return True
+
+def _run_batch_step(step, description):
+    """Run one remote batch step under the retry policy; False (with an error) on failure"""
+    try:
+        retry_operation(step, name='scripts_batch')
+        return True
+    except Exception as e:
+        console.print(f"[ERROR] Could not {description}: {e}", style="red")
         return False
 
-def run_pre_flight_checks():
-    """Run all pre-flight validation checks"""
-    console.print("[INFO] Running pre-flight checks...", style="blue")
+def apply_script_sync(plan, target=None, delete=False):
+    """Copy new/changed scripts in parallel, optionally delete remote-only ones, then notify once"""
+    target = target or primary_target()
+    uploads = plan['added'] + plan['changed']
+    deletions = plan['removed'] if delete else []
+    if not uploads and not deletions:
+        console.print("[SUCCESS] Scripts are already in sync.", style="green")
+        return True
     
-    # Check environment variables
-    if not all([remote_user, remote_host, remote_path, local_path]):
-        console.print("[ERROR] Missing required environment variables", style="red")
-        missing = []
-        if not remote_user: missing.append("REMOTE_USER")
-        if not remote_host: missing.append("REMOTE_HOST") 
-        if not remote_path: missing.append("REMOTE_PATH")
-        if not local_path: missing.append("LOCAL_PATH")
-        console.print(f"Missing: {', '.join(missing)}", style="red")
+    # Create every missing directory in one round trip before the parallel copies
+    transport = get_transport(target)
+    directories = sorted({posixpath.dirname(posixpath.join(target['scripts_dir'], path)) for path in uploads})
+    if directories and not _run_batch_step(lambda: transport.makedirs(directories), "create script directories"):
         return False
     
-    # Validate SSH configuration
-    if not validate_ssh_key():
+    failed = []
+    if uploads:
+        console.print(f"[INFO] Copying {len(uploads)} script(s) to {target['name']}...", style="blue")
+        with ThreadPoolExecutor(max_workers=max(1, min(scripts_max_workers, len(uploads)))) as pool:
+            futures = {
+                pool.submit(retry_operation, functools.partial(_upload_script, path, target), name='script_upload'): path
+                for path in uploads
+            }
+            for future in as_completed(futures):
+                try:
+                    future.result()
+                except Exception as e:
+                    failed.append(futures[future])
+                    console.print(f"[ERROR] {futures[future]}: {e}", style="red")
+    if failed:
+        console.print(f"[ERROR] {len(failed)} script(s) failed to copy - notification skipped", style="red")
         return False
     
-    # Test SSH connection
-    if not test_ssh_connection():
+    if deletions and not _run_batch_step(
+        lambda: transport.remove([posixpath.join(target['scripts_dir'], path) for path in deletions]),
+        "delete remote-only scripts"
+    ):
         return False
-        
-    console.print("[SUCCESS] Pre-flight checks completed", style="green")
-    return True
+    
+    console.print(f"[SUCCESS] Scripts synced: {len(uploads)} copied, {len(deletions)} deleted.", style="green")
+    if not webhook_configured(target):
+        console.print("[WARNING] Webhook URL or auth secret not set - Node-RED was not told about the new scripts",
+                      style="yellow")
+        return True
+    return send_webhook({
+        'action': 'scripts_synced',
+        'files': uploads,
+        'deleted': deletions,
+        'manifest': plan['manifest'],
+        'timestamp': datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    }, target=target)
 
-def pull():
-    if not run_pre_flight_checks():
-        return False
-        
-    def _pull_operation():
-        cmd = [
-            "scp",
-            f"{remote_user}@{remote_host}:{remote_path}",
-            local_path
-        ]
-        console.print("\n[INFO] Pulling remote file to local...", style="blue")
-        console.print(" ".join(cmd), style="dim")
-        result = subprocess.run(cmd, shell=False)
-        if result.returncode != 0:
-            raise Exception("SCP pull failed")
-        return result.returncode == 0
+def prepare_script_sync(target=None):
+    """Hash local and remote scripts and return the sync plan, or None on failure"""
+    target = target or primary_target()
+    if not target.get('scripts_dir'):
+        console.print("[ERROR] SCRIPTS_REMOTE_DIR (or scripts_dir for this target) is not set", style="red")
+        return None
     
     try:
-        success = retry_operation(_pull_operation)
-        if success:
-            console.print("[SUCCESS] Pull complete.", style="green")
-            # Validate the pulled JSON file
-            if local_path and validate_json_file(local_path):
-                console.print("[SUCCESS] Downloaded file validated successfully", style="green")
-        return success
+        local_manifest = local_script_manifest(list_script_files())
+    except OSError as e:
+        console.print(f"[ERROR] Could not read local scripts: {e}", style="red")
+        return None
+    remote_manifest = get_remote_script_manifest(target)
+    if remote_manifest is None:
+        return None
+    return plan_script_sync(local_manifest, remote_manifest)
+
+# ==== GLOBAL KEY REFERENCES ====
+# Index of the global keys the Function-node scripts read and write, cached in
+# SYNC_KEY_INDEX per file (size + mtime) so a push only rescans what changed.
+# Dynamic keys ('tag-whitelist_' + name, `prefix_${x}`) are kept as prefixes.
+
+_KEY_INDEX_VERSION = 1
+_JS_COMMENT = re.compile(r"/\*.*?\*/|^\s*//[^\n]*", re.DOTALL | re.MULTILINE)
+_KEY_PATH_SEPARATOR = re.compile(r"[.\[]")
+_GLOBAL_CALL = re.compile(
+    r"""\bglobal\.(get|set)\(\s*(?:'([^'\\\n]*)'|"([^"\\\n]*)"|`([^`\\$]*)(\$\{)?[^`]*`)\s*(\+)?"""
+)
+
+def scan_global_keys(source):
+    """Return the literal keys and dynamic key prefixes read/written by one script"""
+    refs = {'get': set(), 'set': set(), 'get_prefixes': set()}
+    for match in _GLOBAL_CALL.finditer(_JS_COMMENT.sub("", source)):
+        call, single, double, template, interpolated, concatenated = match.groups()
+        key = next(value for value in (single, double, template) if value is not None)
+        # 'sensorMappings.file' and 'list[0]' address properties of a top-level key
+        root = _KEY_PATH_SEPARATOR.split(key, 1)[0]
+        if (interpolated or concatenated) and root == key:
+            if call == 'get' and key:
+                refs['get_prefixes'].add(key)
+        elif root:
+            refs[call].add(root)
+    return {name: sorted(values) for name, values in refs.items()}
+
+def _load_key_index():
+    """Read the cached index, starting afresh when it is missing, stale or from another root"""
+    try:
+        with open(key_index_path, 'r', encoding='utf-8') as f:
+            index = json.load(f)
+        if index.get('version') == _KEY_INDEX_VERSION and index.get('root') == scripts_root:
+            return index
+    except (OSError, ValueError, AttributeError):
+        pass
+    return {'version': _KEY_INDEX_VERSION, 'root': scripts_root, 'files': {}}
+
+@timed('key_index')
+def update_key_index():
+    """Bring the cached index up to date, rescanning only new or modified scripts"""
+    index = _load_key_index()
+    cached = index['files']
+    files = {}
+    rescanned = 0
+    for path in list_script_files():
+        try:
+            stat = os.stat(os.path.join(scripts_root, path))
+        except OSError:
+            continue
+        entry = cached.get(path)
+        if not entry or entry['size'] != stat.st_size or entry['mtime_ns'] != stat.st_mtime_ns:
+            try:
+                with open(os.path.join(scripts_root, path), 'r', encoding='utf-8', errors='replace') as f:
+                    refs = scan_global_keys(f.read())
+            except OSError as e:
+                console.print(f"[WARNING] Could not scan {path}: {e}", style="yellow")
+                continue
+            entry = {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, **refs}
+            rescanned += 1
+        files[path] = entry
+    
+    if rescanned or files.keys() != cached.keys():
+        index['files'] = files
+        try:
+            _write_atomic(key_index_path, json.dumps(index, separators=(',', ':')).encode('utf-8'))
+        except OSError as e:
+            console.print(f"[WARNING] Could not save the key index: {e}", style="yellow")
+    return index
+
+# Bookkeeping keys of set_global.js; older flow versions wrote them into the file store
+_SYNC_STATE_KEYS = ('globalContextVersion', 'globalContextKeys', 'scriptsManifest')
+
+def key_ignored(key):
+    """Return True when a key matches SYNC_KEYS_IGNORE (or is the sync flow's own bookkeeping)"""
+    return key in _SYNC_STATE_KEYS or any(fnmatch.fnmatch(key, pattern) for pattern in keys_ignore)
+
+def cross_reference_keys(index, data):
+    """Compare the keys of an outgoing JSON object with the index
+    
+    Returns missing keys (read by a script, absent from the JSON and never
+    written by a script) mapped to the reading files, and unused JSON keys
+    that no script reads.
+    """
+    readers = {}
+    prefixes = {}
+    written = set()
+    for path, entry in index['files'].items():
+        for key in entry['get']:
+            readers.setdefault(key, []).append(path)
+        for prefix in entry['get_prefixes']:
+            prefixes.setdefault(prefix, []).append(path)
+        written.update(entry['set'])
+    
+    missing = {
+        key: paths for key, paths in readers.items()
+        if key not in data and key not in written and not key_ignored(key)
+    }
+    for prefix, paths in prefixes.items():
+        if not any(key.startswith(prefix) for key in itertools.chain(data, written)) and not key_ignored(prefix + '*'):
+            missing[prefix + '*'] = paths
+    unused = sorted(
+        key for key in data
+        if key not in readers and not any(key.startswith(prefix) for prefix in prefixes) and not key_ignored(key)
+    )
+    return {'missing': missing, 'unused': unused}
+
+def check_global_key_refs(data=None):
+    """Warn about keys the scripts read but the outgoing JSON lacks (and unused ones); returns the report"""
+    if not key_refs_check:
+        return None
+    try:
+        if data is None:
+            data = snapshot_data(get_local_snapshot())
+        if not isinstance(data, dict):
+            return None
+        index = update_key_index()
+        if not index['files']:
+            return None
+        report = cross_reference_keys(index, data)
     except Exception as e:
-        console.print(f"[ERROR] Pull failed after all retries: {e}", style="red")
-        return False
+        console.print(f"[WARNING] Global key check skipped: {e}", style="yellow")
+        return None
+    
+    for key, paths in sorted(report['missing'].items()):
+        console.print(f"[WARNING] Global key '{key}' is read by {', '.join(sorted(paths))} but missing from the pushed file",
+                      style="yellow")
+    if report['unused']:
+        console.print(f"[INFO] Keys no script reads: {', '.join(report['unused'])}", style="blue")
+    return report
 
-def push():
-    if not run_pre_flight_checks():
+# ==== WATCH MODE ====
+
+class _DebouncedSync:
+    """Collapse bursts of file events into one sync after a quiet period"""
+    
+    def __init__(self, delay, action):
+        self.delay = delay
+        self.action = action
+        self.timer = None
+        self.lock = threading.Lock()
+        self.sync_lock = threading.Lock()
+        self.rerun = False
+    
+    def trigger(self):
+        """Restart the debounce window"""
+        with self.lock:
+            if self.timer:
+                self.timer.cancel()
+            self.timer = threading.Timer(self.delay, self._fire)
+            self.timer.daemon = True
+            self.timer.start()
+    
+    def cancel(self):
+        """Drop any pending sync"""
+        with self.lock:
+            if self.timer:
+                self.timer.cancel()
+                self.timer = None
+    
+    def _fire(self):
+        # A save during a running sync is handled by one follow-up run
+        if not self.sync_lock.acquire(blocking=False):
+            self.rerun = True
+            return
+        try:
+            self.rerun = False
+            self.action()
+        finally:
+            self.sync_lock.release()
+        if self.rerun:
+            self.trigger()
+
+def _watch_sync(state):
+    """Validate the saved file and push it if only the local side changed
+    
+    The remote must still match the last-synced base; when both sides
+    changed a conflict-free three-way merge is applied instead, and
+    anything else is left for a manual pull or merge.
+    """
+    started = time.monotonic()
+    try:
+        snapshot = get_local_snapshot()
+    except FileNotFoundError:
+        return  # Mid-save (editor replaced the file); the next event retries
+    
+    if snapshot['hash'] == state.get('last_hash'):
+        return  # Touched or re-saved without content changes
+    
+    try:
+        snapshot_data(snapshot)
+    except json.JSONDecodeError as e:
+        console.print(f"[ERROR] Invalid JSON, waiting for the next save: {e}", style="red")
+        return
+    
+    console.print(f"\n[INFO] {os.path.basename(local_path)} changed, syncing...", style="blue")
+    status_info = get_file_status()
+    if not status_info or status_info['status'] == 'remote_unavailable':
+        console.print("[ERROR] Cannot compare with the remote file, will retry on the next save", style="red")
+        return
+    if status_info['files_identical']:
+        state['last_hash'] = snapshot['hash']
+        console.print("[INFO] Remote file already matches - nothing to push", style="green")
+        return
+    
+    if status_info['status'] == 'diverged':
+        console.print("[WARNING] The remote file also changed since the last sync, merging", style="yellow")
+        plan = prepare_merge(status_info)
+        if plan is None:
+            return
+        if plan['conflicts']:
+            display_merge(plan['taken'], plan['conflicts'])
+            console.print("[WARNING] Not pushed - run 'merge' to resolve the conflicts", style="yellow")
+            return
+        if apply_merge(status_info, plan):
+            state['last_hash'] = get_local_snapshot()['hash']
+            console.print(f"[SUCCESS] Merged and synced in {time.monotonic() - started:.2f}s", style="green")
+        else:
+            console.print("[ERROR] Automatic merge failed, will retry on the next save", style="red")
+        return
+    
+    # Only push over a remote that still holds what was last synced (mtimes are not enough)
+    if status_info['status'] != 'local_newer' or status_info['base_hash'] != status_info['remote_hash']:
+        if status_info['base_hash']:
+            console.print(
+                f"[WARNING] Remote file changed since the last sync ({status_info['status']}) - "
+                "not pushing automatically; run 'pull' or 'merge'",
+                style="yellow"
+            )
+        else:
+            console.print(
+                "[WARNING] No last-synced snapshot to compare the remote against - "
+                "not pushing automatically; run 'push' or 'pull' once",
+                style="yellow"
+            )
+        return
+    
+    if push(assume_yes=True, pre_flight=False):
+        state['last_hash'] = snapshot['hash']
+        console.print(f"[SUCCESS] Synced in {time.monotonic() - started:.2f}s", style="green")
+    else:
+        console.print("[ERROR] Automatic push failed, will retry on the next save", style="red")
+
+def watch(debounce=None):
+    """Watch LOCAL_PATH and push automatically after each (debounced) save
+    
+    Saves are only pushed while the remote still matches the last-synced
+    base; remote edits are merged or left for a manual pull.
+    """
+    try:
+        from watchdog.observers import Observer
+        from watchdog.events import FileSystemEventHandler
+    except ImportError:
+        console.print("[ERROR] Watch mode requires the 'watchdog' package (pip install watchdog)", style="red")
         return False
     
-    # Validate local JSON file before pushing
-    if not local_path or not validate_json_file(local_path):
-        console.print("[ERROR] Local JSON validation failed. Aborting push.", style="red")
+    if not run_pre_flight_checks():
         return False
     
-    # Get current status and ask for confirmation
+    watched_file = os.path.realpath(local_path)
+    state = {}
     status_info = get_file_status()
-    if status_info and not status_info['files_identical']:
-        console.print("\n[INFO] Files are different. Showing detailed diff:", style="blue")
-        show_detailed_diff(status_info)
-        
-        if not Confirm.ask("\n[bold yellow]Continue with push?[/bold yellow]"):
-            console.print("[INFO] Push cancelled by user", style="yellow")
-            temp_path = status_info.get('temp_remote_path')
-            if temp_path and isinstance(temp_path, str) and os.path.exists(temp_path):
-                os.unlink(temp_path)
-            return False
+    if status_info and status_info['files_identical']:
+        state['last_hash'] = status_info['local_hash']
     
-    def _push_operation():
-        cmd = [
-            "scp",
-            local_path,
-            f"{remote_user}@{remote_host}:{remote_path}"
-        ]
-        console.print("\n[INFO] Pushing local file to remote...", style="blue")
-        console.print(" ".join(cmd), style="dim")
-        result = subprocess.run(cmd, shell=False)
-        if result.returncode != 0:
-            raise Exception("SCP push failed")
-        return result.returncode == 0
+    debouncer = _DebouncedSync(
+        watch_debounce if debounce is None else debounce,
+        lambda: run_action('watch_sync', _watch_sync, state)
+    )
+    
+    class _LocalFileHandler(FileSystemEventHandler):
+        def on_any_event(self, event):
+            # Our own reads raise opened/closed_no_write events; only react to writes
+            if event.event_type not in ('created', 'modified', 'moved', 'closed'):
+                return
+            # Editors often save via a temp file + rename, so match either path
+            paths = (getattr(event, 'src_path', None), getattr(event, 'dest_path', None))
+            if any(path and os.path.realpath(path) == watched_file for path in paths):
+                debouncer.trigger()
+    
+    observer = Observer()
+    observer.schedule(_LocalFileHandler(), os.path.dirname(watched_file), recursive=False)
+    observer.start()
+    console.print(f"[INFO] Watching {watched_file} (debounce {debouncer.delay}s, Ctrl+C to stop)", style="blue")
     
     try:
-        success = retry_operation(_push_operation)
-        if success:
-            console.print("[SUCCESS] Push complete.", style="green")
-            # Send webhook after successful push
-            send_webhook()
-        return success
-    except Exception as e:
-        console.print(f"[ERROR] Push failed after all retries: {e}", style="red")
-        return False
+        if status_info and not status_info['files_identical']:
+            console.print("[INFO] Local file differs from remote, checking whether it can be synced", style="blue")
+            debouncer.trigger()
+        while observer.is_alive():
+            observer.join(1)
+    except KeyboardInterrupt:
+        console.print("\n[INFO] Stopping watch mode", style="blue")
     finally:
-        # Clean up temp file if exists
-        if status_info:
-            temp_path = status_info.get('temp_remote_path')
-            if temp_path and isinstance(temp_path, str) and os.path.exists(temp_path):
-                os.unlink(temp_path)
+        debouncer.cancel()
+        observer.stop()
+        observer.join()
+    return True
 
 def print_header():
     """Print a styled header for the application"""
+    from rich.panel import Panel
+    from rich.text import Text
+    
     title = Text("🔄 Node-RED Global JSON Sync Tool", style="bold magenta")
     
     header_text = Text()
@@ -486,21 +3736,51 @@ def print_header():
     console.print(panel)
     console.print()  # Empty line for spacing
 
+def show_startup_status():
+    """Run pre-flight checks alongside the first status fetch and show the file status"""
+    if not check_config():
+        return False
+    
+    with ThreadPoolExecutor(max_workers=2) as pool:
+        pre_flight = pool.submit(run_pre_flight_checks)
+        status = pool.submit(get_file_status)
+        if not pre_flight.result():
+            return False
+        file_status = status.result()
+    if file_status is None:
+        return False
+    return show_status(file_status)
+
+def show_status(file_status=None):
+    """Display the file status, refreshing it unless it was just fetched"""
+    console.print("=" * 60, style="dim")
+    file_status = file_status or get_file_status()
+    if file_status:
+        display_file_status(file_status)
+    console.print("=" * 60, style="dim")
+    return file_status is not None
+
+def show_diff():
+    """Show the detailed diff between local and remote"""
+    file_status = get_file_status()
+    if not file_status:
+        return False
+    return show_detailed_diff(file_status)
+
+def install_signal_handlers():
+    """Exit cleanly on SIGTERM/SIGHUP so shared SSH connections are closed"""
+    for sig in (signal.SIGTERM, getattr(signal, "SIGHUP", None)):
+        if sig is not None:
+            signal.signal(sig, _exit_on_signal)
+
 def main():
+    install_signal_handlers()
+    report_target_warnings()
+    
     print_header()
     
     # Show file status at startup
-    if run_pre_flight_checks():
-        console.print("=" * 60, style="dim")
-        file_status = get_file_status()
-        if file_status:
-            display_file_status(file_status)
-            
-            # Clean up temp file after displaying status
-            temp_path = file_status.get('temp_remote_path')
-            if temp_path and isinstance(temp_path, str) and os.path.exists(temp_path):
-                os.unlink(temp_path)
-        console.print("=" * 60, style="dim")
+    run_action('startup', show_startup_status)
     
     while True:  # Keep the menu running
         console.print("Choose an action:", style="bold cyan")
@@ -508,29 +3788,31 @@ def main():
         console.print("2) Push local → remote", style="cyan")
         console.print("3) Show detailed file diff", style="cyan")
         console.print("4) Refresh file status", style="cyan")
-        choice = input("Type 1, 2, 3, 4 (or q to quit): ").strip().lower()
+        console.print("5) Push changed keys only (delta)", style="cyan")
+        console.print(f"6) Fleet status ({len(targets)} target(s))", style="cyan")
+        console.print(f"7) Fleet push ({len(targets)} target(s))", style="cyan")
+        console.print("8) Merge local and remote changes (three-way)", style="cyan")
+        console.print("9) Version history (diff / roll back)", style="cyan")
+        choice = input("Type 1-9 (or q to quit): ").strip().lower()
 
         if choice == "1":
-            pull()
+            run_action('pull', pull)
         elif choice == "2":
-            push()
+            run_action('push', push)
         elif choice == "3":
-            file_status = get_file_status()
-            if file_status:
-                show_detailed_diff(file_status)
-                temp_path = file_status.get('temp_remote_path')
-                if temp_path and isinstance(temp_path, str) and os.path.exists(temp_path):
-                    os.unlink(temp_path)
+            run_action('diff', show_diff)
         elif choice == "4":
-            # Refresh file status
-            console.print("=" * 60, style="dim")
-            file_status = get_file_status()
-            if file_status:
-                display_file_status(file_status)
-                temp_path = file_status.get('temp_remote_path')
-                if temp_path and isinstance(temp_path, str) and os.path.exists(temp_path):
-                    os.unlink(temp_path)
-            console.print("=" * 60, style="dim")
+            run_action('status', show_status)
+        elif choice == "5":
+            run_action('push_delta', push, mode="delta")
+        elif choice == "6":
+            run_action('fleet_status', fleet_status)
+        elif choice == "7":
+            run_action('fleet_push', fleet_push)
+        elif choice == "8":
+            run_action('merge', merge)
+        elif choice == "9":
+            run_action('history', show_history)
         elif choice == "q":
             console.print("Quitting, nothing done. 👍", style="green")
             sys.exit(0)
@@ -540,5 +3822,535 @@ def main():
         # Add a separator between operations
         console.print()  # Empty line for better readability
 
+# ==== NON-INTERACTIVE COMMANDS ====
+# Subcommand exit codes: 0 = OK / in sync, 1 = files differ, 2 = error
+EXIT_OK = 0
+EXIT_DIFFERS = 1
+EXIT_ERROR = 2
+
+def _status_record(status_info):
+    """Reduce a file status to JSON-serialisable fields"""
+    def side(prefix):
+        mtime = status_info[f'{prefix}_mtime']
+        return {
+            'mtime': mtime.isoformat() if mtime else None,
+            'size': status_info[f'{prefix}_size'],
+            'sha256': status_info[f'{prefix}_hash']
+        }
+    
+    return {
+        'target': status_info['target']['name'],
+        'status': status_info['status'],
+        'identical': status_info['files_identical'],
+        'recommendation': status_info['recommendation'],
+        'local': side('local'),
+        'remote': side('remote'),
+        'base_sha256': status_info.get('base_hash')
+    }
+
+def _status_exit_code(status_info):
+    """Map a file status to the subcommand exit code"""
+    if status_info['status'] == 'remote_unavailable':
+        return EXIT_ERROR
+    return EXIT_OK if status_info['files_identical'] else EXIT_DIFFERS
+
+def cli_status(output="rich"):
+    """Compare local and remote hashes without the header, SSH key check or shared connection"""
+    if not check_config():
+        return EXIT_ERROR
+    status_info = get_file_status()
+    if status_info is None:
+        return EXIT_ERROR
+    
+    if output == "rich":
+        display_file_status(status_info)
+        return _status_exit_code(status_info)
+    
+    record = _status_record(status_info)
+    if output == "json":
+        print(json.dumps(record))
+    else:
+        print(f"status: {record['status']}")
+        print(f"recommendation: {record['recommendation']}")
+        for name in ('local', 'remote'):
+            info = record[name]
+            print(f"{name}: {info['mtime'] or '-'} {info['size'] if info['size'] is not None else '-'} {info['sha256'] or '-'}")
+    return _status_exit_code(status_info)
+
+def _emit_diff(output, diff, **fields):
+    """Print a diff from diff_snapshots on stdout as plain lines or one JSON record"""
+    if diff['format'] == 'json':
+        changes = [
+            {'kind': kind, 'path': path, 'old': old_value, 'new': new_value}
+            for kind, path, old_value, new_value in diff['changes']
+        ]
+    else:
+        changes = diff['changes']
+    
+    if output == "json":
+        print(json.dumps({**fields, 'format': diff['format'], 'changes': changes,
+                          'truncated': diff['truncated']}, ensure_ascii=False))
+        return
+    
+    for change in changes:
+        if diff['format'] == 'text':
+            print(change)
+        elif change['kind'] == 'added':
+            print(f"+ {change['path']}: {json.dumps(change['new'], ensure_ascii=False)}")
+        elif change['kind'] == 'removed':
+            print(f"- {change['path']}: {json.dumps(change['old'], ensure_ascii=False)}")
+        else:
+            print(f"~ {change['path']}: {json.dumps(change['old'], ensure_ascii=False)} -> {json.dumps(change['new'], ensure_ascii=False)}")
+    if diff['truncated']:
+        console.print(f"[WARNING] Diff truncated after {DIFF_MAX_LINES} changes", style="yellow")
+
+def cli_diff(output="rich"):
+    """Print the remote → local differences; exit code as for status"""
+    if not check_config():
+        return EXIT_ERROR
+    status_info = get_file_status()
+    if status_info is None:
+        return EXIT_ERROR
+    
+    if output == "rich":
+        if not show_detailed_diff(status_info):
+            return EXIT_ERROR
+        return _status_exit_code(status_info)
+    
+    diff = collect_diff(status_info)
+    if diff is None:
+        return EXIT_ERROR
+    _emit_diff(output, diff, target=status_info['target']['name'], status=status_info['status'])
+    return _status_exit_code(status_info)
+
+def _report_action(output, action, ok, **fields):
+    """Print the outcome of a pull/push in plain or JSON form and return the exit code"""
+    if output == "json":
+        print(json.dumps({'action': action, 'ok': bool(ok), 'target': primary_target()['name'], **fields}))
+    elif output == "plain":
+        print(f"{action}: {'ok' if ok else 'failed'}")
+    return EXIT_OK if ok else EXIT_ERROR
+
+def cli_pull(output="rich"):
+    """Pull the remote file without the interactive menu"""
+    return _report_action(output, 'pull', pull())
+
+def cli_push(output="rich", assume_yes=False, mode=None):
+    """Push the local file without the interactive menu"""
+    mode = (mode or push_mode).lower()
+    if not assume_yes and not sys.stdin.isatty():
+        console.print("[ERROR] push needs --yes when not run from a terminal", style="red")
+        return _report_action(output, 'push', False, mode=mode)
+    return _report_action(output, 'push', push(mode=mode, assume_yes=assume_yes), mode=mode)
+
+def cli_merge(output="rich", prefer=None, assume_yes=False):
+    """Merge without the menu; exit 1 when same-key conflicts are left unresolved"""
+    interactive = output == "rich" and sys.stdin.isatty() and not assume_yes
+    status_info, plan = plan_merge(prefer, interactive)
+    if plan is None:
+        identical = bool(status_info and status_info['files_identical'])
+        return _report_action(output, 'merge', identical, taken=[], conflicts=[])
+    
+    taken = [{'path': path, 'from': side} for path, side in plan['taken']]
+    conflicts = [path for path, base, local, remote in plan['conflicts']]
+    if output == "rich":
+        display_merge(plan['taken'], plan['conflicts'])
+    
+    if conflicts:
+        if output == "json":
+            print(json.dumps({'action': 'merge', 'ok': False, 'target': status_info['target']['name'],
+                              'taken': taken, 'conflicts': conflicts}, ensure_ascii=False))
+        elif output == "plain":
+            for path in conflicts:
+                print(f"conflict: {path}")
+        return EXIT_DIFFERS
+    
+    if interactive and not confirm("\n[bold yellow]Apply the merge to local and remote?[/bold yellow]"):
+        console.print("[INFO] Merge cancelled by user", style="yellow")
+        return EXIT_ERROR
+    if output == "plain":
+        for item in taken:
+            print(f"{item['from']}: {item['path']}")
+    return _report_action(output, 'merge', apply_merge(status_info, plan), taken=taken, conflicts=[])
+
+def cli_history(output="rich", limit=20):
+    """List the most recent history versions"""
+    entries = load_history()[-limit:] if limit > 0 else load_history()
+    if output == "rich":
+        display_history(entries)
+    elif output == "json":
+        print(json.dumps(list(reversed(entries))))
+    else:
+        for entry in reversed(entries):
+            print(f"{entry['id']} {entry['time']} {entry['action']} {entry['target']} {entry['size']} {entry['hash']}")
+    return EXIT_OK
+
+def cli_history_diff(output="rich", old="", new="local"):
+    """Diff two history versions (or a version and the local file); exit 1 when they differ"""
+    old_snapshot, old_label = resolve_version(old)
+    new_snapshot, new_label = resolve_version(new)
+    if not old_snapshot or not new_snapshot:
+        return EXIT_ERROR
+    
+    diff = diff_snapshots(old_snapshot, new_snapshot, old_label, new_label)
+    if diff is None:
+        return EXIT_ERROR
+    if output == "rich":
+        print_diff(diff, f"{old_label} to {new_label}")
+    else:
+        _emit_diff(output, diff, old=old_snapshot['hash'], new=new_snapshot['hash'])
+    return EXIT_OK if old_snapshot['hash'] == new_snapshot['hash'] else EXIT_DIFFERS
+
+def cli_rollback(output="rich", version="", assume_yes=False):
+    """Restore a history version and push it"""
+    if not assume_yes and not sys.stdin.isatty():
+        console.print("[ERROR] rollback needs --yes when not run from a terminal", style="red")
+        return _report_action(output, 'rollback', False, version=version)
+    return _report_action(output, 'rollback', rollback(version, assume_yes=assume_yes), version=version)
+
+def cli_scripts(output="rich", dry_run=False, delete=False, assume_yes=False):
+    """Sync the Function-node scripts; with --dry-run exit 1 when any would change"""
+    if not dry_run and not assume_yes and not sys.stdin.isatty():
+        console.print("[ERROR] scripts needs --yes (or --dry-run) when not run from a terminal", style="red")
+        return _report_action(output, 'scripts', False)
+    if not run_pre_flight_checks():
+        return _report_action(output, 'scripts', False)
+    plan = prepare_script_sync()
+    if plan is None:
+        return _report_action(output, 'scripts', False)
+    
+    pending = bool(plan['added'] or plan['changed'] or (delete and plan['removed']))
+    fields = {key: plan[key] for key in ('added', 'changed', 'removed', 'unchanged', 'manifest')}
+    if output == "rich":
+        display_script_plan(plan, delete)
+    elif output == "plain":
+        for marker, key in (('+', 'added'), ('~', 'changed'), ('-', 'removed')):
+            for path in plan[key]:
+                print(f"{marker} {path}")
+    
+    if dry_run:
+        if output == "json":
+            print(json.dumps({'action': 'scripts', 'dry_run': True, 'target': primary_target()['name'], **fields}))
+        return EXIT_DIFFERS if pending else EXIT_OK
+    
+    if pending and not assume_yes and not confirm("\n[bold yellow]Copy these scripts to the remote?[/bold yellow]"):
+        console.print("[INFO] Script sync cancelled by user", style="yellow")
+        return _report_action(output, 'scripts', False, **fields)
+    return _report_action(output, 'scripts', apply_script_sync(plan, delete=delete), deleted=delete, **fields)
+
+# ==== RESIDENT AGENT ====
+# `agent` keeps the shared SSH connection, the pre-flight result and the remote
+# stat/hash and content warm, and answers status/diff/pull/push on a Unix socket.
+# Protocol: one JSON request line per connection, e.g.
+#   {"command": "status", "output": "json"}
+# answered by one JSON line {"exit": 0, "stdout": "...", "stderr": "..."}.
+# Requests run one at a time; "output", "verbose", "width" and "color" shape
+# the captured output as the CLI would print it, push also takes "mode".
+_agent_lock = threading.Lock()
+
+_AGENT_COMMANDS = {
+    'status': lambda request: run_action('status', cli_status, request['output']),
+    'diff': lambda request: run_action('diff', cli_diff, request['output']),
+    'pull': lambda request: run_action('pull', cli_pull, request['output']),
+    'push': lambda request: run_action('push', cli_push, request['output'], assume_yes=True, mode=request.get('mode')),
+}
+
+def agent_execute(request):
+    """Run one agent request with its output captured and return the response"""
+    global console
+    command = _AGENT_COMMANDS.get(request.get('command'))
+    if command is None:
+        return {'exit': EXIT_ERROR, 'stdout': '', 'stderr': f"[ERROR] Unknown agent command: {request.get('command')}\n"}
+    
+    request.setdefault('output', 'rich')
+    stdout, stderr = io.StringIO(), io.StringIO()
+    with _agent_lock:
+        agent_console = console
+        if request['output'] == 'rich':
+            from rich.console import Console
+            console = Console(file=stdout, force_terminal=bool(request.get('color')), width=request.get('width') or 80)
+        else:
+            console = _PlainConsole(verbose=bool(request.get('verbose')))
+        try:
+            with redirect_stdout(stdout), redirect_stderr(stderr):
+                code = command(request)
+        except Exception as e:
+            code = EXIT_ERROR
+            stderr.write(f"[ERROR] Agent command failed: {e}\n")
+        finally:
+            console = agent_console
+    return {'exit': code, 'stdout': stdout.getvalue(), 'stderr': stderr.getvalue()}
+
+def agent_request(command, output="rich", **fields):
+    """Run a command on a running agent and print its output; None when no agent answers"""
+    import socket
+    
+    if not use_agent or not hasattr(socket, 'AF_UNIX') or not os.path.exists(agent_socket):
+        return None
+    request = {
+        'command': command,
+        'output': output,
+        'width': shutil.get_terminal_size().columns,
+        'color': sys.stdout.isatty(),
+        **fields
+    }
+    
+    client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        client.settimeout(2)
+        try:
+            client.connect(agent_socket)
+        except OSError:
+            return None  # Stale socket from an agent that is gone: run the command here
+        # Once the agent has the request it is not re-run locally, even if the answer is lost
+        try:
+            client.settimeout(None)
+            client.sendall((json.dumps(request) + "\n").encode('utf-8'))
+            with client.makefile('rb') as reader:
+                response = json.loads(reader.readline())
+        except (OSError, ValueError) as e:
+            print(f"[ERROR] Lost the connection to the sync agent: {e}", file=sys.stderr)
+            return EXIT_ERROR
+    finally:
+        client.close()
+    
+    sys.stderr.write(response.get('stderr', ''))
+    sys.stdout.write(response.get('stdout', ''))
+    sys.stdout.flush()
+    return response.get('exit', EXIT_ERROR)
+
+def _agent_refresh(state):
+    """Re-check the remote and prefetch changed content so requests are answered from cache"""
+    target = primary_target()
+    with _agent_lock:
+        console.quiet = True
+        try:
+            status_info = None
+            # A dead shared connection is reopened; without one calls connect on their own
+            get_transport(target).connect()
+            if run_pre_flight_checks():
+                _snapshot_cache['info'].pop(target['name'], None)
+                status_info = get_file_status(fetch_content=True)
+        finally:
+            console.quiet = False
+        
+        # Only report changes, not every refresh
+        summary = (status_info['status'], status_info['remote_hash']) if status_info else None
+        if summary == state.get('last', ()):
+            return
+        state['last'] = summary
+        if status_info is None:
+            invalidate_pre_flight()
+            console.print("[WARNING] Background refresh failed; requests query the remote directly", style="yellow")
+        else:
+            console.print(f"[INFO] {datetime.now():%H:%M:%S} {status_info['status']} "
+                          f"(remote {(status_info['remote_hash'] or '-')[:12]})", style="blue")
+
+def run_agent(socket_path=None, refresh=None):
+    """Serve status/diff/pull/push on a Unix socket while refreshing remote state in the background"""
+    global agent_socket, remote_info_max_age
+    import socket
+    import socketserver
+    
+    if not hasattr(socket, 'AF_UNIX'):
+        console.print("[ERROR] The sync agent needs Unix domain sockets", style="red")
+        return False
+    agent_socket = socket_path or agent_socket
+    refresh = agent_refresh if refresh is None else refresh
+    if refresh <= 0:
+        console.print("[ERROR] The agent refresh interval must be positive", style="red")
+        return False
+    
+    if os.path.exists(agent_socket):
+        probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            probe.connect(agent_socket)
+            console.print(f"[ERROR] An agent is already listening on {agent_socket}", style="red")
+            return False
+        except OSError:
+            os.unlink(agent_socket)  # Left behind by an agent that did not shut down cleanly
+        finally:
+            probe.close()
+    
+    if not run_pre_flight_checks():
+        return False
+    
+    class _AgentHandler(socketserver.StreamRequestHandler):
+        def handle(self):
+            try:
+                request = json.loads(self.rfile.readline())
+                if not isinstance(request, dict):
+                    raise ValueError("request must be a JSON object")
+            except ValueError as e:
+                response = {'exit': EXIT_ERROR, 'stdout': '', 'stderr': f"[ERROR] Bad agent request: {e}\n"}
+            else:
+                response = agent_execute(request)
+            self.wfile.write((json.dumps(response) + "\n").encode('utf-8'))
+    
+    class _AgentServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+        daemon_threads = True
+    
+    os.makedirs(os.path.dirname(os.path.abspath(agent_socket)), exist_ok=True)
+    previous_umask = os.umask(0o177)  # Socket readable and writable by this user only
+    try:
+        server = _AgentServer(agent_socket, _AgentHandler)
+    except OSError as e:
+        console.print(f"[ERROR] Could not listen on {agent_socket}: {e}", style="red")
+        return False
+    finally:
+        os.umask(previous_umask)
+    
+    # Status answers may use remote info up to one missed refresh old
+    remote_info_max_age = 2 * refresh
+    state = {}
+    stop = threading.Event()
+    
+    def _refresh_loop():
+        while not stop.wait(refresh):
+            try:
+                _agent_refresh(state)
+            except Exception as e:
+                with _agent_lock:
+                    console.print(f"[WARNING] Background refresh failed: {e}", style="yellow")
+    
+    # Warm the cache before the first request; later refreshes run in the background
+    _agent_refresh(state)
+    console.print(f"[SUCCESS] Agent listening on {agent_socket} (refresh every {refresh:g}s, Ctrl+C to stop)", style="green")
+    refresher = threading.Thread(target=_refresh_loop, name="agent-refresh", daemon=True)
+    refresher.start()
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        stop.set()
+        with _agent_lock:
+            console.print("\n[INFO] Stopping the agent", style="blue")
+        server.server_close()
+        if os.path.exists(agent_socket):
+            os.unlink(agent_socket)
+    return True
+
+def run_cli(args):
+    """Run a subcommand (or --watch) and return its exit code"""
+    global console
+    if args.output != "rich":
+        console = _PlainConsole(verbose=args.verbose)
+    report_target_warnings()
+    install_signal_handlers()
+    
+    if args.watch or args.command == "watch":
+        return EXIT_OK if watch(args.debounce) else EXIT_ERROR
+    if args.command == "agent":
+        return EXIT_OK if run_agent(args.socket, args.refresh) else EXIT_ERROR
+    
+    # Unattended commands go to a running agent when there is one
+    if args.command in _AGENT_COMMANDS and (args.command != "push" or args.yes):
+        fields = {'verbose': args.verbose}
+        if args.command == "push":
+            fields['mode'] = args.mode
+        code = agent_request(args.command, args.output, **fields)
+        if code is not None:
+            return code
+    if args.command == "status":
+        return run_action('status', cli_status, args.output)
+    if args.command == "diff":
+        return run_action('diff', cli_diff, args.output)
+    if args.command == "pull":
+        return run_action('pull', cli_pull, args.output)
+    if args.command == "push":
+        return run_action('push', cli_push, args.output, assume_yes=args.yes, mode=args.mode)
+    if args.command == "merge":
+        return run_action('merge', cli_merge, args.output, prefer=args.prefer, assume_yes=args.yes)
+    if args.command == "history":
+        return cli_history(args.output, args.limit)
+    if args.command == "history-diff":
+        return cli_history_diff(args.output, args.old, args.new)
+    if args.command == "rollback":
+        return run_action('rollback', cli_rollback, args.output, args.version, assume_yes=args.yes)
+    if args.command == "scripts":
+        return run_action('scripts', cli_scripts, args.output, dry_run=args.dry_run, delete=args.delete, assume_yes=args.yes)
+    return EXIT_ERROR
+
+def _global_options(defaults):
+    """Build the parent parser for the options accepted before and after a subcommand"""
+    options = argparse.ArgumentParser(add_help=False)
+    options.add_argument("--output", choices=("rich", "plain", "json"),
+                         default="rich" if defaults else argparse.SUPPRESS,
+                         help="rich (default) for people; plain or json print results on stdout and messages on stderr")
+    options.add_argument("-v", "--verbose", action="store_true",
+                         default=False if defaults else argparse.SUPPRESS,
+                         help="with plain/json output, also print progress messages on stderr")
+    options.add_argument("--metrics", metavar="PATH",
+                         default=None if defaults else argparse.SUPPRESS,
+                         help="append one JSON metrics record per action to PATH (JSONL)")
+    return options
+
+def parse_args(argv=None):
+    """Parse command line options"""
+    parser = argparse.ArgumentParser(
+        description="Sync the Node-RED global JSON between this machine and Node-RED hosts",
+        epilog="Without a command the interactive menu starts. "
+               "Command exit codes: 0 = OK / in sync, 1 = files differ, 2 = error.",
+        parents=[_global_options(defaults=True)]
+    )
+    parser.add_argument("--watch", action="store_true",
+                        help="watch LOCAL_PATH and push automatically after each save")
+    parser.add_argument("--debounce", type=float, default=None,
+                        help=f"seconds to wait for further saves before pushing (default {watch_debounce})")
+    
+    # Subcommand copies only override the top-level values when given explicitly
+    common = _global_options(defaults=False)
+    commands = parser.add_subparsers(dest="command", metavar="command")
+    commands.add_parser("status", parents=[common],
+                        help="compare local and remote by hash (no SSH key check or shared connection)")
+    commands.add_parser("diff", parents=[common], help="show the changes from remote to local")
+    commands.add_parser("pull", parents=[common], help="pull the remote file to LOCAL_PATH")
+    push_parser = commands.add_parser("push", parents=[common], help="push LOCAL_PATH to the remote")
+    push_parser.add_argument("-y", "--yes", action="store_true",
+                             help="do not ask for confirmation (required when not run from a terminal)")
+    push_parser.add_argument("--mode", choices=("full", "delta"), default=None,
+                             help=f"full file copy or changed keys only (default {push_mode})")
+    merge_parser = commands.add_parser("merge", parents=[common],
+                                       help="three-way merge local and remote edits since the last sync")
+    merge_parser.add_argument("--prefer", choices=("local", "remote"), default=None,
+                              help="side to keep when both changed the same key (default: report the conflict)")
+    merge_parser.add_argument("-y", "--yes", action="store_true", help="do not ask for confirmation")
+    history_parser = commands.add_parser("history", parents=[common], help="list recorded pulled/pushed versions")
+    history_parser.add_argument("--limit", type=int, default=20, help="number of versions to list (0 = all, default 20)")
+    history_diff_parser = commands.add_parser("history-diff", parents=[common],
+                                              help="diff two versions by SHA-256 prefix or ID")
+    history_diff_parser.add_argument("old", help="older version (SHA-256 prefix, ID or #ID, or 'local')")
+    history_diff_parser.add_argument("new", nargs="?", default="local",
+                                     help="newer version (default: the local file)")
+    rollback_parser = commands.add_parser("rollback", parents=[common],
+                                          help="restore a version locally and push it")
+    rollback_parser.add_argument("version", help="SHA-256 prefix, or version ID (#ID when it could be read as a hash prefix)")
+    rollback_parser.add_argument("-y", "--yes", action="store_true",
+                                 help="do not ask for confirmation (required when not run from a terminal)")
+    scripts_parser = commands.add_parser("scripts", parents=[common],
+                                         help="copy new/changed Function-node scripts to SCRIPTS_REMOTE_DIR and notify Node-RED once")
+    scripts_parser.add_argument("-n", "--dry-run", action="store_true",
+                                help="only list the differences (exit 1 when scripts would be copied)")
+    scripts_parser.add_argument("--delete", action="store_true",
+                                help="also delete remote scripts that no longer exist locally")
+    scripts_parser.add_argument("-y", "--yes", action="store_true",
+                                help="do not ask for confirmation (required when not run from a terminal)")
+    agent_parser = commands.add_parser("agent", parents=[common],
+                                       help="keep the connection and remote state warm and serve status/diff/pull/push on a Unix socket")
+    agent_parser.add_argument("--socket", metavar="PATH", default=None,
+                              help=f"control socket path (default {agent_socket})")
+    agent_parser.add_argument("--refresh", type=float, default=None,
+                              help=f"seconds between background remote checks (default {agent_refresh:g})")
+    watch_parser = commands.add_parser("watch", parents=[common], help="same as --watch")
+    watch_parser.add_argument("--debounce", type=float, default=argparse.SUPPRESS,
+                              help=f"seconds to wait for further saves before pushing (default {watch_debounce})")
+    return parser.parse_args(argv)
+
 if __name__ == "__main__":
+    args = parse_args()
+    if args.metrics:
+        metrics_file = args.metrics
+    if args.watch or args.command:
+        sys.exit(run_cli(args))
     main()
@@ -0,0 +1,323 @@
+import json
+
+import pytest
+
+import sync_global_json as sync
+from sync_global_json import _MISSING
+
+
+# ==== three_way_merge ====
+
+def test_merge_takes_each_sides_own_edits():
+    base = {'a': 1, 'b': 2}
+    local = {'a': 10, 'b': 2}
+    remote = {'a': 1, 'b': 2, 'c': 3}
+
+    merged, taken, conflicts = sync.three_way_merge(base, local, remote)
+
+    assert merged == {'a': 10, 'b': 2, 'c': 3}
+    assert taken == [('$.a', 'local'), ('$.c', 'remote')]
+    assert conflicts == []
+
+
+def test_merge_same_edit_on_both_sides_is_not_a_conflict():
+    merged, taken, conflicts = sync.three_way_merge({'a': 1}, {'a': 2}, {'a': 2})
+
+    assert merged == {'a': 2}
+    assert taken == []
+    assert conflicts == []
+
+
+def test_merge_deletion_on_one_side_only_is_applied():
+    base = {'a': 1, 'b': 2}
+
+    merged, taken, conflicts = sync.three_way_merge(base, {'a': 1, 'b': 2}, {'a': 1})
+    assert merged == {'a': 1}
+    assert taken == [('$.b', 'remote')]
+    assert conflicts == []
+
+    merged, taken, conflicts = sync.three_way_merge(base, {'b': 2}, {'a': 1, 'b': 2})
+    assert merged == {'b': 2}
+    assert taken == [('$.a', 'local')]
+
+
+def test_merge_deleted_on_both_sides_stays_deleted():
+    merged, taken, conflicts = sync.three_way_merge({'a': 1, 'b': 2}, {'b': 2}, {'b': 2})
+
+    assert merged == {'b': 2}
+    assert conflicts == []
+
+
+def test_merge_deleted_locally_and_changed_remotely_is_a_conflict():
+    base = {'a': 1, 'b': 2}
+    local = {'b': 2}
+    remote = {'a': 5, 'b': 2}
+
+    merged, taken, conflicts = sync.three_way_merge(base, local, remote)
+
+    assert conflicts == [('$.a', 1, _MISSING, 5)]
+    # Unresolved conflicts keep the local side, here the deletion
+    assert merged == {'b': 2}
+    assert taken == []
+
+
+def test_merge_changed_locally_and_deleted_remotely_is_a_conflict():
+    merged, taken, conflicts = sync.three_way_merge({'a': 1}, {'a': 2}, {})
+
+    assert conflicts == [('$.a', 1, 2, _MISSING)]
+    assert merged == {'a': 2}
+
+
+def test_merge_nested_objects_changed_on_both_sides():
+    base = {'sensor': {'x': 1, 'y': 1, 'z': {'on': False}}, 'other': True}
+    local = {'sensor': {'x': 2, 'y': 1, 'z': {'on': False}}, 'other': True}
+    remote = {'sensor': {'x': 1, 'y': 1, 'z': {'on': True}, 'w': 0}, 'other': True}
+
+    merged, taken, conflicts = sync.three_way_merge(base, local, remote)
+
+    assert merged == {'sensor': {'x': 2, 'y': 1, 'z': {'on': True}, 'w': 0}, 'other': True}
+    assert sorted(taken) == [('$.sensor.w', 'remote'), ('$.sensor.x', 'local'), ('$.sensor.z', 'remote')]
+    assert conflicts == []
+
+
+def test_merge_nested_conflict_reports_the_inner_path():
+    base = {'sensor': {'x': 1, 'y': 1}}
+    local = {'sensor': {'x': 2, 'y': 3}}
+    remote = {'sensor': {'x': 5, 'y': 1}}
+
+    merged, taken, conflicts = sync.three_way_merge(base, local, remote)
+
+    assert conflicts == [('$.sensor.x', 1, 2, 5)]
+    assert taken == [('$.sensor.y', 'local')]
+    assert merged == {'sensor': {'x': 2, 'y': 3}}
+
+
+def test_merge_object_replaced_by_a_scalar_on_one_side_is_a_conflict():
+    base = {'a': {'x': 1}}
+
+    merged, taken, conflicts = sync.three_way_merge(base, {'a': {'x': 2}}, {'a': 'off'})
+
+    assert conflicts == [('$.a', {'x': 1}, {'x': 2}, 'off')]
+
+
+def test_merge_resolver_picks_a_side():
+    calls = []
+
+    def resolve(path, base, local, remote):
+        calls.append(path)
+        return 'remote'
+
+    merged, taken, conflicts = sync.three_way_merge({'a': 1}, {'a': 2}, {'a': 3}, resolve)
+
+    assert calls == ['$.a']
+    assert merged == {'a': 3}
+    assert taken == [('$.a', 'remote')]
+    assert conflicts == []
+
+
+def test_merge_compares_json_types_strictly():
+    # 1 and true are different JSON values even though they are equal in Python
+    merged, taken, conflicts = sync.three_way_merge({'a': 1}, {'a': 1}, {'a': True})
+
+    assert merged == {'a': True}
+    assert taken == [('$.a', 'remote')]
+
+
+# ==== iter_json_diff ====
+
+def test_json_diff_reports_changes_in_document_order():
+    old = {'a': 1, 'b': {'c': [1, 2]}, 'gone': None}
+    new = {'a': 2, 'b': {'c': [1, 3, 4]}, 'odd key': 'x'}
+
+    assert list(sync.iter_json_diff(old, new)) == [
+        ('changed', '$.a', 1, 2),
+        ('changed', '$.b.c[1]', 2, 3),
+        ('added', '$.b.c[2]', None, 4),
+        ('added', '$["odd key"]', None, 'x'),
+        ('removed', '$.gone', None, None),
+    ]
+
+
+def test_json_diff_ignores_key_order_but_not_types():
+    assert list(sync.iter_json_diff({'a': 1, 'b': 2}, {'b': 2, 'a': 1})) == []
+    assert list(sync.iter_json_diff({'a': 1}, {'a': 1.0})) == [('changed', '$.a', 1, 1.0)]
+    assert list(sync.iter_json_diff({'a': 1}, {'a': True})) == [('changed', '$.a', 1, True)]
+
+
+def test_json_diff_is_lazy():
+    old = {f"k{i}": i for i in range(1000)}
+    new = {key: value + 1 for key, value in old.items()}
+
+    changes = sync.iter_json_diff(old, new)
+
+    assert next(changes) == ('changed', '$.k0', 0, 1)
+
+
+# ==== stream_validate_json ====
+
+@pytest.mark.parametrize("document", [
+    '{}',
+    '[]',
+    '{"a": 1, "b": {"c": [true, false, null, -1.5e3, 0, "\\u00e9\\n"]}}',
+    '  "just a string"  \n',
+])
+@pytest.mark.parametrize("chunk_size", [3, 1024 * 1024])
+def test_stream_validate_accepts_valid_json(tmp_path, document, chunk_size):
+    path = tmp_path / 'global.json'
+    path.write_text(document, encoding='utf-8')
+
+    assert sync.stream_validate_json(str(path), chunk_size=chunk_size) is None
+
+
+@pytest.mark.parametrize("document", [
+    '{"a": 1,\n "b": }',
+    '{"a": [1, 2,]}',
+    '{"a": 1} x',
+    '[1, 2',
+    '{"a": tru}',
+])
+@pytest.mark.parametrize("chunk_size", [3, 1024 * 1024])
+def test_stream_validate_reports_the_same_location_as_json(tmp_path, document, chunk_size):
+    path = tmp_path / 'global.json'
+    path.write_text(document, encoding='utf-8')
+    with pytest.raises(json.JSONDecodeError) as expected:
+        json.loads(document)
+
+    message, line, column = sync.stream_validate_json(str(path), chunk_size=chunk_size)
+
+    assert (line, column) == (expected.value.lineno, expected.value.colno)
+
+
+# ==== compute_key_delta ====
+
+def test_key_delta_splits_added_changed_and_removed_keys():
+    base = {'same': {'x': 1}, 'changed': 1, 'removed': True}
+    current = {'same': {'x': 1}, 'changed': 2, 'added': [1]}
+
+    delta = sync.compute_key_delta(base, current)
+
+    assert delta['added'] == ['added']
+    assert delta['changed'] == ['changed']
+    assert delta['removed'] == ['removed']
+    assert delta['set'] == {'changed': 2, 'added': [1]}
+    assert delta['delete'] == ['removed']
+
+
+def test_key_delta_ignores_key_order_inside_values():
+    base = {'a': {'x': 1, 'y': 2}}
+    current = {'a': {'y': 2, 'x': 1}}
+
+    delta = sync.compute_key_delta(base, current)
+
+    assert delta['set'] == {}
+    assert delta['delete'] == []
+
+
+def test_key_delta_treats_true_and_1_as_different():
+    assert sync.compute_key_delta({'a': 1}, {'a': True})['changed'] == ['a']
+
+
+# ==== scan_global_keys ====
+
+def test_scan_global_keys_finds_literal_and_dynamic_keys():
+    source = """
+        const mappings = global.get('sensorMappings.file');
+        const list = global.get("alarmList[0]");
+        const tag = global.get('tag-whitelist_' + name);
+        const room = global.get(`room_${id}`);
+        global.set(`lastSeen`, Date.now());
+        global.set('alarmState', 'armed');
+        // global.get('commentedOut')
+        /* global.set('blockComment', 1) */
+    """
+
+    assert sync.scan_global_keys(source) == {
+        'get': ['alarmList', 'sensorMappings'],
+        'set': ['alarmState', 'lastSeen'],
+        'get_prefixes': ['room_', 'tag-whitelist_'],
+    }
+
+
+def test_scan_global_keys_ignores_non_literal_keys():
+    source = "const key = 'x'; global.get(key); global.set(someKey, 1);"
+
+    assert sync.scan_global_keys(source) == {'get': [], 'set': [], 'get_prefixes': []}
+
+
+# ==== find_history_entry ====
+
+@pytest.fixture
+def history(monkeypatch):
+    entries = [
+        {'id': 1, 'hash': '5555aa' + '0' * 58},
+        {'id': 2, 'hash': 'abcd11' + '0' * 58},
+        {'id': 3, 'hash': 'abcd22' + '0' * 58},
+        {'id': 5555, 'hash': 'ffff00' + '0' * 58},
+    ]
+    monkeypatch.setattr(sync, 'load_history', lambda: entries)
+    return entries
+
+
+def test_find_history_entry_by_id_and_hash_prefix(history):
+    assert sync.find_history_entry('#2') is history[1]
+    assert sync.find_history_entry('2') is history[1]
+    assert sync.find_history_entry('abcd2') is history[2]
+    assert sync.find_history_entry('FFFF') is history[3]
+
+
+def test_find_history_entry_rejects_ambiguous_and_unknown_refs(history):
+    assert sync.find_history_entry('abcd') is None      # two hash prefixes
+    assert sync.find_history_entry('5555') is None      # ID 5555 and a hash prefix
+    assert sync.find_history_entry('#5555') is history[3]
+    assert sync.find_history_entry('5555a') is history[0]
+    assert sync.find_history_entry('#9') is None
+    assert sync.find_history_entry('abc') is None       # hash prefixes need 4 characters
+
+
+# ==== plan_script_sync ====
+
+def test_plan_script_sync_compares_manifests(monkeypatch):
+    monkeypatch.setattr(sync, 'scripts_patterns', ['*.js'])
+    local = {'a.js': 'h1', 'b.js': 'h2', 'c.js': 'h3'}
+    remote = {'b.js': 'h2', 'c.js': 'old', 'gone.js': 'h4', 'notes.txt': 'h5'}
+
+    plan = sync.plan_script_sync(local, remote)
+
+    assert plan['added'] == ['a.js']
+    assert plan['changed'] == ['c.js']
+    # Remote files outside SCRIPTS_PATTERNS are never deleted
+    assert plan['removed'] == ['gone.js']
+    assert plan['unchanged'] == 1
+    assert plan['manifest'] == sync.manifest_digest(local)
+
+
+def test_plan_script_sync_manifest_digest_ignores_order():
+    first = sync.plan_script_sync({'a.js': 'h1', 'b.js': 'h2'}, {})
+    second = sync.plan_script_sync({'b.js': 'h2', 'a.js': 'h1'}, {})
+
+    assert first['manifest'] == second['manifest']
+
+
+# ==== split_top_level_members ====
+
+@pytest.mark.parametrize("raw", [
+    b'{\n    "a": [1, {"b": "}"}],\n    "c\\"": "x"\n}\n',
+    b'{"\xc3\xa9": 1}',
+    b'{}',
+    b'[1, 2]',
+    b'{"a": 1,}',
+    b'\xff{',
+])
+def test_split_top_level_members_joins_back_exactly(raw):
+    assert b"".join(sync.split_top_level_members(raw)) == raw
+
+
+def test_split_top_level_members_gives_one_chunk_per_key():
+    raw = json.dumps({'a': 1, 'b': {'c': 2}, 'd': 'x'}, indent=4).encode('utf-8')
+    edited = json.dumps({'a': 1, 'b': {'c': 3}, 'd': 'x'}, indent=4).encode('utf-8')
+
+    chunks = sync.split_top_level_members(raw)
+    edited_chunks = sync.split_top_level_members(edited)
+
+    assert len(chunks) == 3
+    assert [old == new for old, new in zip(chunks, edited_chunks)] == [True, False, True]
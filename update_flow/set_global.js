@@ -1,8 +1,121 @@
-if (typeof msg.payload === "object" && msg.payload !== null && !Array.isArray(msg.payload)) {
-    for (var key in msg.payload) {
-        global.set(key, msg.payload[key], 'file');
+var payload = msg.payload;
+
+// Bookkeeping for sync_global_json.py (applied version, synced key list, scripts
+// manifest) lives outside the file store: the 'file' store is the synced
+// global.json itself, and writing these keys there would change the remote
+// file after every push. Needs a 'memory' store in settings.js contextStorage.
+var SYNC_STATE_STORE = 'memory';
+
+if (payload && payload.action === 'confirm_global_context') {
+    // Apply confirmation from sync_global_json.py: report the version currently live
+    msg.payload = {
+        status: 'ok',
+        version: global.get('globalContextVersion', SYNC_STATE_STORE) || null
+    };
+} else if (payload && payload.action === 'update_global_context') {
+    // Full push from sync_global_json.py: the whole document replaces the synced keys
+    if (typeof payload.data !== "object" || payload.data === null || Array.isArray(payload.data)) {
+        node.warn('update_global_context without a JSON object in data - nothing applied');
+        // Report the version that is actually live so the sync tool does not count this as applied
+        msg.payload = {
+            status: 'error',
+            error: 'data must be a JSON object',
+            version: global.get('globalContextVersion', SYNC_STATE_STORE) || null
+        };
+        return msg;
     }
-    node.warn('Set global keys from payload: ' + Object.keys(msg.payload).join(', '));
+
+    var previousKeys = global.get('globalContextKeys', SYNC_STATE_STORE) || [];
+    var removedKeys = previousKeys.filter(function (previousKey) {
+        return !Object.prototype.hasOwnProperty.call(payload.data, previousKey);
+    });
+    removedKeys.forEach(function (removedKey) {
+        global.set(removedKey, undefined, 'file');
+    });
+    for (var dataKey in payload.data) {
+        global.set(dataKey, payload.data[dataKey], 'file');
+    }
+    global.set('globalContextKeys', Object.keys(payload.data), SYNC_STATE_STORE);
+    global.set('globalContextVersion', payload.version || null, SYNC_STATE_STORE);
+    node.warn('Applied global context - ' + Object.keys(payload.data).length + ' key(s) set; removed: ' +
+        (removedKeys.join(', ') || 'none'));
+
+    // Echo the version only now that every key has been applied
+    msg.payload = {
+        status: 'applied',
+        version: payload.version || null,
+        set: Object.keys(payload.data),
+        deleted: removedKeys
+    };
+} else if (payload && payload.action === 'apply_global_delta') {
+    // Key-level delta from sync_global_json.py: only touch the keys that changed
+    var setKeys = (typeof payload.set === "object" && payload.set !== null) ? payload.set : {};
+    var deleteKeys = Array.isArray(payload.delete) ? payload.delete : [];
+
+    for (var key in setKeys) {
+        global.set(key, setKeys[key], 'file');
+    }
+    deleteKeys.forEach(function (deleteKey) {
+        global.set(deleteKey, undefined, 'file');
+    });
+    // Keep the list of synced keys current so the next full push knows what to remove
+    var syncedKeys = (global.get('globalContextKeys', SYNC_STATE_STORE) || []).filter(function (syncedKey) {
+        return deleteKeys.indexOf(syncedKey) === -1;
+    });
+    Object.keys(setKeys).forEach(function (setKey) {
+        if (syncedKeys.indexOf(setKey) === -1) {
+            syncedKeys.push(setKey);
+        }
+    });
+    global.set('globalContextKeys', syncedKeys, SYNC_STATE_STORE);
+    if (payload.version) {
+        global.set('globalContextVersion', payload.version, SYNC_STATE_STORE);
+    }
+    node.warn('Applied global delta - set: ' + (Object.keys(setKeys).join(', ') || 'none') +
+        '; deleted: ' + (deleteKeys.join(', ') || 'none'));
+
+    // Keys the function nodes read but the pushed file lacks (from the sync tool's key index)
+    var missingKeys = (payload.keys && Array.isArray(payload.keys.missing)) ? payload.keys.missing : [];
+    if (missingKeys.length) {
+        node.warn('Global keys read by function nodes but missing: ' + missingKeys.join(', '));
+    }
+
+    // Echo the applied version so the sync tool can confirm the push
+    msg.payload = {
+        status: 'applied',
+        version: payload.version || null,
+        set: Object.keys(setKeys),
+        deleted: deleteKeys
+    };
+} else if (payload && payload.action === 'scripts_synced') {
+    // Batch script sync from sync_global_json.py: one notification for every copied/deleted file.
+    // Function-node code lives in flows.json, so this changes no deployed node; it records which
+    // script versions are now on disk (scriptsManifest) for auditing and for flows that load them.
+    var files = Array.isArray(payload.files) ? payload.files : [];
+    var deleted = Array.isArray(payload.deleted) ? payload.deleted : [];
+
+    global.set('scriptsManifest', payload.manifest || null, SYNC_STATE_STORE);
+    node.warn('Function-node scripts on disk updated - copied: ' + (files.join(', ') || 'none') +
+        '; deleted: ' + (deleted.join(', ') || 'none'));
+
+    msg.payload = {
+        status: 'recorded',
+        manifest: payload.manifest || null,
+        files: files,
+        deleted: deleted
+    };
+} else if (payload && payload.action) {
+    node.warn('Unknown action "' + payload.action + '" - nothing applied');
+    msg.payload = {
+        status: 'error',
+        error: 'unknown action',
+        version: global.get('globalContextVersion', SYNC_STATE_STORE) || null
+    };
+} else if (typeof payload === "object" && payload !== null && !Array.isArray(payload)) {
+    for (var key in payload) {
+        global.set(key, payload[key], 'file');
+    }
+    node.warn('Set global keys from payload: ' + Object.keys(payload).join(', '));
 } else {
     node.warn('payload is not an object! Not updating globals.');
 }